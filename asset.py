@@ -1,3 +1,19 @@
+def function_from_shop_code(shop_code):
+    """
+    Determines asset function (clinical, renal, imaging) from a shop code.
+
+    :param shop_code: Shop code
+    :return: String denoting the function
+    """
+
+    if shop_code == "IMAG" or shop_code == "IMAG0" or shop_code == "IMAG1":
+        return "imaging"
+    elif shop_code == "REN" or shop_code == "FHA_R":
+        return "renal"
+    else:
+        return "clinical"
+
+
 class Asset:
 
     """
@@ -27,6 +43,10 @@ class Asset:
         self.function = self.assign_function()   # Function (clinical, renal, imaging)
         self.cost_centre = self.assign_temp_cost_centre(sites_cc_dict).strip()   # Cost centre
         self.avg_support_hours = 0   # Number of work order hours per year
+        self.support_hours_match = None   # Reference entry that avg_support_hours was taken from
+        self.service_contract_cost = 0   # Annual service contract cost (imaging assets only)
+        self.service_contract_match = None   # Catalogue level that service_contract_cost was taken from
+        self.source_lines = None   # (input row, qty) of each input line collapsed into this asset
 
     def assign_function(self):
         """
@@ -35,12 +55,7 @@ class Asset:
         :return: String denoting the asset's function
         """
 
-        if self.shop_code == "IMAG" or self.shop_code == "IMAG0" or self.shop_code == "IMAG1":
-            return "imaging"
-        elif self.shop_code == "REN" or self.shop_code == "FHA_R":
-            return "renal"
-        else:
-            return "clinical"
+        return function_from_shop_code(self.shop_code)
 
     def assign_temp_cost_centre(self, sites_cc_dict):
         """
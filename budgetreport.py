@@ -1,12 +1,21 @@
 import pandas as pd
 import xlsxwriter
 import os
+import hashlib
 from asset import Asset
 from costcentre import CostCentre
 from regionalstaff import RegionalStaff
+from descriptionindex import DescriptionIndex
+from fixedpoint import CENTS_PER_DOLLAR, SCALE, scalar_round_divide, scalar_to_fixed
+from modelinputs import read_table
+from rollups import compute_rollups, list_rollup_tables
+from servicecontracts import read_service_contract_catalogue, resolve_service_contract_costs
 
 pd.set_option("display.expand_frame_repr", False)
 
+# Rows in an Excel worksheet
+EXCEL_MAX_ROWS = 1048576
+
 
 """
 ########################################################################################################################
@@ -27,12 +36,12 @@ def read_sites_cost_centres_reference():
     sites_cc_file_path = "model_inputs/cost_centres_and_sites/cost_centres_and_sites_reference.xlsx"
 
     # Read into df the "site", "clinical_cost_centre", "renal_cost_centre", "imaging_cost_centre" fields
-    sites_cc_df = pd.read_excel(sites_cc_file_path,
-                                sheet_name="Sites",
-                                usecols=["site_code",
-                                         "clinical_cost_centre",
-                                         "renal_cost_centre",
-                                         "imaging_cost_centre"])
+    sites_cc_df = read_table(sites_cc_file_path,
+                             sheet_name="Sites",
+                             usecols=["site_code",
+                                      "clinical_cost_centre",
+                                      "renal_cost_centre",
+                                      "imaging_cost_centre"])
 
     # Convert dataframe into dictionary
     sites_cc_dict = sites_cc_df.set_index("site_code").T.to_dict("list")
@@ -56,11 +65,11 @@ def read_cc_responsibility_reference():
     sites_cc_file_path = "model_inputs/cost_centres_and_sites/cost_centres_and_sites_reference.xlsx"
 
     # Read into df the "cost_centre_name", "health_authority", "function" fields
-    cc_responsibility_df = pd.read_excel(sites_cc_file_path,
-                                         sheet_name="Cost Centres",
-                                         usecols=["cost_centre_name",
-                                                  "health_authority",
-                                                  "function"])
+    cc_responsibility_df = read_table(sites_cc_file_path,
+                                      sheet_name="Cost Centres",
+                                      usecols=["cost_centre_name",
+                                               "health_authority",
+                                               "function"])
 
     # Get unique HA and function values from cc_responsibility_df and store in numpy array
     health_auth = cc_responsibility_df["health_authority"].unique()
@@ -83,6 +92,186 @@ def read_cc_responsibility_reference():
     return cc_responsibility_dict
 
 
+def read_asset_support_hours_reference():
+    """
+    Reads asset_support_hours_reference.xlsx, which gives the average annual work order hours spent on each model.
+
+    :return: DataFrame with columns "asset_description", "model_number", "avg_support_hour_per_model", "count_asset"
+    """
+
+    # File path to asset_support_hours_reference.xlsx
+    asset_support_hours_file_path = "model_inputs/wo_reports/asset_support_hours_reference.xlsx"
+    # Read data into df and index the relevant columns
+    asset_support_hours_df = read_table(asset_support_hours_file_path,
+                                        usecols=["asset_description",
+                                                 "model_number",
+                                                 "avg_support_hour_per_model",
+                                                 "count_asset"])
+    asset_support_hours_df = asset_support_hours_df[["asset_description",
+                                                     "model_number",
+                                                     "avg_support_hour_per_model",
+                                                     "count_asset"]]
+
+    return asset_support_hours_df
+
+
+def as_float(value):
+    """
+    Converts a model value to a float; some CostCentre values are single-element Series because they are computed from
+    "General Summary" columns in tech_labour_hours.xlsx.
+
+    :param value: Float or single-element Series
+    :return: Float
+    """
+
+    if isinstance(value, pd.Series):
+        return float(value.iloc[0])
+
+    return float(value)
+
+
+def compute_file_hash(file_path):
+    """
+    Computes the SHA-256 hash of a file.
+
+    :param file_path: Path to the file
+    :return: Hex digest
+    """
+
+    with open(file_path, "rb") as input_file:
+        return hashlib.sha256(input_file.read()).hexdigest()
+
+
+def collapse_duplicate_lines(df, input_rows=None):
+    """
+    Collapses input lines with the same model number, asset description, HA, site and shop (ignoring surrounding white
+    space) into one line with their summed quantity, so that each distinct asset is resolved and costed once. Collapsed
+    lines keep the position of the first line of their group.
+
+    :param df: DataFrame laid out like the "User Input" sheet of budget_report_input.xlsx
+    :param input_rows: Row number of each of df's lines in the "User Input" sheet; defaults to df's own row order
+    :return: Tuple (collapsed_df, source_lines), where source_lines has one entry per row of collapsed_df: a list of
+             (row number in the "User Input" sheet, quantity) tuples for the input lines that were collapsed into it
+    """
+
+    key_columns = ["model_num", "asset_description", "health_auth", "site_code", "shop_code"]
+
+    # Compare text keys without surrounding white space, as Asset does
+    keys_df = df[key_columns].astype(str)
+    for column in key_columns:
+        keys_df[column] = keys_df[column].str.strip()
+
+    line_groups = keys_df.groupby(key_columns, sort=False).ngroup().to_numpy()
+
+    # Row 1 of the "User Input" sheet holds the headers
+    if input_rows is None:
+        input_rows = range(2, len(df) + 2)
+
+    input_lines = pd.Series(list(zip(input_rows, df["quantity"].tolist())))
+    source_lines = input_lines.groupby(line_groups, sort=True).agg(list).tolist()
+
+    collapsed_df = df.groupby(line_groups, sort=True).agg({column: "first" for column in df.columns})
+    collapsed_df["quantity"] = df["quantity"].groupby(line_groups, sort=True).sum()
+
+    return collapsed_df.reset_index(drop=True), source_lines
+
+
+def write_dynamic_array_column(worksheet, first_row, col, formula, values, cell_format):
+    """
+    Writes a dynamic array formula that spills down a column, with values as its cached results so that the workbook
+    reads correctly without being recalculated.
+
+    :param worksheet: xlsxwriter worksheet
+    :param first_row: Zero-based row of the formula cell
+    :param col: Zero-based column
+    :param formula: Dynamic array formula, e.g. "=B10*G17:G40"
+    :param values: Result of the formula for each row it spills over
+    :param cell_format: Formatting variable
+    :return: None
+    """
+
+    worksheet.write_dynamic_array_formula(first_row, col, first_row + len(values) - 1, col, formula, cell_format,
+                                          values[0])
+    worksheet.write_column(first_row + 1, col, values[1:], cell_format)
+
+
+def write_long_format_tables(tables, file_path, max_rows_per_sheet=EXCEL_MAX_ROWS - 1, max_sheets_per_file=4):
+    """
+    Writes tables as Excel tables with autofilter. A table longer than max_rows_per_sheet continues on further
+    worksheets ("Assets", "Assets 2", ...), and once a workbook has max_sheets_per_file worksheets, writing continues in
+    a new workbook next to file_path (budget_report_output_2.xlsx, ...).
+
+    :param tables: List of (sheet name, columns, rows) tuples, where columns is a list of (header, key, number format
+                   or None) tuples and rows is a list of dicts with those keys
+    :param file_path: Path of the first workbook
+    :param max_rows_per_sheet: Maximum number of data rows on one worksheet, below its header row
+    :param max_sheets_per_file: Maximum number of worksheets in one workbook
+    :return: List of paths of the workbooks written
+    """
+
+    file_paths = [file_path]
+    workbook = xlsxwriter.Workbook(file_path)
+    formats = {}
+    num_sheets = 0
+
+    for sheet_name, columns, rows in tables:
+        for part, start in enumerate(range(0, max(len(rows), 1), max_rows_per_sheet), start=1):
+            # Continue in a new workbook once the current one is full
+            if num_sheets == max_sheets_per_file:
+                workbook.close()
+                file_paths.append("{root}_{number}{ext}".format(root=os.path.splitext(file_path)[0],
+                                                                number=len(file_paths) + 1,
+                                                                ext=os.path.splitext(file_path)[1]))
+                workbook = xlsxwriter.Workbook(file_paths[-1])
+                formats = {}
+                num_sheets = 0
+
+            for header, key, num_format in columns:
+                if num_format is not None and num_format not in formats:
+                    formats[num_format] = workbook.add_format({"num_format": num_format})
+
+            name = sheet_name if part == 1 else "{name} {part}".format(name=sheet_name, part=part)
+            worksheet = workbook.add_worksheet(name)
+            num_sheets += 1
+
+            part_rows = rows[start:start + max_rows_per_sheet]
+            worksheet.add_table(0, 0, max(len(part_rows), 1), len(columns) - 1,
+                                {"name": name.replace(" ", "_"),
+                                 "autofilter": True,
+                                 "data": [[row[key] for header, key, num_format in columns] for row in part_rows],
+                                 "columns": [{"header": header, "format": formats.get(num_format)}
+                                             for header, key, num_format in columns]})
+            worksheet.set_column(0, len(columns) - 1, 18)
+            worksheet.freeze_panes(1, 0)
+
+    workbook.close()
+
+    return file_paths
+
+
+def compute_input_hashes(input_folder_path="model_inputs"):
+    """
+    Computes a SHA-256 hash of every input file so that results can be traced back to the exact inputs that produced
+    them. Excel lock files (~$...) are skipped.
+
+    :param input_folder_path: Folder containing the model inputs
+    :return: Dict with key: file path relative to input_folder_path and value: hex digest
+    """
+
+    input_hashes = {}
+
+    for dir_path, dir_names, file_names in os.walk(input_folder_path):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            if file_name.startswith("~$"):
+                continue
+            file_path = os.path.join(dir_path, file_name)
+            input_hashes[os.path.relpath(file_path, input_folder_path).replace(os.sep, "/")] = compute_file_hash(
+                file_path)
+
+    return input_hashes
+
+
 """
 ########################################################################################################################
 ######################################## BUDGETREPORT CLASS BELOW ######################################################
@@ -102,6 +291,11 @@ class BudgetReport:
     sites_cost_centre_dict = read_sites_cost_centres_reference()
     # Nested dict with HA, asset function, and their corresponding cost centres
     cost_centre_responsibility_dict = read_cc_responsibility_reference()
+    # Compiled reference store (see referencestore.py) to look up asset support hours in; if None, they are looked up in
+    # the table returned by read_asset_support_hours_reference()
+    reference_store = None
+    # Date service contracts must cover to be costed (see servicecontracts.py); if None, today
+    service_contract_date = None
 
     def __init__(self):
         """
@@ -110,19 +304,52 @@ class BudgetReport:
 
         # Dictionary with key: "cost centre name" and value: CostCentre object
         self.cost_centres = {}
-        # Current row to which we are writing in the "Summary" worksheet in budget_report_output.xlsx
-        self.summary_row = 2
-
-    def create_asset_objects(self):
+        # (cost centre name, net cost to service) of each cost centre written to budget_report_output.xlsx, for the
+        # "Summary" worksheet
+        self.summary_totals = []
+        # Whether to write one output row per input line instead of one per collapsed asset
+        self.expand_lines = False
+        # Whether to write each computed asset column as one dynamic array formula instead of one formula per row
+        self.array_formulas = False
+        # Whether to write computed results as plain values instead of formulas
+        self.values_only = False
+        # Whether per-asset costs are exact cents, rounded at fixedpoint.py's rounding points 10 and 11, and every cost
+        # formula is rounded to the cent to match (set by fixedpoint.apply_fixed_point_engine())
+        self.fixed_point = False
+        # Whether to write rollups by health authority, function, site and shop (see rollups.py) after the "Summary"
+        # worksheet
+        self.rollups = False
+        # Whether to write only the "Summary" worksheet, with each cost centre's total as a value, instead of a
+        # worksheet per cost centre
+        self.summary_only = False
+        # Fuzzy index over reference model numbers and descriptions (see descriptionindex.py); only built once an asset
+        # needs it, then kept for later calls of compute_asset_support_hours()
+        self.description_index = None
+
+    def create_asset_objects(self, df=None, collapse_duplicates=True, input_rows=None):
         """
         Pulls asset details inputted by user into budget_report_input.xlsx and creates an Asset object for each row of
-        asset details entered.
+        asset details entered. Identical lines are collapsed into one Asset with their summed quantity (see
+        collapse_duplicate_lines()); each Asset's source_lines maps it back to the input lines it came from.
 
+        :param df: Optional DataFrame laid out like the "User Input" sheet to use instead of budget_report_input.xlsx
+        :param collapse_duplicates: Whether to collapse identical lines; if False, each line becomes its own Asset
+        :param input_rows: Row number of each of df's lines in the "User Input" sheet; defaults to df's own row order
         :return: List of Asset objects that correspond to input entered by user into budget_report_input.xlsx
         """
 
         # Read asset details into dataframe
-        df = pd.read_excel(self.budget_report_input_file_path, sheet_name="User Input")
+        if df is None:
+            df = read_table(self.budget_report_input_file_path, sheet_name="User Input")
+
+        if input_rows is None:
+            input_rows = range(2, len(df) + 2)
+
+        if collapse_duplicates:
+            df, source_lines = collapse_duplicate_lines(df, input_rows)
+        else:
+            df = df.reset_index(drop=True)
+            source_lines = [[(row, qty)] for row, qty in zip(input_rows, df["quantity"].tolist())]
 
         # Convert dataframe into dictionary
         #   Key: "df index"
@@ -140,6 +367,7 @@ class BudgetReport:
                                 details[4],  # site_code
                                 details[5],  # shop_code
                                 self.sites_cost_centre_dict))
+            assets[-1].source_lines = source_lines[asset]
 
         return assets
 
@@ -170,11 +398,28 @@ class BudgetReport:
             else:
                 self.cost_centres[asset.cost_centre] = CostCentre(asset, budget_report)
 
-            # Get the most recently inserted key into cost_centres dictionary (i.e. a cost centre string)
-            last_key_inserted = list(self.cost_centres.keys())[-1]
+            # Fulfill cost centre-asset bidirectional relationship by assigning the asset's CostCentre object to it
+            asset.assign_permanent_cost_centre(self.cost_centres.get(asset.cost_centre))
 
-            # Fulfill cost centre-asset bidirectional relationship by assigning a CostCentre object to the asset
-            asset.assign_permanent_cost_centre(self.cost_centres.get(last_key_inserted))
+    def select_cost_centres(self, cost_centre_names=None, health_auth=None, function=None):
+        """
+        Lists the cost centres in the "Cost Centres" sheet of cost_centres_and_sites_reference.xlsx that match every
+        given criterion.
+
+        :param cost_centre_names: Cost centre names to choose from; None for any
+        :param health_auth: Health authority the cost centres fall under; None for any
+        :param function: Function the cost centres are responsible for (clinical, renal, imaging); None for any
+        :return: Set of cost centre names
+        """
+
+        selected = set()
+
+        for ha, functions in self.cost_centre_responsibility_dict.items():
+            for func, names in functions.items():
+                if health_auth in (None, ha) and function in (None, func):
+                    selected.update(name for name in names if cost_centre_names is None or name in cost_centre_names)
+
+        return selected
 
     def create_regional_staff_objects(self):
         """
@@ -188,7 +433,7 @@ class BudgetReport:
         regional_staff_salaries_file_path = "model_inputs/labour_reports/staff_salaries.xlsx"
 
         # Read regional staff data into dataframe
-        regional_staff_df = pd.read_excel(regional_staff_salaries_file_path, sheet_name="Regional Staff")
+        regional_staff_df = read_table(regional_staff_salaries_file_path, sheet_name="Regional Staff")
 
         # Convert dataframe into dictionary with key: "name", and values: ["all other fields"]
         regional_staff_dict = regional_staff_df.set_index("name").T.to_dict("list")
@@ -208,102 +453,508 @@ class BudgetReport:
 
         return regional_staff
 
-    def compute_asset_support_hours(self):
+    def compute_asset_support_hours(self, asset_support_hours_df=None, assets=None):
         """
         Iterates through each asset inputted by the user and reads from "asset_support_hours_reference.xlsx" the average
         work order hours spent on each model of an asset and stores this float in the asset's avg_support_hours field.
 
+        :param asset_support_hours_df: Optional table returned by read_asset_support_hours_reference(), to avoid reading
+                                       it again when called once per cost centre; not needed if reference_store is set
+        :param assets: Asset objects to resolve; defaults to every asset of every cost centre in cost_centres
         :return: None
         """
 
-        # File path to asset_support_hours_reference.xlsx
-        asset_support_hours_file_path = "model_inputs/wo_reports/asset_support_hours_reference.xlsx"
-        # Read data into df and index the relevant columns
-        asset_support_hours_df = pd.read_excel(asset_support_hours_file_path)
-        asset_support_hours_df = asset_support_hours_df[["asset_description",
-                                                         "model_number",
-                                                         "avg_support_hour_per_model",
-                                                         "count_asset"]]
+        if asset_support_hours_df is None and self.reference_store is None:
+            asset_support_hours_df = read_asset_support_hours_reference()
+
+        if assets is None:
+            assets = [asset for cost_centre in self.cost_centres.values() for asset in cost_centre.assets]
 
         # Loop through all the assets that were inputted by the user
+        for asset in assets:
+            # Filter asset_support_hours_df with rows that only contain model # of current asset
+            filtered_model_df = self.find_asset_support_hours("model_number", asset.model_num,
+                                                              asset_support_hours_df)
+
+            # If model number exists in the df, compute average support hours for current model
+            if not filtered_model_df.empty:
+                asset.avg_support_hours = filtered_model_df["avg_support_hour_per_model"].mean()
+                asset.support_hours_match = "model number"
+
+            # If model number doesn't exist in df, compute weighted average support hours for current asset
+            else:
+                # Create df with rows that only contain the asset_description of current asset
+                filtered_asset_df = self.find_asset_support_hours("asset_description", asset.name,
+                                                                  asset_support_hours_df)
+                # Group df by model number and summarize by average support hour and count of that model
+                asset_model_num_df = filtered_asset_df.set_index("model_number").groupby("model_number").agg(
+                    {"avg_support_hour_per_model": "mean", "count_asset": "sum"})
+                # Product portion of weighted average computation
+                asset_model_num_df["weight"] = asset_model_num_df["avg_support_hour_per_model"] * (
+                            asset_model_num_df["count_asset"] / asset_model_num_df["count_asset"].sum())
+                # Compute weighted average support hours for current asset
+                asset.avg_support_hours = asset_model_num_df["weight"].sum()
+                asset.support_hours_match = "asset description"
+
+                # If the description doesn't match exactly either, estimate support hours from the most similar
+                # reference model numbers or descriptions
+                if asset_model_num_df.empty:
+                    if self.description_index is None:
+                        if asset_support_hours_df is None:
+                            asset_support_hours_df = self.reference_store.read_asset_support_hours()
+                        self.description_index = DescriptionIndex(asset_support_hours_df)
+                    estimate = self.description_index.estimate_support_hours(asset.model_num, asset.name)
+                    asset.avg_support_hours, asset.support_hours_match = estimate
+
+    def compute_service_contract_costs(self, service_contracts_df=None, assets=None):
+        """
+        Looks up the annual service contract cost of each asset of an imaging cost centre in the service contract
+        catalogue (see servicecontracts.py) and stores it in the asset's service_contract_cost field. Every asset is
+        resolved with one join per catalogue level rather than a search per asset.
+
+        :param service_contracts_df: Optional table returned by servicecontracts.read_service_contract_catalogue(), to
+                                     avoid reading it again when called once per cost centre
+        :param assets: Asset objects to resolve; defaults to every asset of every cost centre in cost_centres
+        :return: None
+        """
+
+        if service_contracts_df is None:
+            service_contracts_df = read_service_contract_catalogue()
+
+        if assets is None:
+            assets = [asset for cost_centre in self.cost_centres.values() for asset in cost_centre.assets]
+
+        # Only imaging worksheets have a service contract column
+        assets = [asset for asset in assets if asset.cost_centre.function == "imaging"]
+
+        assets_df = pd.DataFrame({"model_number": [asset.model_num for asset in assets],
+                                  "health_auth": [asset.health_auth for asset in assets],
+                                  "site_code": [asset.site_code for asset in assets]})
+        costs, matches = resolve_service_contract_costs(assets_df, service_contracts_df, self.service_contract_date)
+
+        for asset, cost, match in zip(assets, costs.tolist(), matches):
+            asset.service_contract_cost = cost
+            asset.service_contract_match = match
+
+    def find_asset_support_hours(self, column, value, asset_support_hours_df):
+        """
+        Pulls the asset support hours reference rows with a given model number or asset description, with an indexed
+        query if a reference store is in use and by filtering asset_support_hours_df otherwise.
+
+        :param column: "model_number" or "asset_description"
+        :param value: Value to match exactly
+        :param asset_support_hours_df: Table returned by read_asset_support_hours_reference(); ignored if
+                                       reference_store is set
+        :return: DataFrame with the matching rows
+        """
+
+        if self.reference_store is not None:
+            return self.reference_store.find_asset_support_hours(column, value)
+
+        return asset_support_hours_df[asset_support_hours_df[column] == value]
+
+    def output_lines(self, cost_centre):
+        """
+        Lists the asset rows to write to a cost centre's worksheet: one per Asset, or one per input line if expand_lines
+        is set.
+
+        :param cost_centre: CostCentre object for which we are writing output
+        :return: List of (Asset object, quantity, row numbers of the asset's lines in the "User Input" sheet) tuples
+        """
+
+        lines = []
+
+        for asset in cost_centre.assets:
+            source_lines = asset.source_lines or []
+            if self.expand_lines and source_lines:
+                lines.extend((asset, qty, str(row)) for row, qty in source_lines)
+            else:
+                lines.append((asset, asset.qty, ", ".join(str(row) for row, qty in source_lines)))
+
+        return lines
+
+    def compute_asset_costs(self, cost_centre, asset, qty):
+        """
+        Computes an asset row's costs with the same arithmetic as the formulas written to budget_report_output.xlsx.
+
+        :param cost_centre: CostCentre object the asset belongs to
+        :param asset: Asset object
+        :param qty: Quantity of the row
+        :return: Dict with keys "oh_cost_per_asset", "direct_cost_per_asset", "service_contract_cost_per_asset",
+                 "cost_to_service_per_asset", "total_cost_to_service"
+        """
+
+        # In fixed-point mode, the same cents as fixedpoint.compute_asset_costs_cents() for the exact rates on the
+        # CostCentre object, so the workbook agrees with the results stored in the warehouse
+        if self.fixed_point:
+            support_hours = scalar_to_fixed(asset.avg_support_hours, SCALE)
+            # Rounding point 10
+            oh_cost = scalar_round_divide(scalar_to_fixed(cost_centre.pohr, CENTS_PER_DOLLAR) * support_hours, SCALE)
+            direct_cost = scalar_round_divide(
+                scalar_to_fixed(cost_centre.weighted_avg_tech_hourly_wage, CENTS_PER_DOLLAR) * support_hours, SCALE)
+            service_contract_cost = scalar_to_fixed(asset.service_contract_cost, CENTS_PER_DOLLAR)
+            cost_to_service = oh_cost + direct_cost + service_contract_cost
+            # Rounding point 11
+            total_cost_to_service = scalar_round_divide(cost_to_service * scalar_to_fixed(qty, SCALE), SCALE)
+
+            return {"oh_cost_per_asset": oh_cost / CENTS_PER_DOLLAR,
+                    "direct_cost_per_asset": direct_cost / CENTS_PER_DOLLAR,
+                    "service_contract_cost_per_asset": service_contract_cost / CENTS_PER_DOLLAR,
+                    "cost_to_service_per_asset": cost_to_service / CENTS_PER_DOLLAR,
+                    "total_cost_to_service": total_cost_to_service / CENTS_PER_DOLLAR}
+
+        oh_cost = as_float(cost_centre.pohr) * asset.avg_support_hours
+        direct_cost = as_float(cost_centre.weighted_avg_tech_hourly_wage) * asset.avg_support_hours
+        service_contract_cost = asset.service_contract_cost
+        cost_to_service = oh_cost + direct_cost + service_contract_cost
+
+        return {"oh_cost_per_asset": oh_cost,
+                "direct_cost_per_asset": direct_cost,
+                "service_contract_cost_per_asset": service_contract_cost,
+                "cost_to_service_per_asset": cost_to_service,
+                "total_cost_to_service": cost_to_service * qty}
+
+    def compute_cost_centre_total(self, cost_centre):
+        """
+        Computes a cost centre's net cost to service as written to cell B14 of its worksheet, without writing the
+        worksheet.
+
+        :param cost_centre: CostCentre object
+        :return: Net cost to service
+        """
+
+        return self.sum_costs(self.compute_asset_costs(cost_centre, asset, qty)["total_cost_to_service"]
+                              for asset, qty, input_rows in self.output_lines(cost_centre))
+
+    def sum_costs(self, costs):
+        """
+        Adds up costs into a cost centre or "Summary" total. In fixed-point mode, the costs are whole cents and the sum
+        is rounded to the cent, dropping the float error of adding them up in dollars.
+
+        :param costs: Iterable of costs in dollars
+        :return: Sum of the costs
+        """
+
+        total = sum(costs)
+
+        return round(total, 2) if self.fixed_point else total
+
+    def cost_formula(self, formula):
+        """
+        Rounds a cost formula to the cent in fixed-point mode, so that Excel recomputes the same whole cents as
+        compute_asset_costs() and sum_costs().
+
+        :param formula: Formula string, with or without the leading "="
+        :return: Formula string
+        """
+
+        if self.fixed_point:
+            return "=ROUND({formula},2)".format(formula=formula.lstrip("="))
+
+        return formula
+
+    def support_hours_value(self, asset):
+        """
+        Annual support hours per asset as written to the "Annual Support Hours per Asset" column. In fixed-point mode,
+        they are rounded to the millionths fixedpoint.py computes with, so the cost formulas recompute its cents.
+
+        :param asset: Asset object
+        :return: Support hours
+        """
+
+        if self.fixed_point:
+            return scalar_to_fixed(asset.avg_support_hours, SCALE) / SCALE
+
+        return asset.avg_support_hours
+
+    def build_results_tables(self):
+        """
+        Collects the per-cost centre rates and OH components and the per-asset costs into two DataFrames. Per-asset
+        costs use the same arithmetic as the formulas written to budget_report_output.xlsx.
+
+        :return: Tuple (cost_centre_results, asset_results) of DataFrames
+        """
+
+        cost_centre_rows = []
+        asset_rows = []
+
         for key in self.cost_centres:
             cost_centre = self.cost_centres.get(key)
-            asset_objects = cost_centre.assets
-            for asset in asset_objects:
-                # Filter asset_support_hours_df with rows that only contain model # of current asset
-                filtered_model_df = asset_support_hours_df[asset_support_hours_df["model_number"] == asset.model_num]
-
-                # If model number exists in the df, compute average support hours for current model
-                if not filtered_model_df.empty:
-                    asset.avg_support_hours = filtered_model_df["avg_support_hour_per_model"].mean()
-
-                # If model number doesn't exist in df, compute weighted average support hours for current asset
-                else:
-                    # Create df with rows that only contain the asset_description of current asset
-                    filtered_asset_df = asset_support_hours_df[asset_support_hours_df["asset_description"] == asset.name]
-                    # Group df by model number and summarize by average support hour and count of that model
-                    asset_model_num_df = filtered_asset_df.set_index("model_number").groupby("model_number").agg(
-                        {"avg_support_hour_per_model": "mean", "count_asset": "sum"})
-                    # Product portion of weighted average computation
-                    asset_model_num_df["weight"] = asset_model_num_df["avg_support_hour_per_model"] * (
-                                asset_model_num_df["count_asset"] / asset_model_num_df["count_asset"].sum())
-                    # Compute weighted average support hours for current asset
-                    asset.avg_support_hours = asset_model_num_df["weight"].sum()
+            pohr = as_float(cost_centre.pohr)
+            tech_hourly_wage = as_float(cost_centre.weighted_avg_tech_hourly_wage)
+            asset_totals = []
+            cost_centre_support_hours = 0
+
+            for asset in cost_centre.assets:
+                costs = self.compute_asset_costs(cost_centre, asset, asset.qty)
+
+                asset_rows.append({"cost_centre_name": cost_centre.name,
+                                   "health_auth": asset.health_auth,
+                                   "function": asset.function,
+                                   "shop_code": asset.shop_code,
+                                   "site_code": asset.site_code,
+                                   "model_num": str(asset.model_num),
+                                   "asset_description": asset.name,
+                                   "qty": asset.qty,
+                                   "avg_support_hours": asset.avg_support_hours,
+                                   "support_hours_match": asset.support_hours_match,
+                                   "service_contract_match": asset.service_contract_match,
+                                   **costs})
+
+                asset_totals.append(costs["total_cost_to_service"])
+                cost_centre_support_hours += asset.avg_support_hours * asset.qty
+
+            cost_centre_rows.append({"cost_centre_name": cost_centre.name,
+                                     "health_auth": cost_centre.health_auth,
+                                     "function": cost_centre.function,
+                                     "num_assets": len(cost_centre.assets),
+                                     "asset_qty": sum(asset.qty for asset in cost_centre.assets),
+                                     "support_hours": cost_centre_support_hours,
+                                     "non_labour_oh": as_float(cost_centre.non_labour_oh),
+                                     "tech_staff_oh": as_float(cost_centre.tech_staff_oh),
+                                     "regional_staff_oh": as_float(cost_centre.regional_staff_oh),
+                                     "total_oh": as_float(cost_centre.non_labour_oh + cost_centre.tech_staff_oh +
+                                                          cost_centre.regional_staff_oh),
+                                     "pohr": pohr,
+                                     "weighted_avg_tech_hourly_wage": tech_hourly_wage,
+                                     "total_cost_to_service": self.sum_costs(asset_totals)})
+
+        return pd.DataFrame(cost_centre_rows), pd.DataFrame(asset_rows)
 
     def write_output_to_excel(self):
         """
         Write cost model output to an excel file in /model_outputs/budget_report_output.xlsx. Run the model to see
         sample output.
 
+        Every formula is written with its result as the cached value, so the output reads correctly in pandas, openpyxl
+        and viewers that don't recalculate. If values_only is set, results are written without formulas. If
+        summary_only is set, only the "Summary" worksheet is written.
+
         Read the docs for more information on how to use xlsxwriter: https://xlsxwriter.readthedocs.io/
 
         :return: None
         """
 
+        workbook, formats, summary_sheet = self.open_output_workbook()
+
+        # Loop through each cost centre for which we are budgeting
+        for key in self.cost_centres:
+
+            # Only the cost centre's total is needed for the "Summary" worksheet
+            if self.summary_only:
+                self.summary_totals.append((key, self.compute_cost_centre_total(self.cost_centres.get(key))))
+                continue
+
+            # Call helper function to write:
+            #       - OH: Total OH, non-labour OH, tech staff OH, regional staff OH
+            #       - Rates: POHR, tech wage per hour
+            self.write_cost_centre_output(key=key, workbook=workbook, **formats)
+
+        rollup_tables = list_rollup_tables(compute_rollups(*self.build_results_tables())) if self.rollups else None
+        self.close_output_workbook(workbook, formats, summary_sheet, rollup_tables)
+
+    def open_output_workbook(self, constant_memory=False):
+        """
+        Creates budget_report_output.xlsx with its formats and an empty "Summary" worksheet. Worksheets are written top
+        to bottom, so the workbook can be opened in xlsxwriter's constant memory mode, which writes each row to disk
+        as soon as the next one is started.
+
+        :param constant_memory: Whether to open the workbook in constant memory mode
+        :return: Tuple (workbook, formats, summary_sheet), where formats is a dict of the formatting variables taken
+                 by write_cost_centre_output()
+        """
+
         dir_path = os.getcwd()
         budget_output_file_path = r"{dir_path}\model_outputs\budget_report_output.xlsx".format(dir_path=dir_path)
-        workbook = xlsxwriter.Workbook(budget_output_file_path)
+        workbook = xlsxwriter.Workbook(budget_output_file_path, {"constant_memory": constant_memory})
 
         # Formatting
-        title = workbook.add_format({"bold": True})
-        heading = workbook.add_format({"bold": True, "font_color": "white", "bg_color": "#244062", "border": True})
-        cell_borders = workbook.add_format({"border": True})
-        cell_borders_and_currency = workbook.add_format({"border": True, "num_format": "$#,##0.00"})
-        currency = workbook.add_format({"num_format": "$#,##0.00"})
-        decimal_hundredth = workbook.add_format({"num_format": "#,##0.00"})
-        total_cost_to_service = workbook.add_format({"font_color": "white",
-                                                     "bg_color": "#538dd5",
-                                                     "border": True,
-                                                     "bold": True})
-
-        # Add summary worksheet that summarizes the budget outputs for each cost centre
+        formats = {"title": workbook.add_format({"bold": True}),
+                   "heading": workbook.add_format({"bold": True,
+                                                   "font_color": "white",
+                                                   "bg_color": "#244062",
+                                                   "border": True}),
+                   "cell_borders": workbook.add_format({"border": True}),
+                   "cell_borders_and_currency": workbook.add_format({"border": True, "num_format": "$#,##0.00"}),
+                   "currency": workbook.add_format({"num_format": "$#,##0.00"}),
+                   "decimal_hundredth": workbook.add_format({"num_format": "#,##0.00"}),
+                   "total_cost_to_service": workbook.add_format({"font_color": "white",
+                                                                 "bg_color": "#538dd5",
+                                                                 "border": True,
+                                                                 "bold": True})}
+
+        # Add summary worksheet that summarizes the budget outputs for each cost centre; it is filled in by
+        # close_output_workbook() once every cost centre's total is known
         summary_sheet = workbook.add_worksheet("Summary")
         summary_sheet.set_column(0, 1, 20)  # Col A, B
+        self.summary_totals = []
 
-        # Loop through each cost centre for which we are budgeting
-        for key in self.cost_centres:
+        return workbook, formats, summary_sheet
 
-            # Call helper function to write:
-            #       - OH: Total OH, non-labour OH, tech staff OH, regional staff OH
-            #       - Rates: POHR, tech wage per hour
-            self.write_cost_centre_output(cell_borders, cell_borders_and_currency, currency, decimal_hundredth, heading,
-                                          key, title, total_cost_to_service, workbook, summary_sheet)
+    def close_output_workbook(self, workbook, formats, summary_sheet, rollup_tables=None):
+        """
+        Writes the "Summary" worksheet from the cost centre totals collected by write_cost_centre_total(), followed by
+        any rollup worksheets, and closes budget_report_output.xlsx.
+
+        :param workbook: xlsxwriter object returned by open_output_workbook()
+        :param formats: Dict of formatting variables returned by open_output_workbook()
+        :param summary_sheet: Summary worksheet returned by open_output_workbook()
+        :param rollup_tables: List returned by rollups.list_rollup_tables(), or None to write no rollups
+        :return: None
+        """
+
+        heading = formats["heading"]
+        cell_borders_and_currency = formats["cell_borders_and_currency"]
+        summary_total = self.sum_costs(cost_centre_total for name, cost_centre_total in self.summary_totals)
 
         # Write total cost for all cost centres to "Summary" worksheet
-        summary_sheet.write(0, 0, "Total Cost", total_cost_to_service)
-        summary_sheet.write_formula(0,
-                                    1,
-                                    "=SUM(B3:B{last_row})".format(last_row=self.summary_row),
-                                    cell_borders_and_currency)
+        summary_sheet.write(0, 0, "Total Cost", formats["total_cost_to_service"])
+        if self.values_only:
+            summary_sheet.write(0, 1, summary_total, cell_borders_and_currency)
+        else:
+            summary_sheet.write_formula(0,
+                                        1,
+                                        self.cost_formula("=SUM(B3:B{last_row})".format(
+                                            last_row=len(self.summary_totals) + 2)),
+                                        cell_borders_and_currency,
+                                        summary_total)
+
+        # Write total cost for each cost centre to the "Summary" worksheet; without cost centre worksheets to refer to
+        # if summary_only is set
+        for summary_row, (name, cost_centre_total) in enumerate(self.summary_totals, start=2):
+            summary_sheet.write(summary_row, 0, name, heading)
+            if self.values_only or self.summary_only:
+                summary_sheet.write(summary_row, 1, cost_centre_total, cell_borders_and_currency)
+            else:
+                total_cost_reference = "{cc_name}!B14".format(cc_name=name)
+                summary_sheet.write_formula(summary_row,
+                                            1,
+                                            "={formula}".format(formula=total_cost_reference),
+                                            cell_borders_and_currency,
+                                            cost_centre_total)
+
+        if rollup_tables is not None:
+            self.write_rollup_output(workbook, formats["heading"], rollup_tables)
 
         # Output will only be written if workbook.close() is called
         workbook.close()
 
+    def write_rollup_output(self, workbook, heading, rollup_tables):
+        """
+        Writes a worksheet per rollup, one row per group below a row of headings. Rows are written top to bottom, as
+        Excel tables can't be written in constant memory mode.
+
+        :param workbook: xlsxwriter object returned by open_output_workbook()
+        :param heading: Formatting variable for the row of headings
+        :param rollup_tables: List returned by rollups.list_rollup_tables()
+        :return: None
+        """
+
+        # Bordered formatting variable for each number format
+        cell_formats = {}
+
+        for sheet_name, columns, rows in rollup_tables:
+            worksheet = workbook.add_worksheet(sheet_name)
+            worksheet.set_column(0, len(columns) - 1, 20)
+            worksheet.freeze_panes(1, 0)
+            worksheet.autofilter(0, 0, max(len(rows), 1), len(columns) - 1)
+
+            for col, (header, key, num_format) in enumerate(columns):
+                worksheet.write(0, col, header, heading)
+                if num_format not in cell_formats:
+                    cell_formats[num_format] = workbook.add_format({"border": True, "num_format": num_format or 0})
+
+            for row, rollup_row in enumerate(rows, start=1):
+                for col, (header, key, num_format) in enumerate(columns):
+                    worksheet.write(row, col, rollup_row[key], cell_formats[num_format])
+
+    def write_long_format_output(self, max_rows_per_sheet=EXCEL_MAX_ROWS - 1, max_sheets_per_file=4):
+        """
+        Alternative to write_output_to_excel() for budget reports with many cost centres. Instead of a worksheet per cost
+        centre, writes two Excel tables to /model_outputs/budget_report_output.xlsx: "Cost Centres", with each cost
+        centre's OH, rates and net cost to service, and "Assets", with one row per asset keyed by cost centre name.
+        Tables too long for one worksheet spill over into further worksheets and workbooks (see
+        write_long_format_tables()). If summary_only is set, the "Assets" table is left out.
+
+        :param max_rows_per_sheet: Maximum number of data rows on one worksheet
+        :param max_sheets_per_file: Maximum number of worksheets in one workbook
+        :return: List of paths of the workbooks written
+        """
+
+        dir_path = os.getcwd()
+        budget_output_file_path = r"{dir_path}\model_outputs\budget_report_output.xlsx".format(dir_path=dir_path)
+
+        currency = "$#,##0.00"
+        decimal_hundredth = "#,##0.00"
+
+        cost_centre_columns = [("Cost Centre", "cost_centre_name", None),
+                               ("Health Authority", "health_auth", None),
+                               ("Function", "function", None),
+                               ("Assets", "num_assets", None),
+                               ("Qty", "asset_qty", None),
+                               ("Annual Support Hours", "support_hours", decimal_hundredth),
+                               ("Total OH", "total_oh", currency),
+                               ("Non-labour OH", "non_labour_oh", currency),
+                               ("Tech Staff OH", "tech_staff_oh", currency),
+                               ("Regional Staff OH", "regional_staff_oh", currency),
+                               ("POHR", "pohr", currency),
+                               ("Tech $/hr", "weighted_avg_tech_hourly_wage", currency),
+                               ("Net Cost to Service", "total_cost_to_service", currency)]
+
+        asset_columns = [("Cost Centre", "cost_centre_name", None),
+                         ("Health Authority", "health_auth", None),
+                         ("Shop", "shop_code", None),
+                         ("Site", "site_code", None),
+                         ("Model Number", "model_num", None),
+                         ("Asset Description", "asset_description", None),
+                         ("Qty", "qty", None),
+                         ("Annual Support Hours per Asset", "avg_support_hours", decimal_hundredth),
+                         ("OH Cost per Asset", "oh_cost_per_asset", currency),
+                         ("Direct Cost per Asset", "direct_cost_per_asset", currency),
+                         ("Service Contract Cost per Asset", "service_contract_cost_per_asset", currency),
+                         ("Cost to Service per Asset", "cost_to_service_per_asset", currency),
+                         ("Total Cost to Service", "total_cost_to_service", currency),
+                         ("Support Hours Match", "support_hours_match", None),
+                         ("Service Contract Match", "service_contract_match", None),
+                         ("Input Rows", "input_rows", None)]
+
+        cost_centre_results, asset_results = self.build_results_tables()
+        cost_centre_rows = cost_centre_results.to_dict("records")
+
+        tables = [("Cost Centres", cost_centre_columns, cost_centre_rows)]
+
+        # One row per output line, so that expand_lines applies as in the per-cost centre layout
+        if not self.summary_only:
+            asset_rows = []
+            for cost_centre in self.cost_centres.values():
+                for asset, qty, input_rows in self.output_lines(cost_centre):
+                    asset_rows.append({"cost_centre_name": cost_centre.name,
+                                       "health_auth": asset.health_auth,
+                                       "shop_code": asset.shop_code,
+                                       "site_code": asset.site_code,
+                                       "model_num": asset.model_num,
+                                       "asset_description": asset.name,
+                                       "qty": qty,
+                                       "avg_support_hours": asset.avg_support_hours,
+                                       "support_hours_match": asset.support_hours_match,
+                                       "service_contract_match": asset.service_contract_match,
+                                       "input_rows": input_rows,
+                                       **self.compute_asset_costs(cost_centre, asset, qty)})
+            tables.append(("Assets", asset_columns, asset_rows))
+
+        if self.rollups:
+            tables.extend(list_rollup_tables(compute_rollups(cost_centre_results, asset_results)))
+
+        return write_long_format_tables(tables,
+                                        budget_output_file_path,
+                                        max_rows_per_sheet,
+                                        max_sheets_per_file)
+
     def write_cost_centre_output(self, cell_borders, cell_borders_and_currency, currency, decimal_hundredth, heading,
-                                 key, title, total_cost_to_service, workbook, summary_sheet):
+                                 key, title, total_cost_to_service, workbook):
         """
         Writes title, OH, and rates output to a worksheet in budget_report_output.xlsx for the given cost_centre. See
-        "# Formatting" in BudgetReport.write_output_to_excel() for more information on formatting variables passed as
+        "# Formatting" in BudgetReport.open_output_workbook() for more information on formatting variables passed as
         arguments to this method.
 
         :param cell_borders: Formatting variable
@@ -315,7 +966,6 @@ class BudgetReport:
         :param title: Formatting variable
         :param total_cost_to_service: Formatting variable
         :param workbook: xlsxwriter object representing budget_report_output.xlsx
-        :param summary_sheet: Summary worksheet that summarizes the budget outputs for each cost centre
         :return: None
         """
 
@@ -338,8 +988,9 @@ class BudgetReport:
         title_row = 3
         title_col = 0
         values_col = 1
-        worksheet.write_column(title_row, title_col, oh_headers, heading)
-        worksheet.write_column(title_row, values_col, oh_values, cell_borders_and_currency)
+        for row, (header, value) in enumerate(zip(oh_headers, oh_values), start=title_row):
+            worksheet.write(row, title_col, header, heading)
+            worksheet.write(row, values_col, value, cell_borders_and_currency)
 
         # Rates output
         worksheet.write("A9", "Rates", title)
@@ -347,21 +998,21 @@ class BudgetReport:
         rates_values = [cost_centre.pohr,
                         cost_centre.weighted_avg_tech_hourly_wage]
         title_row = 9
-        worksheet.write_column(title_row, title_col, rates_headers, heading)
-        worksheet.write_column(title_row, values_col, rates_values, cell_borders_and_currency)
+        for row, (header, value) in enumerate(zip(rates_headers, rates_values), start=title_row):
+            worksheet.write(row, title_col, header, heading)
+            worksheet.write(row, values_col, value, cell_borders_and_currency)
 
         # Call helper functions to write asset output (support hours per asset, cost to service, etc.) because the
         # output is slightly different for imaging vs. clinical and renal assets
         if cost_centre.function == "imaging":
             self.write_imag_asset_output(cell_borders, cost_centre, currency, decimal_hundredth, heading,
-                                         total_cost_to_service, worksheet, title, cell_borders_and_currency,
-                                         summary_sheet)
+                                         total_cost_to_service, worksheet, title, cell_borders_and_currency)
         else:
             self.write_asset_output(cell_borders, cost_centre, currency, decimal_hundredth, heading,
-                                    total_cost_to_service, worksheet, title, cell_borders_and_currency, summary_sheet)
+                                    total_cost_to_service, worksheet, title, cell_borders_and_currency)
 
     def write_imag_asset_output(self, cell_borders, cost_centre, currency, decimal_hundredth, heading,
-                                total_cost_to_service, worksheet, title, cell_borders_and_currency, summary_sheet):
+                                total_cost_to_service, worksheet, title, cell_borders_and_currency):
         """
         Write asset output for imaging cost centres.
 
@@ -374,7 +1025,6 @@ class BudgetReport:
         :param worksheet: xlsx object representing current worksheet to which we are writing
         :param title: Formatting variable
         :param cell_borders_and_currency: Formatting variable
-        :param summary_sheet: Summary worksheet that summarizes the budget outputs for each cost centre
         :return: None
         """
 
@@ -390,18 +1040,63 @@ class BudgetReport:
                                 "WO Cost per Asset",
                                 "Service Contract Cost per Asset",
                                 "Cost to Service per Asset",
-                                "Total Cost to Service"]
+                                "Total Cost to Service",
+                                "Support Hours Match",
+                                "Service Contract Match",
+                                "Input Rows"]
 
         asset_row = 15
         asset_col = 0
 
+        # Set column widths
+        worksheet.set_column(0, 0, 17)    # Col A
+        worksheet.set_column(1, 3, 15)    # Col B, C, D
+        worksheet.set_column(4, 4, 70)    # Col E
+        worksheet.set_column(5, 5, 7)     # Col F
+        worksheet.set_column(6, 6, 30)    # Col G
+        worksheet.set_column(7, 8, 23)    # Col H, I
+        worksheet.set_column(9, 9, 30)    # Col J
+        worksheet.set_column(10, 10, 23)  # Col K
+        worksheet.set_column(11, 11, 20)  # Col L
+        worksheet.set_column(12, 12, 45)  # Col M
+        worksheet.set_column(13, 13, 35)  # Col N
+        worksheet.set_column(14, 14, 15)  # Col O
+
+        # Formatting for specific columns
+        worksheet.conditional_format("H10:L1000000", {"type": "no_blanks",
+                                                      "format": currency})
+
+        worksheet.conditional_format("G10:G1000000", {"type": "no_blanks",
+                                                      "format": decimal_hundredth})
+
+        worksheet.conditional_format("L9:L1000000", {"type": "no_blanks",
+                                                     "format": total_cost_to_service})
+
+        # Asset rows and their costs, written as the cached results of their formulas
+        output_lines = self.output_lines(cost_centre)
+        row_costs = [self.compute_asset_costs(cost_centre, asset, qty) for asset, qty, input_rows in output_lines]
+        last_row = asset_row + len(output_lines) + 1
+
+        # Sum up total costs and write to cell B14
+        worksheet.write("A13", "Total", title)
+        worksheet.write(13, 0, "Net Cost to Service", total_cost_to_service)
+        self.write_cost_centre_total(worksheet, "L", last_row, row_costs, cost_centre, cell_borders_and_currency)
+
         worksheet.write_row(asset_row, asset_col, asset_output_headers, heading)
 
+        cost_columns = ["oh_cost_per_asset",
+                        "direct_cost_per_asset",
+                        "service_contract_cost_per_asset",
+                        "cost_to_service_per_asset",
+                        "total_cost_to_service"]
+
         # Asset output details
-        for asset in cost_centre.assets:
+        for (asset, qty, input_rows), costs in zip(output_lines, row_costs):
 
             # Start at new row
             asset_row += 1
+            # Row number of the current row in Excel's one-based notation, for formulas
+            row = asset_row + 1
 
             # Store asset details in a list
             row_data = [asset.health_auth,
@@ -409,95 +1104,98 @@ class BudgetReport:
                         asset.site_code,
                         asset.model_num,
                         asset.name,
-                        asset.qty,
-                        asset.avg_support_hours
+                        qty,
+                        self.support_hours_value(asset)
                         ]
 
             # Write asset details from row_data list to the row
             worksheet.write_row(asset_row, asset_col, row_data, cell_borders)
 
-            # Set column widths
-            worksheet.set_column(0, 0, 17)    # Col A
-            worksheet.set_column(1, 3, 15)    # Col B, C, D
-            worksheet.set_column(4, 4, 70)    # Col E
-            worksheet.set_column(5, 5, 7)     # Col F
-            worksheet.set_column(6, 6, 30)    # Col G
-            worksheet.set_column(7, 8, 23)    # Col H, I
-            worksheet.set_column(9, 9, 30)    # Col J
-            worksheet.set_column(10, 10, 23)  # Col K
-            worksheet.set_column(11, 11, 20)  # Col L
-
-            # Formatting for specific columns
-            worksheet.conditional_format("H10:L1000000", {"type": "no_blanks",
-                                                          "format": currency})
-
-            worksheet.conditional_format("G10:G1000000", {"type": "no_blanks",
-                                                          "format": decimal_hundredth})
-
-            worksheet.conditional_format("L9:L1000000", {"type": "no_blanks",
-                                                         "format": total_cost_to_service})
-
-        '''
-        Write formulas in cells for:
-           - OH Cost Per Asset
-           - Direct Cost Per Asset
-           - Service Contract Cost Per Asset
-           - Cost to Service Per Asset
-           - Total Cost to Service
-        
-        for loop explanation:
-            - Start at row 15 because it is the first row after the headers
-            - asset_row is the last row that was written to, but we need to add 2 to it because it is based on 
-              zero-based indexing (+1) and second arg in Python range() function is not inclusive (+1) 
-        '''
-
-        for row in range(17, asset_row + 2):
-            # Cell containing WO hours for current row
-            wo_hours_cell = "G" + str(row)
-            # Formula for OH Cost Per Asset = POHR (B10) * WO hours
-            worksheet.write_formula(row - 1, 7, "=B10*{wo_hours}".format(wo_hours=wo_hours_cell), cell_borders)
-            # Formula for Direct Cost Per Asset = Tech $/hr (B11) * WO hours
-            worksheet.write_formula(row - 1, 8, "=B11*{wo_hours}".format(wo_hours=wo_hours_cell), cell_borders)
-            # Write 0 as dummy value for each row under Service Contract Cost Per Asset
-            worksheet.write(row - 1, 9, 0, cell_borders)
-
-            # Formula for Cost to Service Per Asset = OH Costs + Direct Costs + Service Contract Costs
-            oh_cost_cell = "H" + str(row)
-            direct_cost_cell = "I" + str(row)
-            service_contract_cell = "J" + str(row)
-            worksheet.write_formula(row - 1,
-                                    10,
-                                    "=SUM({oh}, {wo}, {contract})".format(oh=oh_cost_cell,
-                                                                          wo=direct_cost_cell,
-                                                                          contract=service_contract_cell),
-                                    cell_borders)
-
-            # Formula for Total Cost to Service = Qty * Cost to Service Per Asset
-            qty_cell = "F" + str(row)
-            per_asset_cost = "K" + str(row)
-            worksheet.write_formula(row - 1, 11, "{unit_cost}*{qty}".format(unit_cost=per_asset_cost, qty=qty_cell),
-                                    cell_borders)
-
-        # Sum up total costs and write to cell B14
-        worksheet.write("A13", "Total", title)
-        worksheet.write(13, 0, "Net Cost to Service", total_cost_to_service)
-        last_row_cell = "L{row}".format(row=asset_row+1)
-        worksheet.write_formula(13,
-                                1,
-                                "=SUM({start}:{end})".format(start="L17", end=last_row_cell),
-                                cell_borders_and_currency)
-
-        # Write total cost for the cost centre to the "Summary" worksheet
-        summary_sheet.write(self.summary_row, 0, cost_centre.name, heading)
-        total_cost_reference = "{cc_name}!B14".format(cc_name=cost_centre.name)
-        summary_sheet.write_formula(self.summary_row,
-                                    1,
-                                    "={formula}".format(formula=total_cost_reference),
-                                    cell_borders_and_currency)
-        self.summary_row += 1
+            '''
+            Write formulas in cells for:
+               - OH Cost Per Asset
+               - Direct Cost Per Asset
+               - Service Contract Cost Per Asset
+               - Cost to Service Per Asset
+               - Total Cost to Service
+
+            In values-only mode, the results are written without formulas. In array formula mode, the formulas are
+            written for all rows at once below.
+            '''
+            if self.values_only:
+                worksheet.write_row(asset_row, 7, [costs[column] for column in cost_columns], cell_borders)
+            elif not self.array_formulas:
+                # Cell containing WO hours for current row
+                wo_hours_cell = "G" + str(row)
+                # Formula for OH Cost Per Asset = POHR (B10) * WO hours
+                worksheet.write_formula(asset_row,
+                                        7,
+                                        self.cost_formula("=B10*{wo_hours}".format(wo_hours=wo_hours_cell)),
+                                        cell_borders,
+                                        costs["oh_cost_per_asset"])
+                # Formula for Direct Cost Per Asset = Tech $/hr (B11) * WO hours
+                worksheet.write_formula(asset_row,
+                                        8,
+                                        self.cost_formula("=B11*{wo_hours}".format(wo_hours=wo_hours_cell)),
+                                        cell_borders,
+                                        costs["direct_cost_per_asset"])
+                # Service Contract Cost Per Asset, looked up in the service contract catalogue
+                worksheet.write(asset_row, 9, costs["service_contract_cost_per_asset"], cell_borders)
+
+                # Formula for Cost to Service Per Asset = OH Costs + Direct Costs + Service Contract Costs
+                oh_cost_cell = "H" + str(row)
+                direct_cost_cell = "I" + str(row)
+                service_contract_cell = "J" + str(row)
+                worksheet.write_formula(asset_row,
+                                        10,
+                                        self.cost_formula("=SUM({oh}, {wo}, {contract})".format(
+                                            oh=oh_cost_cell,
+                                            wo=direct_cost_cell,
+                                            contract=service_contract_cell)),
+                                        cell_borders,
+                                        costs["cost_to_service_per_asset"])
+
+                # Formula for Total Cost to Service = Qty * Cost to Service Per Asset
+                qty_cell = "F" + str(row)
+                per_asset_cost = "K" + str(row)
+                worksheet.write_formula(asset_row,
+                                        11,
+                                        self.cost_formula("{unit_cost}*{qty}".format(unit_cost=per_asset_cost,
+                                                                                     qty=qty_cell)),
+                                        cell_borders,
+                                        costs["total_cost_to_service"])
+
+            # Reference entry the support hours were taken from
+            worksheet.write(asset_row, 12, asset.support_hours_match, cell_borders)
+            # Catalogue level the service contract cost was found at (see servicecontracts.MATCH_LEVELS)
+            worksheet.write(asset_row, 13, asset.service_contract_match, cell_borders)
+            # Input lines the row was collapsed from
+            worksheet.write(asset_row, 14, input_rows, cell_borders)
+
+        # In array formula mode, each computed column is a single dynamic array formula spilling over every asset row
+        if self.array_formulas and not self.values_only and row_costs:
+            column_values = {column: [costs[column] for costs in row_costs] for column in cost_columns}
+            # OH Cost Per Asset = POHR (B10) * WO hours
+            write_dynamic_array_column(worksheet, 16, 7,
+                                       self.cost_formula("=B10*G17:G{last}".format(last=last_row)),
+                                       column_values["oh_cost_per_asset"], cell_borders)
+            # Direct Cost Per Asset = Tech $/hr (B11) * WO hours
+            write_dynamic_array_column(worksheet, 16, 8,
+                                       self.cost_formula("=B11*G17:G{last}".format(last=last_row)),
+                                       column_values["direct_cost_per_asset"], cell_borders)
+            # Service Contract Cost Per Asset, looked up in the service contract catalogue
+            worksheet.write_column(16, 9, column_values["service_contract_cost_per_asset"], cell_borders)
+            # Cost to Service Per Asset = OH Costs + Direct Costs + Service Contract Costs
+            write_dynamic_array_column(worksheet, 16, 10,
+                                       self.cost_formula("=H17:H{last}+I17:I{last}+J17:J{last}".format(last=last_row)),
+                                       column_values["cost_to_service_per_asset"], cell_borders)
+            # Total Cost to Service = Qty * Cost to Service Per Asset
+            write_dynamic_array_column(worksheet, 16, 11,
+                                       self.cost_formula("=K17:K{last}*F17:F{last}".format(last=last_row)),
+                                       column_values["total_cost_to_service"], cell_borders)
 
     def write_asset_output(self, cell_borders, cost_centre, currency, decimal_hundredth, heading, total_cost_to_service,
-                           worksheet, title, cell_borders_and_currency, summary_sheet):
+                           worksheet, title, cell_borders_and_currency):
         """
         Write asset output for clinical/renal cost centres.
 
@@ -510,7 +1208,6 @@ class BudgetReport:
         :param worksheet: xlsx object representing current worksheet to which we are writing
         :param title: Formatting variable
         :param cell_borders_and_currency: Formatting variable
-        :param summary_sheet: Summary worksheet that summarizes the budget outputs for each cost centre
         :return: None
         """
 
@@ -525,16 +1222,57 @@ class BudgetReport:
                                 "OH Cost per Asset",
                                 "Direct Cost per Asset",
                                 "Cost to Service per Asset",
-                                "Total Cost to Service"]
+                                "Total Cost to Service",
+                                "Support Hours Match",
+                                "Input Rows"]
         asset_row = 15
         asset_col = 0
+
+        # Set column widths
+        worksheet.set_column(0, 0, 17)    # Col A
+        worksheet.set_column(1, 3, 15)    # Col B, C, D
+        worksheet.set_column(4, 4, 70)    # Col E
+        worksheet.set_column(5, 5, 7)     # Col F
+        worksheet.set_column(6, 6, 30)    # Col G
+        worksheet.set_column(7, 9, 23)    # Col H, I, J
+        worksheet.set_column(10, 10, 20)  # Col K
+        worksheet.set_column(11, 11, 45)  # Col L
+        worksheet.set_column(12, 12, 15)  # Col M
+
+        # Formatting for specific columns
+        worksheet.conditional_format("H10:K1000000", {"type": "no_blanks",
+                                                      "format": currency})
+
+        worksheet.conditional_format("G10:G1000000", {"type": "no_blanks",
+                                                      "format": decimal_hundredth})
+
+        worksheet.conditional_format("K9:K1000000", {"type": "no_blanks",
+                                                     "format": total_cost_to_service})
+
+        # Asset rows and their costs, written as the cached results of their formulas
+        output_lines = self.output_lines(cost_centre)
+        row_costs = [self.compute_asset_costs(cost_centre, asset, qty) for asset, qty, input_rows in output_lines]
+        last_row = asset_row + len(output_lines) + 1
+
+        # Sum up total costs and write to cell B14
+        worksheet.write("A13", "Total", title)
+        worksheet.write(13, 0, "Net Cost to Service", total_cost_to_service)
+        self.write_cost_centre_total(worksheet, "K", last_row, row_costs, cost_centre, cell_borders_and_currency)
+
         worksheet.write_row(asset_row, asset_col, asset_output_headers, heading)
 
+        cost_columns = ["oh_cost_per_asset",
+                        "direct_cost_per_asset",
+                        "cost_to_service_per_asset",
+                        "total_cost_to_service"]
+
         # Asset output details
-        for asset in cost_centre.assets:
+        for (asset, qty, input_rows), costs in zip(output_lines, row_costs):
 
             # Start at new row
             asset_row += 1
+            # Row number of the current row in Excel's one-based notation, for formulas
+            row = asset_row + 1
 
             # Store asset details in a list
             row_data = [asset.health_auth,
@@ -542,81 +1280,112 @@ class BudgetReport:
                         asset.site_code,
                         asset.model_num,
                         asset.name,
-                        asset.qty,
-                        asset.avg_support_hours
+                        qty,
+                        self.support_hours_value(asset)
                         ]
 
             # Write asset details from row_data list to the row
             worksheet.write_row(asset_row, asset_col, row_data, cell_borders)
 
-            # Set column widths
-            worksheet.set_column(0, 0, 17)    # Col A
-            worksheet.set_column(1, 3, 15)    # Col B, C, D
-            worksheet.set_column(4, 4, 70)    # Col E
-            worksheet.set_column(5, 5, 7)     # Col F
-            worksheet.set_column(6, 6, 30)    # Col G
-            worksheet.set_column(7, 9, 23)    # Col H, I, J
-            worksheet.set_column(10, 10, 20)  # Col K
-
-            # Formatting for specific columns
-            worksheet.conditional_format("H10:K1000000", {"type": "no_blanks",
-                                                          "format": currency})
-
-            worksheet.conditional_format("G10:G1000000", {"type": "no_blanks",
-                                                          "format": decimal_hundredth})
-
-            worksheet.conditional_format("K9:K1000000", {"type": "no_blanks",
-                                                         "format": total_cost_to_service})
-
-        '''
-               Write formulas in cells for:
-                  - OH Cost Per Asset
-                  - Direct Cost Per Asset
-                  - Cost to Service Per Asset
-                  - Total Cost to Service
-
-               for loop explanation:
-                   - Start at row 15 because it is the first row after the headers
-                   - asset_row is the last row that was written to, but we need to add 2 to it because it is based on 
-                     zero-based indexing (+1) and second arg in Python range() function is not inclusive (+1) 
-               '''
-
-        for row in range(17, asset_row + 2):
-            # Cell containing WO hours for current row
-            wo_hours_cell = "G" + str(row)
-            # Formula for OH Cost Per Asset = POHR (B10) * WO hours
-            worksheet.write_formula(row - 1, 7, "=B10*{wo_hours}".format(wo_hours=wo_hours_cell), cell_borders)
-            # Formula for Direct Cost Per Asset = Tech $/hr (B11) * WO hours
-            worksheet.write_formula(row - 1, 8, "=B11*{wo_hours}".format(wo_hours=wo_hours_cell), cell_borders)
-
-            # Formula for Cost to Service Per Asset = OH Costs + Direct Costs
-            oh_cost_cell = "H" + str(row)
-            direct_cost_cell = "I" + str(row)
-            worksheet.write_formula(row - 1,
-                                    9,
-                                    "=SUM({oh}, {direct})".format(oh=oh_cost_cell, direct=direct_cost_cell),
-                                    cell_borders)
-
-            # Formula for Total Cost to Service = Qty * Cost to Service Per Asset
-            qty_cell = "F" + str(row)
-            per_asset_cost = "J" + str(row)
-            worksheet.write_formula(row - 1, 10, "{unit_cost}*{qty}".format(unit_cost=per_asset_cost, qty=qty_cell),
-                                    cell_borders)
+            '''
+            Write formulas in cells for:
+               - OH Cost Per Asset
+               - Direct Cost Per Asset
+               - Cost to Service Per Asset
+               - Total Cost to Service
+
+            In values-only mode, the results are written without formulas. In array formula mode, the formulas are
+            written for all rows at once below.
+            '''
+            if self.values_only:
+                worksheet.write_row(asset_row, 7, [costs[column] for column in cost_columns], cell_borders)
+            elif not self.array_formulas:
+                # Cell containing WO hours for current row
+                wo_hours_cell = "G" + str(row)
+                # Formula for OH Cost Per Asset = POHR (B10) * WO hours
+                worksheet.write_formula(asset_row,
+                                        7,
+                                        self.cost_formula("=B10*{wo_hours}".format(wo_hours=wo_hours_cell)),
+                                        cell_borders,
+                                        costs["oh_cost_per_asset"])
+                # Formula for Direct Cost Per Asset = Tech $/hr (B11) * WO hours
+                worksheet.write_formula(asset_row,
+                                        8,
+                                        self.cost_formula("=B11*{wo_hours}".format(wo_hours=wo_hours_cell)),
+                                        cell_borders,
+                                        costs["direct_cost_per_asset"])
+
+                # Formula for Cost to Service Per Asset = OH Costs + Direct Costs
+                oh_cost_cell = "H" + str(row)
+                direct_cost_cell = "I" + str(row)
+                worksheet.write_formula(asset_row,
+                                        9,
+                                        self.cost_formula("=SUM({oh}, {direct})".format(oh=oh_cost_cell,
+                                                                                        direct=direct_cost_cell)),
+                                        cell_borders,
+                                        costs["cost_to_service_per_asset"])
+
+                # Formula for Total Cost to Service = Qty * Cost to Service Per Asset
+                qty_cell = "F" + str(row)
+                per_asset_cost = "J" + str(row)
+                worksheet.write_formula(asset_row,
+                                        10,
+                                        self.cost_formula("{unit_cost}*{qty}".format(unit_cost=per_asset_cost,
+                                                                                     qty=qty_cell)),
+                                        cell_borders,
+                                        costs["total_cost_to_service"])
+
+            # Reference entry the support hours were taken from
+            worksheet.write(asset_row, 11, asset.support_hours_match, cell_borders)
+            # Input lines the row was collapsed from
+            worksheet.write(asset_row, 12, input_rows, cell_borders)
+
+        # In array formula mode, each computed column is a single dynamic array formula spilling over every asset row
+        if self.array_formulas and not self.values_only and row_costs:
+            column_values = {column: [costs[column] for costs in row_costs] for column in cost_columns}
+            # OH Cost Per Asset = POHR (B10) * WO hours
+            write_dynamic_array_column(worksheet, 16, 7,
+                                       self.cost_formula("=B10*G17:G{last}".format(last=last_row)),
+                                       column_values["oh_cost_per_asset"], cell_borders)
+            # Direct Cost Per Asset = Tech $/hr (B11) * WO hours
+            write_dynamic_array_column(worksheet, 16, 8,
+                                       self.cost_formula("=B11*G17:G{last}".format(last=last_row)),
+                                       column_values["direct_cost_per_asset"], cell_borders)
+            # Cost to Service Per Asset = OH Costs + Direct Costs
+            write_dynamic_array_column(worksheet, 16, 9,
+                                       self.cost_formula("=H17:H{last}+I17:I{last}".format(last=last_row)),
+                                       column_values["cost_to_service_per_asset"], cell_borders)
+            # Total Cost to Service = Qty * Cost to Service Per Asset
+            write_dynamic_array_column(worksheet, 16, 10,
+                                       self.cost_formula("=J17:J{last}*F17:F{last}".format(last=last_row)),
+                                       column_values["total_cost_to_service"], cell_borders)
+
+    def write_cost_centre_total(self, worksheet, total_col, last_row, row_costs, cost_centre,
+                                cell_borders_and_currency):
+        """
+        Writes a cost centre's net cost to service to cell B14 of its worksheet and records it for the "Summary"
+        worksheet.
 
-        # Sum up total costs and write to cell B14
-        worksheet.write("A13", "Total", title)
-        worksheet.write(13, 0, "Net Cost to Service", total_cost_to_service)
-        last_row_cell = "K{row}".format(row=asset_row+1)
-        worksheet.write_formula(13,
-                                1,
-                                "=SUM({start}:{end})".format(start="K17", end=last_row_cell),
-                                cell_borders_and_currency)
-
-        # Write total cost for the cost centre to the "Summary" worksheet
-        summary_sheet.write(self.summary_row, 0, cost_centre.name, heading)
-        total_cost_reference = "{cc_name}!B14".format(cc_name=cost_centre.name)
-        summary_sheet.write_formula(self.summary_row,
+        :param worksheet: xlsx object representing the cost centre's worksheet
+        :param total_col: Letter of the "Total Cost to Service" column of the asset output
+        :param last_row: Last row of the asset output in Excel's one-based notation
+        :param row_costs: List of dicts returned by compute_asset_costs() for each asset row
+        :param cost_centre: CostCentre object for which we are writing output
+        :param cell_borders_and_currency: Formatting variable
+        :return: None
+        """
+
+        cost_centre_total = self.sum_costs(costs["total_cost_to_service"] for costs in row_costs)
+
+        if self.values_only:
+            worksheet.write(13, 1, cost_centre_total, cell_borders_and_currency)
+        else:
+            last_row_cell = "{col}{row}".format(col=total_col, row=last_row)
+            worksheet.write_formula(13,
                                     1,
-                                    "={formula}".format(formula=total_cost_reference),
-                                    cell_borders_and_currency)
-        self.summary_row += 1
+                                    self.cost_formula("=SUM({start}:{end})".format(start=total_col + "17",
+                                                                                   end=last_row_cell)),
+                                    cell_borders_and_currency,
+                                    cost_centre_total)
+
+        self.summary_totals.append((cost_centre.name, cost_centre_total))
@@ -0,0 +1,246 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from sweep import SWEEP_PARAMETERS
+from vectorengine import TECH_LEVELS, as_scenario_column, compute_cost_centre_rates, compute_cost_centre_support_hours
+
+"""
+########################################################################################################################
+##################################### MODULE SCOPE FUNCTIONS BELOW #####################################################
+########################################################################################################################
+
+Capacity planning: runs the labour hours side of CostCentre.compute_pohr() in reverse to find the tech FTEs each cost
+centre needs to absorb the support hours of the assets in the budget report, then re-evaluates POHR and tech $/hr with
+the added staff. Every cost centre and every scenario is planned at once with array arithmetic (see vectorengine):
+
+    $ python capacityplanner.py --fte-increment 0.1
+    $ python capacityplanner.py --scenarios scenarios.csv --level-mix 8=0.7,10=0.3
+"""
+
+
+def compute_productive_hours_per_fte(arrays, productivity_rate, hours_worked_per_day=None,
+                                     semi_prod_days_per_year=None):
+    """
+    Computes the productive hours one full-time tech of each level works in a year, as in CostCentre.compute_pohr():
+        productivity rate * hours worked per day * (semi-productive days per year - vacation days for the level)
+
+    :param arrays: Dict of reference arrays (see referencearrays.build_reference_arrays())
+    :param productivity_rate: % of annual labour hours that techs are productive; scalar or one value per scenario
+    :param hours_worked_per_day: Average hours a tech works in a day; defaults to the reference value
+    :param semi_prod_days_per_year: Days in a year less weekends, stats and sick days; defaults to the reference value
+    :return: Array of shape (4,) ordered as TECH_LEVELS, or (k, 1, 4) for k scenarios
+    """
+
+    if hours_worked_per_day is None:
+        hours_worked_per_day = arrays["hours_worked_per_day"]
+    if semi_prod_days_per_year is None:
+        semi_prod_days_per_year = arrays["semi_prod_days_per_year"]
+
+    productivity_rate = as_scenario_column(productivity_rate)[..., np.newaxis]
+    hours_worked_per_day = as_scenario_column(hours_worked_per_day)[..., np.newaxis]
+    semi_prod_days_per_year = as_scenario_column(semi_prod_days_per_year)[..., np.newaxis]
+
+    return productivity_rate * hours_worked_per_day * (semi_prod_days_per_year - arrays["level_vac_days"])
+
+
+def compute_current_level_mix(arrays):
+    """
+    Computes each cost centre's current share of techs at each level. Cost centres without techs get the mix of the
+    whole region.
+
+    :param arrays: Dict of reference arrays (see referencearrays.build_reference_arrays())
+    :return: (number of cost centres, 4) array whose rows sum to 1
+    """
+
+    level_qty = arrays["level_qty"]
+    total_num_staff = level_qty.sum(axis=1, keepdims=True)
+    region_mix = level_qty.sum(axis=0) / level_qty.sum()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(total_num_staff > 0, level_qty / total_num_staff, region_mix)
+
+
+def parse_level_mix(text):
+    """
+    Parses a level mix given on the command line, e.g. "8=0.7,10=0.3". Shares are normalized to sum to 1.
+
+    :param text: Comma-separated level=share pairs
+    :return: Array of shape (4,) ordered as TECH_LEVELS
+    """
+
+    mix = np.zeros(len(TECH_LEVELS))
+
+    for pair in text.split(","):
+        level, share = pair.split("=")
+        mix[TECH_LEVELS.index(int(level))] = float(share)
+
+    return mix / mix.sum()
+
+
+def plan_capacity(arrays, cc_support_hours, oh_tech_time_percentage, productivity_rate, level_mix=None,
+                  benefits_multiplier=None, hours_worked_per_day=None, semi_prod_days_per_year=None,
+                  support_hours_multiplier=1.0, fte_increment=None):
+    """
+    Computes the incremental tech FTEs each cost centre needs for its new support hours and the resulting rates:
+        required FTEs = support hours / productive hours of one FTE of the level mix
+
+    Negative support hours (assets being removed) give negative FTEs. Headcount at a level never drops below 0.
+    Assumptions may be scalars or 1-D arrays with one value per scenario, as in vectorengine.compute_cost_centre_rates().
+
+    :param arrays: Dict of reference arrays (see referencearrays.build_reference_arrays())
+    :param cc_support_hours: 1-D array of the new annual support hours per cost centre (see
+                             vectorengine.compute_cost_centre_support_hours())
+    :param oh_tech_time_percentage: % of tech time spent on non-device related work
+    :param productivity_rate: % of annual labour hours that techs are productive
+    :param level_mix: Share of new FTEs at each level in TECH_LEVELS, as a (4,) array for every cost centre or a
+                      (number of cost centres, 4) array; defaults to each cost centre's current mix
+    :param benefits_multiplier: Multiplier applied to salaries to get total compensation; defaults to the reference value
+    :param hours_worked_per_day: Average hours a tech works in a day; defaults to the reference value
+    :param semi_prod_days_per_year: Days in a year less weekends, stats and sick days; defaults to the reference value
+    :param support_hours_multiplier: Scales the new support hours
+    :param fte_increment: If given, new FTEs at each level are rounded up to a multiple of this (e.g. 0.5 or 1)
+    :return: Dict with keys:
+                "support_hours": New support hours per cost centre
+                "required_fte": Incremental FTEs per cost centre
+                "level_fte": Incremental FTEs per cost centre and level, last axis ordered as TECH_LEVELS
+                "level_qty": Headcount per cost centre and level after the plan
+                "rates_before", "rates_after": Dicts returned by vectorengine.compute_cost_centre_rates() for the
+                    current and planned headcount
+             Per-cost centre arrays have shape (number of cost centres,), or (k, number of cost centres) for k scenarios
+    """
+
+    if level_mix is None:
+        level_mix = compute_current_level_mix(arrays)
+
+    level_mix = np.asarray(level_mix, dtype=np.float64)
+    level_mix = level_mix / level_mix.sum(axis=-1, keepdims=True)
+
+    hours_per_fte = compute_productive_hours_per_fte(arrays, productivity_rate, hours_worked_per_day,
+                                                     semi_prod_days_per_year)
+    hours_per_mix_fte = (level_mix * hours_per_fte).sum(axis=-1)
+
+    support_hours = as_scenario_column(support_hours_multiplier) * cc_support_hours
+    required_fte = support_hours / hours_per_mix_fte
+    level_fte = required_fte[..., np.newaxis] * level_mix
+
+    # The small offset stops float error from rounding an exact multiple up (e.g. 0.30000000000000004 / 0.1)
+    if fte_increment is not None:
+        level_fte = np.ceil(level_fte / fte_increment - 1e-9) * fte_increment
+
+    level_qty = np.maximum(arrays["level_qty"] + level_fte, 0)
+    level_fte = level_qty - arrays["level_qty"]
+
+    rate_assumptions = {"oh_tech_time_percentage": oh_tech_time_percentage,
+                        "productivity_rate": productivity_rate,
+                        "benefits_multiplier": benefits_multiplier,
+                        "hours_worked_per_day": hours_worked_per_day,
+                        "semi_prod_days_per_year": semi_prod_days_per_year}
+
+    rates_before = compute_cost_centre_rates(arrays, **rate_assumptions)
+    rates_after = compute_cost_centre_rates(dict(arrays, level_qty=level_qty), **rate_assumptions)
+
+    return {"support_hours": support_hours,
+            "required_fte": level_fte.sum(axis=-1),
+            "level_fte": level_fte,
+            "level_qty": level_qty,
+            "rates_before": rates_before,
+            "rates_after": rates_after}
+
+
+def plan_to_frame(plan, cost_centre_names):
+    """
+    Lays a plan out as a long format table with one row per scenario and cost centre.
+
+    :param plan: Dict returned by plan_capacity()
+    :param cost_centre_names: Array of cost centre names in the order of the reference arrays
+    :return: DataFrame with columns "scenario_id", "cost_centre_name", "support_hours", "required_fte",
+             "fte_level8", "fte_level9", "fte_level10", "fte_level12", "pohr_before", "pohr_after", "pohr_change",
+             "weighted_avg_tech_hourly_wage_before", "weighted_avg_tech_hourly_wage_after",
+             "weighted_avg_tech_hourly_wage_change"
+    """
+
+    num_cost_centres = len(cost_centre_names)
+    required_fte = np.atleast_2d(plan["required_fte"])
+    num_scenarios = required_fte.shape[0]
+    shape = (num_scenarios, num_cost_centres)
+
+    plan_df = pd.DataFrame({"scenario_id": np.repeat(np.arange(num_scenarios), num_cost_centres),
+                            "cost_centre_name": np.tile(cost_centre_names, num_scenarios),
+                            "support_hours": np.broadcast_to(plan["support_hours"], shape).ravel(),
+                            "required_fte": required_fte.ravel()})
+
+    level_fte = np.broadcast_to(plan["level_fte"], (num_scenarios, num_cost_centres, len(TECH_LEVELS)))
+    for position, level in enumerate(TECH_LEVELS):
+        plan_df["fte_level{level}".format(level=level)] = level_fte[..., position].ravel()
+
+    for rate in ["pohr", "weighted_avg_tech_hourly_wage"]:
+        plan_df[rate + "_before"] = np.broadcast_to(plan["rates_before"][rate], shape).ravel()
+        plan_df[rate + "_after"] = np.broadcast_to(plan["rates_after"][rate], shape).ravel()
+        plan_df[rate + "_change"] = plan_df[rate + "_after"] - plan_df[rate + "_before"]
+
+    return plan_df
+
+
+def main():
+    """
+    Builds the reference arrays from model_inputs/ and plans the tech FTEs needed for the assets in
+    budget_report_input.xlsx, for one scenario or for every scenario in a CSV file. Output is written to
+    model_outputs/capacity_plan.csv.
+
+    :return: None
+    """
+
+    parser = argparse.ArgumentParser(description="Plan the tech FTEs needed to absorb new assets' support hours")
+    parser.add_argument("--scenarios", help="CSV file with one row per scenario and columns from SWEEP_PARAMETERS")
+    parser.add_argument("--level-mix", help="Share of new FTEs at each level, e.g. 8=0.7,10=0.3 (default: each cost "
+                                            "centre's current mix)")
+    parser.add_argument("--fte-increment", type=float, default=None,
+                        help="Round new FTEs at each level up to a multiple of this")
+    parser.add_argument("--output", default=os.path.join("model_outputs", "capacity_plan.csv"))
+    args = parser.parse_args()
+
+    # Imported here so that importing this module doesn't read every reference workbook
+    from budgetreport import BudgetReport
+    from costcentre import CostCentre
+    from referencearrays import build_reference_arrays
+
+    print("Importing data...")
+
+    budget_report = BudgetReport()
+    assets = budget_report.create_asset_objects()
+    budget_report.create_cost_centre_objects(assets, budget_report)
+    budget_report.compute_asset_support_hours()
+    arrays = build_reference_arrays(budget_report=budget_report)
+
+    assumptions = {"oh_tech_time_percentage": CostCentre.OH_TECH_TIME_PERCENTAGE,
+                   "productivity_rate": CostCentre.PRODUCTIVITY_RATE}
+
+    if args.scenarios:
+        scenarios_df = pd.read_csv(args.scenarios)
+        unknown_parameters = set(scenarios_df.columns) - set(SWEEP_PARAMETERS)
+        if unknown_parameters:
+            raise ValueError("Unknown scenario parameters: {names}".format(names=", ".join(sorted(unknown_parameters))))
+        for column in scenarios_df.columns:
+            assumptions[column] = scenarios_df[column].to_numpy(dtype=np.float64)
+
+    print("Planning capacity...")
+
+    plan = plan_capacity(arrays,
+                         compute_cost_centre_support_hours(arrays),
+                         level_mix=parse_level_mix(args.level_mix) if args.level_mix else None,
+                         fte_increment=args.fte_increment,
+                         **assumptions)
+    plan_df = plan_to_frame(plan, arrays["cost_centre_names"])
+
+    if args.scenarios:
+        plan_df = plan_df.merge(scenarios_df.rename_axis("scenario_id").reset_index(), on="scenario_id", how="left")
+
+    plan_df.to_csv(args.output, index=False)
+
+    print("Capacity plan written to {path}".format(path=args.output))
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,250 @@
+import datetime
+import os
+import pickle
+import pandas as pd
+from asset import Asset
+from budgetreport import BudgetReport, as_float
+from costcentre import CostCentre
+
+"""
+########################################################################################################################
+##################################### MODULE SCOPE FUNCTIONS BELOW #####################################################
+########################################################################################################################
+
+Checkpoints between the stages of a model run, so that a failure late in the run (e.g. budget_report_output.xlsx being
+open in Excel when it is written) doesn't throw away the work done before it. After each stage the state needed to
+carry on is saved as a small table-based pickle:
+
+    "assets":        asset table, with each asset's resolved cost centre
+    "cost_centres":  asset table and per-cost centre OH and rates
+    "support_hours": asset table with resolved support hours and per-cost centre OH and rates
+
+Each checkpoint records the hashes of the inputs it was computed from and is only used if they still match, so a
+resumed run never mixes old results with changed inputs:
+
+    $ python main.py --resume
+"""
+
+# Default folder for checkpoint files
+checkpoint_folder_path = "model_outputs/checkpoints"
+
+# Pipeline stages, in the order they run
+CHECKPOINT_STAGES = ["assets", "cost_centres", "support_hours"]
+
+
+def assets_to_frame(assets):
+    """
+    Lays out Asset objects as a table. Columns keep their Python values (e.g. None rather than NaN for a missing
+    support hours match) so that restored assets are written exactly like the originals.
+
+    :param assets: List of Asset objects
+    :return: DataFrame with columns "model_num", "asset_description", "qty", "health_auth", "site_code", "shop_code",
+             "function", "cost_centre_name", "avg_support_hours", "support_hours_match", "source_lines"
+    """
+
+    return pd.DataFrame([{"model_num": asset.model_num,
+                          "asset_description": asset.name,
+                          "qty": asset.qty,
+                          "health_auth": asset.health_auth,
+                          "site_code": asset.site_code,
+                          "shop_code": asset.shop_code,
+                          "function": asset.function,
+                          "cost_centre_name": getattr(asset.cost_centre, "name", asset.cost_centre),
+                          "avg_support_hours": asset.avg_support_hours,
+                          "support_hours_match": asset.support_hours_match,
+                          "source_lines": asset.source_lines}
+                         for asset in assets], dtype=object)
+
+
+def cost_centres_to_frame(budget_report):
+    """
+    Lays out the OH and rates of a BudgetReport's CostCentre objects as a table.
+
+    :param budget_report: BudgetReport object on which create_cost_centre_objects() has been called
+    :return: DataFrame with columns "cost_centre_name", "health_auth", "function", "non_labour_oh", "tech_staff_oh",
+             "regional_staff_oh", "pohr", "weighted_avg_tech_hourly_wage"
+    """
+
+    return pd.DataFrame([{"cost_centre_name": cost_centre.name,
+                          "health_auth": cost_centre.health_auth,
+                          "function": cost_centre.function,
+                          "non_labour_oh": as_float(cost_centre.non_labour_oh),
+                          "tech_staff_oh": as_float(cost_centre.tech_staff_oh),
+                          "regional_staff_oh": as_float(cost_centre.regional_staff_oh),
+                          "pohr": as_float(cost_centre.pohr),
+                          "weighted_avg_tech_hourly_wage": as_float(cost_centre.weighted_avg_tech_hourly_wage)}
+                         for cost_centre in budget_report.cost_centres.values()])
+
+
+def save_checkpoint(stage, input_hashes, assets, budget_report=None, folder_path=checkpoint_folder_path):
+    """
+    Saves the result of a stage. The file is written under a temporary name and then renamed, so a failure while saving
+    never leaves a truncated checkpoint behind.
+
+    :param stage: One of CHECKPOINT_STAGES
+    :param input_hashes: Dict returned by budgetreport.compute_input_hashes()
+    :param assets: List of Asset objects; for stages after "assets", in the order of budget_report's cost centres
+    :param budget_report: BudgetReport object; required for stages after "assets"
+    :param folder_path: Folder to write checkpoint files to
+    :return: Path of the checkpoint file
+    """
+
+    os.makedirs(folder_path, exist_ok=True)
+    file_path = os.path.join(folder_path, "{stage}.pkl".format(stage=stage))
+
+    checkpoint = {"stage": stage,
+                  "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                  "input_hashes": input_hashes,
+                  "asset_df": assets_to_frame(assets),
+                  "cost_centre_df": cost_centres_to_frame(budget_report) if budget_report is not None else None}
+
+    with open(file_path + ".tmp", "wb") as checkpoint_file:
+        pickle.dump(checkpoint, checkpoint_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(file_path + ".tmp", file_path)
+
+    return file_path
+
+
+def load_latest_checkpoint(input_hashes, folder_path=checkpoint_folder_path):
+    """
+    Finds the checkpoint of the latest stage that was computed from the current inputs.
+
+    :param input_hashes: Dict returned by budgetreport.compute_input_hashes() for the current inputs
+    :param folder_path: Folder containing checkpoint files
+    :return: Checkpoint dict (see save_checkpoint()), or None if there is no valid checkpoint
+    """
+
+    for stage in reversed(CHECKPOINT_STAGES):
+        file_path = os.path.join(folder_path, "{stage}.pkl".format(stage=stage))
+
+        if not os.path.exists(file_path):
+            continue
+
+        with open(file_path, "rb") as checkpoint_file:
+            checkpoint = pickle.load(checkpoint_file)
+
+        if checkpoint["input_hashes"] == input_hashes:
+            return checkpoint
+
+    return None
+
+
+def restore_assets(asset_df, sites_cost_centre_dict):
+    """
+    Recreates Asset objects from a checkpoint's asset table.
+
+    :param asset_df: Asset table from a checkpoint
+    :param sites_cost_centre_dict: See BudgetReport.sites_cost_centre_dict
+    :return: List of Asset objects
+    """
+
+    assets = []
+
+    for row in asset_df.to_dict("records"):
+        asset = Asset(row["model_num"], row["asset_description"], row["qty"], row["health_auth"], row["site_code"],
+                      row["shop_code"], sites_cost_centre_dict)
+        asset.avg_support_hours = row["avg_support_hours"]
+        asset.support_hours_match = row["support_hours_match"]
+        asset.source_lines = row["source_lines"]
+        assets.append(asset)
+
+    return assets
+
+
+def restore_budget_report(checkpoint):
+    """
+    Recreates a BudgetReport with its CostCentre and Asset objects from a checkpoint of a stage after "assets".
+
+    :param checkpoint: Checkpoint dict (see save_checkpoint())
+    :return: BudgetReport object
+    """
+
+    budget_report = BudgetReport()
+    assets = restore_assets(checkpoint["asset_df"], budget_report.sites_cost_centre_dict)
+    cost_centre_names = checkpoint["asset_df"]["cost_centre_name"].tolist()
+
+    for cost_centre_row in checkpoint["cost_centre_df"].to_dict("records"):
+        cost_centre_assets = [asset for asset, name in zip(assets, cost_centre_names)
+                              if name == cost_centre_row["cost_centre_name"]]
+        cost_centre = CostCentre.from_checkpoint(cost_centre_row, cost_centre_assets)
+        for asset in cost_centre_assets:
+            asset.assign_permanent_cost_centre(cost_centre)
+        budget_report.cost_centres[cost_centre.name] = cost_centre
+
+    return budget_report
+
+
+def checkpoint_assets(budget_report):
+    """
+    Lists a BudgetReport's assets in the order of its cost centres, the order they are saved in after the "assets"
+    stage.
+
+    :param budget_report: BudgetReport object on which create_cost_centre_objects() has been called
+    :return: List of Asset objects
+    """
+
+    return [asset for cost_centre in budget_report.cost_centres.values() for asset in cost_centre.assets]
+
+
+def run_with_checkpoints(input_hashes, resume=False, folder_path=checkpoint_folder_path, cost_centre_names=None):
+    """
+    Runs create_asset_objects(), create_cost_centre_objects() and compute_asset_support_hours(), saving a checkpoint
+    after each, then compute_service_contract_costs(), which is quick enough to always run. If resume is True, starts
+    after the latest stage with a checkpoint that matches input_hashes.
+
+    :param input_hashes: Dict returned by budgetreport.compute_input_hashes() for the current inputs
+    :param resume: Whether to restart from the latest valid checkpoint
+    :param folder_path: Folder for checkpoint files
+    :param cost_centre_names: Set of the only cost centres to create and compute, e.g. returned by
+                              BudgetReport.select_cost_centres(); None for all. Only the "assets" checkpoint, which
+                              has every asset, is saved, and it can't be combined with resume
+    :return: BudgetReport object ready to be written
+    """
+
+    if resume and cost_centre_names is not None:
+        raise ValueError("A run restricted to some cost centres can't resume from a checkpoint")
+
+    checkpoint = load_latest_checkpoint(input_hashes, folder_path) if resume else None
+    completed_stages = []
+
+    if checkpoint is not None:
+        completed_stages = CHECKPOINT_STAGES[:CHECKPOINT_STAGES.index(checkpoint["stage"]) + 1]
+        print("Resuming after the {stage} stage from a checkpoint of {created}...".format(**checkpoint))
+    elif resume:
+        print("No checkpoint matches the current inputs; running all stages...")
+
+    if "cost_centres" in completed_stages:
+        budget_report = restore_budget_report(checkpoint)
+    else:
+        # Create BudgetReport object holding data needed to produce final output
+        budget_report = BudgetReport()
+
+        # Create list of Asset objects for which the user wants to budget
+        if "assets" in completed_stages:
+            assets = restore_assets(checkpoint["asset_df"], budget_report.sites_cost_centre_dict)
+        else:
+            assets = budget_report.create_asset_objects()
+            save_checkpoint("assets", input_hashes, assets, folder_path=folder_path)
+
+        # Leave out the other cost centres' assets before any OH or support hours are computed for them
+        if cost_centre_names is not None:
+            assets = [asset for asset in assets if asset.cost_centre in cost_centre_names]
+
+        print("Computing cost to service...")
+
+        # Create CostCentre objects based on the Asset objects above
+        budget_report.create_cost_centre_objects(assets, budget_report)
+        if cost_centre_names is None:
+            save_checkpoint("cost_centres", input_hashes, checkpoint_assets(budget_report), budget_report, folder_path)
+
+    # Compute asset support hours
+    if "support_hours" not in completed_stages:
+        budget_report.compute_asset_support_hours()
+        if cost_centre_names is None:
+            save_checkpoint("support_hours", input_hashes, checkpoint_assets(budget_report), budget_report,
+                            folder_path)
+
+    # Look up imaging assets' service contract costs
+    budget_report.compute_service_contract_costs()
+
+    return budget_report
@@ -1,13 +1,13 @@
-import pandas as pd
 import math
 import statistics
+from modelinputs import read_table
 from techstaff import TechStaff
 
 # File path to tech_labour_hours.xlsx
 tech_labour_hours_path = "model_inputs/labour_reports/tech_labour_hours.xlsx"
 
 # Read "General Summary" into a dataframe
-gen_sum_df = pd.read_excel(tech_labour_hours_path, sheet_name="General Summary")
+gen_sum_df = read_table(tech_labour_hours_path, sheet_name="General Summary")
 
 # File path to staff_salaries.xlsx
 staff_salaries_file_path = "model_inputs/labour_reports/staff_salaries.xlsx"
@@ -31,7 +31,7 @@ def read_tech_staff_ref():
              corresponding cost centre.
     """
 
-    tech_staff_df = pd.read_excel(staff_salaries_file_path, sheet_name="Tech Staff")
+    tech_staff_df = read_table(staff_salaries_file_path, sheet_name="Tech Staff")
 
     return tech_staff_df
 
@@ -45,7 +45,7 @@ def read_tech_vac_summary():
                 Value: avg_vac (int)
     """
 
-    vac_sum_df = pd.read_excel(tech_labour_hours_path, sheet_name="Vacation Summary")
+    vac_sum_df = read_table(tech_labour_hours_path, sheet_name="Vacation Summary")
     annual_vac_days_by_level_dict = vac_sum_df.set_index("level")["avg_vac"].to_dict()
 
     return annual_vac_days_by_level_dict
@@ -59,7 +59,7 @@ def read_hours_paid_per_year():
     :return: Float representing number of hours for which a tech is paid in a year.
     """
 
-    hours_paid_per_year = gen_sum_df["hours_paid_per_year"]
+    hours_paid_per_year = gen_sum_df.at[0, "hours_paid_per_year"]
 
     return hours_paid_per_year
 
@@ -71,7 +71,7 @@ def read_semi_prod_days():
     :return: Float representing number of days in a year less weekends, stats, and sick days.
     """
 
-    semi_prod_days_per_year = gen_sum_df["semi_prod_days_per_year"]
+    semi_prod_days_per_year = gen_sum_df.at[0, "semi_prod_days_per_year"]
 
     return semi_prod_days_per_year
 
@@ -83,7 +83,7 @@ def read_hours_per_day():
     :return: Float representing average hours worked per day by a tech.
     """
 
-    avg_hours_per_day = gen_sum_df["avg_hours_per_day"]
+    avg_hours_per_day = gen_sum_df.at[0, "avg_hours_per_day"]
 
     return avg_hours_per_day
 
@@ -98,12 +98,43 @@ def read_tech_staff_salary_sched():
                 Value: year6_hourly_wage (float)
     """
 
-    tech_staff_salary_df = pd.read_excel(staff_salaries_file_path, sheet_name="Tech Staff Salary Sched")
+    tech_staff_salary_df = read_table(staff_salaries_file_path, sheet_name="Tech Staff Salary Sched")
     tech_staff_salary_dict = tech_staff_salary_df.set_index("level")["year6_hourly_wage"].to_dict()
 
     return tech_staff_salary_dict
 
 
+def read_partial_oh_history(cost_centre_name, function, health_auth, partial_oh_history=None, reference_store=None):
+    """
+    Reads the actual and budgeted partial OH for each fiscal year for a cost centre.
+
+    :param cost_centre_name: Name of the cost centre
+    :param function: Function of the cost centre (clinical, renal, imaging)
+    :param health_auth: Health authority under which the cost centre falls
+    :param partial_oh_history: Optional long format DataFrame of partial OH by cost centre and fiscal year (see
+                               generalledger.ingest_general_ledger()); if None, the cost centre's worksheet in
+                               model_inputs/financial_reports/{function}/{health_auth}.xlsx is read instead
+    :param reference_store: Optional ReferenceStore (see referencestore.py) to look the history up in instead of the
+                            worksheet
+    :return: DataFrame with (at least) columns "fiscal_year", "actual_partial_oh", "budgeted_partial_oh"
+    """
+
+    # Use the partial OH history ingested from the general ledger if one was provided
+    if partial_oh_history is not None:
+        return partial_oh_history[partial_oh_history["cost_centre_name"] == cost_centre_name]
+
+    # Then the compiled reference store, if one is in use
+    if reference_store is not None:
+        return reference_store.find_partial_oh_history(cost_centre_name)
+
+    # Otherwise find the appropriate financial report Excel workbook and worksheet to parse
+    file_path = CostCentre.financial_reports_folder_path + "{function}/{health_auth}.xlsx".format(function=function,
+                                                                                               health_auth=health_auth)
+    financials_df = read_table(file_path, sheet_name=cost_centre_name)
+
+    return financials_df
+
+
 """
 ########################################################################################################################
 ######################################## COSTCENTRE CLASS BELOW ########################################################
@@ -132,9 +163,21 @@ class CostCentre:
     # % of time that techs spend doing non-device related work (i.e. attending meetings, assisting clinical staff, etc.)
     OH_TECH_TIME_PERCENTAGE = 0.35
 
+    # % of annual labour hours that techs are productive; 80% is the standard productivity rate cited in literature
+    # after accounting for idle time
+    PRODUCTIVITY_RATE = 0.8
+
     # Path to directory containing financial reports
     financial_reports_folder_path = "model_inputs/financial_reports/"
 
+    # Long format DataFrame of partial OH by cost centre and fiscal year (see generalledger.ingest_general_ledger()); if
+    # set, it is used in place of the worksheets in financial_reports_folder_path
+    partial_oh_history = None
+
+    # Compiled reference store (see referencestore.py) to look up tech staff levels and partial OH history in; if None,
+    # they are taken from tech_staff_df and the worksheets in financial_reports_folder_path
+    reference_store = None
+
     # Average number of hours a tech works in a day
     hours_worked_per_day = read_hours_per_day()
 
@@ -172,6 +215,33 @@ class CostCentre:
         # Weighted average hourly tech wage
         self.weighted_avg_tech_hourly_wage = self.compute_weighted_avg_tech_hourly_wage()
 
+    @classmethod
+    def from_checkpoint(cls, cost_centre_row, assets):
+        """
+        Recreates a CostCentre from the OH and rates saved in a checkpoint (see checkpoint.py) without reading any
+        financial report or regional staff data.
+
+        :param cost_centre_row: Dict with keys "cost_centre_name", "health_auth", "function", "non_labour_oh",
+                                "tech_staff_oh", "regional_staff_oh", "pohr", "weighted_avg_tech_hourly_wage"
+        :param assets: List of Asset objects in this cost centre
+        :return: CostCentre object
+        """
+
+        cost_centre = cls.__new__(cls)
+
+        cost_centre.name = cost_centre_row["cost_centre_name"]
+        cost_centre.assets = assets
+        cost_centre.health_auth = cost_centre_row["health_auth"]
+        cost_centre.function = cost_centre_row["function"]
+        cost_centre.regional_staff_oh = cost_centre_row["regional_staff_oh"]
+        cost_centre.tech_staff = cost_centre.create_tech_staff_objects()
+        cost_centre.tech_staff_oh = cost_centre_row["tech_staff_oh"]
+        cost_centre.non_labour_oh = cost_centre_row["non_labour_oh"]
+        cost_centre.pohr = cost_centre_row["pohr"]
+        cost_centre.weighted_avg_tech_hourly_wage = cost_centre_row["weighted_avg_tech_hourly_wage"]
+
+        return cost_centre
+
     def compute_regional_staff_oh(self, regional_staff):
         """
         Iterates through each regional staff and checks to see if this cost centre is overseen by them. If it is, then
@@ -206,24 +276,26 @@ class CostCentre:
                  "qty" field that indicates the number of staff of that level working at the cost centre.)
         """
 
-        # Pull row from df with information relevant to this cost centre
-        tech_staff_df = self.tech_staff_df[self.tech_staff_df["cost_centre_name"] == self.name]
-
         # Create a list of floats indicating the quantity of techs for each level:
         #      - Level 8 techs at tech_level_qty[0]
         #      - Level 9 techs at tech_level_qty[1]
         #      - Level 10 techs at tech_level_qty[2]
         #      - Level 12 techs at tech_level_qty[3]
-        tech_level_qty = tech_staff_df[["level8", "level9", "level10", "level12"]].values.tolist()[0]
+        if self.reference_store is not None:
+            tech_level_qty = self.reference_store.find_tech_staff_levels(self.name)
+        else:
+            # Pull row from df with information relevant to this cost centre
+            tech_staff_df = self.tech_staff_df[self.tech_staff_df["cost_centre_name"] == self.name]
+            tech_level_qty = tech_staff_df[["level8", "level9", "level10", "level12"]].values.tolist()[0]
 
         # Create TechStaff objects and append them to tech_staff
         tech_staff = []
 
-        for qty in tech_level_qty:
+        for level_index, qty in enumerate(tech_level_qty):
             if qty != 0 and not math.isnan(qty):
 
                 # Create level 8 techs
-                if tech_level_qty.index(qty) == 0:
+                if level_index == 0:
                     tech_staff.append(TechStaff(8,
                                                 qty,
                                                 self.tech_staff_salary_dict.get(8),
@@ -231,7 +303,7 @@ class CostCentre:
                                                 self))
 
                 # Create level 9 techs
-                if tech_level_qty.index(qty) == 1:
+                if level_index == 1:
                     tech_staff.append(TechStaff(9,
                                                 qty,
                                                 self.tech_staff_salary_dict.get(9),
@@ -239,7 +311,7 @@ class CostCentre:
                                                 self))
 
                 # Create level 10 techs
-                if tech_level_qty.index(qty) == 2:
+                if level_index == 2:
                     tech_staff.append(TechStaff(10,
                                                 qty,
                                                 self.tech_staff_salary_dict.get(10),
@@ -247,7 +319,7 @@ class CostCentre:
                                                 self))
 
                 # Create level 12 techs
-                if tech_level_qty.index(qty) == 3:
+                if level_index == 3:
                     tech_staff.append(TechStaff(12,
                                                 qty,
                                                 self.tech_staff_salary_dict.get(12),
@@ -278,9 +350,8 @@ class CostCentre:
         :return: Non-labour OH for this cost centre.
         """
 
-        # Find the appropriate financial report Excel workbook and worksheet to parse
-        file_path = self.financial_reports_folder_path + "{function}/{health_auth}.xlsx".format(function=self.function, health_auth=self.health_auth)
-        financials_df = pd.read_excel(file_path, sheet_name=self.name)
+        financials_df = read_partial_oh_history(self.name, self.function, self.health_auth, self.partial_oh_history,
+                                                self.reference_store)
 
         # Pull actual and budgeted partial OH for each fiscal year into a list
         # For clinical and renal cost centres, partial OH is total expenses less labour expense.
@@ -323,7 +394,7 @@ class CostCentre:
 
         # Take 80% of annual labour hours because 80% is the standard productivity rate cited in literature after
         # accounting for idle time
-        return total_oh / (0.8 * annual_labour_hours)
+        return total_oh / (self.PRODUCTIVITY_RATE * annual_labour_hours)
 
     def compute_weighted_avg_tech_hourly_wage(self):
         """
@@ -0,0 +1,192 @@
+import re
+import numpy as np
+
+"""
+########################################################################################################################
+##################################### MODULE SCOPE FUNCTIONS BELOW #####################################################
+########################################################################################################################
+"""
+
+# Minimum Dice similarity for a reference description to be considered a match
+MIN_DESCRIPTION_SCORE = 0.6
+
+# Minimum Dice similarity for a reference model number to be considered a match
+MIN_MODEL_SCORE = 0.85
+
+# Number of best matching reference descriptions that contribute to a support hours estimate
+MAX_CANDIDATES = 5
+
+
+def normalize_text(text):
+    """
+    Upper-cases text and replaces punctuation with single spaces, e.g. "Pumps, Infusion-General " -> "PUMPS INFUSION
+    GENERAL".
+
+    :param text: String (or any value; non-strings are converted with str())
+    :return: Normalized string
+    """
+
+    return " ".join(re.sub(r"[^0-9A-Z]+", " ", str(text).upper()).split())
+
+
+def extract_features(text):
+    """
+    Breaks normalized text into the features used for matching: every whole word plus every character trigram of each
+    word padded with spaces (so "PUMPS" gives "PUMPS", " PU", "PUM", "UMP", "MPS", "PS ").
+
+    :param text: Normalized string
+    :return: Set of feature strings
+    """
+
+    features = set()
+
+    for word in text.split():
+        features.add(word)
+        padded = " " + word + " "
+        for start in range(len(padded) - 2):
+            features.add(padded[start:start + 3])
+
+    return features
+
+
+"""
+########################################################################################################################
+################################### NGRAMINVERTEDINDEX CLASS BELOW #####################################################
+########################################################################################################################
+"""
+
+
+class NgramInvertedIndex:
+    """
+    Inverted index from word/trigram features to the strings that contain them. A query only touches the posting lists
+    of its own features, so its cost depends on the query rather than on the number of indexed strings.
+    """
+
+    def __init__(self, keys):
+        """
+        :param keys: List of strings to index; query results refer to positions in this list
+        """
+
+        # Indexed strings
+        self.keys = list(keys)
+
+        postings = {}
+        num_features = np.zeros(len(self.keys), dtype=np.int32)
+
+        for position, key in enumerate(self.keys):
+            features = extract_features(normalize_text(key))
+            num_features[position] = len(features)
+            for feature in features:
+                postings.setdefault(feature, []).append(position)
+
+        # Dict with key: feature and value: array of positions of the keys that contain it
+        self.postings = {feature: np.array(positions, dtype=np.int32) for feature, positions in postings.items()}
+        # Number of distinct features of each key
+        self.num_features = num_features
+
+    def search(self, query, min_score, max_candidates=MAX_CANDIDATES):
+        """
+        Finds the indexed strings most similar to query by Dice similarity of their feature sets:
+            2 * shared features / (query features + key features)
+
+        :param query: String to look up
+        :param min_score: Minimum similarity for a key to be returned
+        :param max_candidates: Maximum number of keys to return
+        :return: List of (position, score) tuples, best match first
+        """
+
+        features = extract_features(normalize_text(query))
+        posting_lists = [self.postings[feature] for feature in features if feature in self.postings]
+
+        if not posting_lists:
+            return []
+
+        # Count shared features for every key that shares at least one
+        positions, shared = np.unique(np.concatenate(posting_lists), return_counts=True)
+        scores = 2 * shared / (len(features) + self.num_features[positions])
+
+        keep = scores >= min_score
+        positions = positions[keep]
+        scores = scores[keep]
+
+        best = np.argsort(-scores, kind="stable")[:max_candidates]
+
+        return [(int(positions[index]), float(scores[index])) for index in best]
+
+
+"""
+########################################################################################################################
+##################################### DESCRIPTIONINDEX CLASS BELOW #####################################################
+########################################################################################################################
+"""
+
+
+class DescriptionIndex:
+    """
+    Fuzzy lookup of annual support hours for assets whose model number and asset description have no exact match in
+    asset_support_hours_reference.xlsx.
+    """
+
+    def __init__(self, asset_support_hours_df):
+        """
+        :param asset_support_hours_df: DataFrame returned by budgetreport.read_asset_support_hours_reference()
+        """
+
+        reference_df = asset_support_hours_df.dropna(subset=["model_number"])
+
+        # Mean support hours for each model number, as in BudgetReport.compute_asset_support_hours()
+        model_hours_series = reference_df.groupby("model_number")["avg_support_hour_per_model"].mean()
+        self.model_numbers = model_hours_series.index.tolist()
+        self.model_hours = model_hours_series.to_numpy(dtype=np.float64)
+        self.model_index = NgramInvertedIndex([str(model_num) for model_num in self.model_numbers])
+
+        # Count-weighted average support hours and total asset count for each description
+        description_model_df = reference_df.groupby(["asset_description", "model_number"]).agg(
+            {"avg_support_hour_per_model": "mean", "count_asset": "sum"})
+        description_model_df["weighted_hours"] = (description_model_df["avg_support_hour_per_model"] *
+                                                  description_model_df["count_asset"])
+        description_df = description_model_df.groupby(level="asset_description")[["weighted_hours",
+                                                                                   "count_asset"]].sum()
+        description_df = description_df[description_df["count_asset"] > 0]
+
+        self.descriptions = description_df.index.tolist()
+        self.description_hours = (description_df["weighted_hours"] / description_df["count_asset"]).to_numpy()
+        self.description_counts = description_df["count_asset"].to_numpy(dtype=np.float64)
+        self.description_index = NgramInvertedIndex(self.descriptions)
+
+    def estimate_support_hours(self, model_num, description):
+        """
+        Estimates annual support hours for an asset:
+            1. If a reference model number is at least MIN_MODEL_SCORE similar, use that model's support hours
+            2. Otherwise, average the support hours of the (up to MAX_CANDIDATES) reference descriptions that are at
+               least MIN_DESCRIPTION_SCORE similar, weighted by similarity score * asset count
+
+        :param model_num: Model number of the asset
+        :param description: Asset description
+        :return: Tuple (support hours, match), where match is a string describing the reference entries used, or
+                 (0, None) if nothing is similar enough
+        """
+
+        model_matches = self.model_index.search(model_num, MIN_MODEL_SCORE, 1)
+
+        if model_matches:
+            position, score = model_matches[0]
+            return self.model_hours[position], "fuzzy model number: {model} ({score:.2f})".format(
+                model=self.model_numbers[position], score=score)
+
+        description_matches = self.description_index.search(description, MIN_DESCRIPTION_SCORE)
+
+        if not description_matches:
+            return 0, None
+
+        positions = np.array([position for position, score in description_matches])
+        weights = np.array([score for position, score in description_matches]) * self.description_counts[positions]
+        support_hours = float(np.sum(weights * self.description_hours[positions]) / np.sum(weights))
+
+        position, score = description_matches[0]
+        match = "fuzzy description: {description} ({score:.2f})".format(description=self.descriptions[position],
+                                                                         score=score)
+        if len(description_matches) > 1:
+            match += " + {count} more".format(count=len(description_matches) - 1)
+
+        return support_hours, match
@@ -0,0 +1,558 @@
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+from budgetreport import BudgetReport, as_float, read_asset_support_hours_reference
+from costcentre import CostCentre
+from generalledger import read_cost_centre_codes_reference
+from livebudget import LiveBudget
+from pricematrix import build_price_matrix
+from asset import function_from_shop_code
+from descriptionindex import DescriptionIndex
+from fixedpoint import compute_asset_costs_cents, compute_cost_centre_rates_cents, to_dollars
+from modelinputs import read_table, read_table_chunks
+from referencearrays import build_reference_arrays, build_support_hours_lookup
+from servicecontracts import read_service_contract_catalogue, resolve_service_contract_costs
+from staffingoptimizer import build_staffing_problems, optimize_staffing, solve_staffing_problem
+from streaming import partition_by_cost_centre, read_partition
+from vectorengine import compute_cost_centre_rates
+
+"""
+########################################################################################################################
+##################################### MODULE SCOPE FUNCTIONS BELOW #####################################################
+########################################################################################################################
+
+Equivalence harness: runs the legacy object model (Asset, CostCentre, TechStaff, RegionalStaff,
+BudgetReport.compute_asset_support_hours()) and a candidate path on the same asset input and compares every per-cost
+centre and per-asset number within a tolerance.
+
+Every path is a function that takes a DataFrame laid out like the "User Input" sheet and returns a tuple
+(cost_centre_results, asset_results) of DataFrames with the columns in COST_CENTRE_COLUMNS and ASSET_COLUMNS. Register
+new engines in CANDIDATE_PATHS so that they can be checked from the command line:
+
+    $ python equivalence.py --path vectorized --rows 50000
+
+check_live_budget() checks instead that a LiveBudget holding the input is left unchanged by updates that fail:
+
+    $ python equivalence.py --live-budget
+
+check_staffing_optimizer() checks that every cost centre's current tech level mix covers its own workload and is never
+cheaper than the mix staffingoptimizer.py recommends:
+
+    $ python equivalence.py --staffing
+
+check_stream_partitions() checks that streaming.py spills every input line to its own cost centre's partition, by
+default with a chunk size that leaves a one-row last chunk:
+
+    $ python equivalence.py --stream-partitions --chunk-size 7
+"""
+
+# Key and value columns compared for each cost centre
+COST_CENTRE_COLUMNS = ["cost_centre_name", "non_labour_oh", "tech_staff_oh", "regional_staff_oh", "total_oh", "pohr",
+                       "weighted_avg_tech_hourly_wage"]
+
+# Key and value columns compared for each asset; "input_row" is the asset's zero-based row in the input
+ASSET_COLUMNS = ["input_row", "cost_centre_name", "avg_support_hours", "cost_to_service_per_asset",
+                 "total_cost_to_service"]
+
+# Default tolerances: relative 1e-9 and absolute one hundredth of a cent
+DEFAULT_RTOL = 1e-9
+DEFAULT_ATOL = 1e-4
+
+
+def read_asset_input():
+    """
+    Reads the "User Input" sheet of budget_report_input.xlsx.
+
+    :return: DataFrame with columns "model_num", "asset_description", "quantity", "health_auth", "site_code",
+             "shop_code"
+    """
+
+    return read_table(BudgetReport.budget_report_input_file_path, sheet_name="User Input")
+
+
+def generate_asset_input(num_rows, seed=0, unknown_model_share=0.2):
+    """
+    Generates a large, valid asset input by sampling sites, shop codes, model numbers and descriptions from the
+    reference workbooks. Sites are limited to those that resolve to a cost centre with tech staff, so that the legacy
+    object model can run on the result.
+
+    :param num_rows: Number of asset rows to generate
+    :param seed: Random seed
+    :param unknown_model_share: Share of rows whose model number isn't in the support hours reference, so that the
+                                asset description fallback is exercised
+    :return: DataFrame laid out like the "User Input" sheet
+    """
+
+    rng = np.random.default_rng(seed)
+
+    cc_reference_df = read_cost_centre_codes_reference().set_index("cost_centre_name")
+    staffed_cost_centres = set(CostCentre.tech_staff_df["cost_centre_name"])
+    support_hours_df = read_asset_support_hours_reference()
+
+    # Sample (site, shop code) combinations that resolve to a staffed cost centre of the same function (the legacy
+    # model reads the financial report of the asset's function, which doesn't exist for a fallback cost centre)
+    price_matrix = build_price_matrix()
+    shop_codes = {"clinical": ["WHITE", "BLUE", "GEN"], "renal": ["REN", "FHA_R"], "imaging": ["IMAG", "IMAG0"]}
+    combinations = [(site_code, shop_code, cost_centre)
+                    for (site_code, function), cost_centre in price_matrix.site_cost_centres.items()
+                    if cost_centre in staffed_cost_centres and cc_reference_df.at[cost_centre, "function"] == function
+                    for shop_code in shop_codes[function]]
+    picks = rng.integers(0, len(combinations), num_rows)
+
+    support_rows = rng.integers(0, len(support_hours_df), num_rows)
+    model_nums = support_hours_df["model_number"].to_numpy(dtype=object)[support_rows]
+    unknown = rng.random(num_rows) < unknown_model_share
+    model_nums[unknown] = ["UNKNOWN-{row}".format(row=row) for row in np.flatnonzero(unknown)]
+
+    quantities = rng.integers(1, 10, num_rows) * rng.choice([-1, 1], num_rows)
+
+    return pd.DataFrame({"model_num": model_nums,
+                         "asset_description": support_hours_df["asset_description"].to_numpy(dtype=object)[
+                             support_rows],
+                         "quantity": quantities,
+                         "health_auth": [cc_reference_df.at[combinations[pick][2], "health_authority"]
+                                         for pick in picks],
+                         "site_code": [combinations[pick][0] for pick in picks],
+                         "shop_code": [combinations[pick][1] for pick in picks]})
+
+
+def run_legacy_path(input_df):
+    """
+    Runs the legacy object model on input_df.
+
+    :param input_df: DataFrame laid out like the "User Input" sheet
+    :return: Tuple (cost_centre_results, asset_results) of DataFrames
+    """
+
+    budget_report = BudgetReport()
+    assets = budget_report.create_asset_objects(input_df, collapse_duplicates=False)
+    input_rows = {id(asset): row for row, asset in enumerate(assets)}
+
+    budget_report.create_cost_centre_objects(assets, budget_report)
+    budget_report.compute_asset_support_hours()
+    budget_report.compute_service_contract_costs()
+
+    cost_centre_rows = []
+    asset_rows = []
+
+    for name, cost_centre in budget_report.cost_centres.items():
+        pohr = as_float(cost_centre.pohr)
+        wage = as_float(cost_centre.weighted_avg_tech_hourly_wage)
+
+        cost_centre_rows.append([name,
+                                 as_float(cost_centre.non_labour_oh),
+                                 as_float(cost_centre.tech_staff_oh),
+                                 as_float(cost_centre.regional_staff_oh),
+                                 as_float(cost_centre.non_labour_oh + cost_centre.tech_staff_oh +
+                                          cost_centre.regional_staff_oh),
+                                 pohr,
+                                 wage])
+
+        for asset in cost_centre.assets:
+            costs = budget_report.compute_asset_costs(cost_centre, asset, asset.qty)
+            asset_rows.append([input_rows[id(asset)],
+                               name,
+                               as_float(asset.avg_support_hours),
+                               costs["cost_to_service_per_asset"],
+                               costs["total_cost_to_service"]])
+
+    return (pd.DataFrame(cost_centre_rows, columns=COST_CENTRE_COLUMNS),
+            pd.DataFrame(asset_rows, columns=ASSET_COLUMNS).sort_values("input_row", ignore_index=True))
+
+
+def resolve_asset_input(input_df):
+    """
+    Resolves each asset of input_df to its cost centre, annual support hours and service contract cost using the
+    precomputed site resolution and support hours lookups of pricematrix and one catalogue join, in place of Asset,
+    BudgetReport.compute_asset_support_hours() and BudgetReport.compute_service_contract_costs().
+
+    :param input_df: DataFrame laid out like the "User Input" sheet
+    :return: Tuple (asset_cost_centres, cost_centre_names, support_hours, service_contract_costs): Series of each
+             asset's cost centre name, list of cost centre names in order of first appearance, and 1-D arrays of each
+             asset's support hours and service contract cost
+    """
+
+    price_matrix = build_price_matrix()
+    model_hours, description_hours = build_support_hours_lookup(read_asset_support_hours_reference())
+
+    site_codes = input_df["site_code"].str.strip()
+    functions = input_df["shop_code"].str.strip().map(function_from_shop_code)
+    asset_cost_centres = pd.Series([price_matrix.site_cost_centres[key] for key in zip(site_codes, functions)])
+
+    # Cost centres in order of first appearance, as in BudgetReport.create_cost_centre_objects()
+    cost_centre_names = asset_cost_centres.drop_duplicates().tolist()
+
+    # Support hours by model number, falling back to asset description, then to the fuzzy description index
+    descriptions = input_df["asset_description"].str.strip()
+    model_matched = input_df["model_num"].isin(model_hours.keys())
+    description_matched = descriptions.isin(description_hours.keys())
+
+    support_hours = input_df["model_num"].map(model_hours)
+    description_support_hours = descriptions.map(description_hours).fillna(0)
+    support_hours = support_hours.where(model_matched, description_support_hours)
+
+    unmatched = ~model_matched & ~description_matched
+    if unmatched.any():
+        description_index = DescriptionIndex(read_asset_support_hours_reference())
+        support_hours[unmatched] = [description_index.estimate_support_hours(model_num, description)[0]
+                                    for model_num, description in zip(input_df.loc[unmatched, "model_num"],
+                                                                      descriptions[unmatched])]
+
+    # Service contract costs of imaging assets only, which are the only ones with a service contract column
+    imaging = (functions == "imaging").to_numpy()
+    service_contract_costs = np.zeros(len(input_df))
+    imaging_df = pd.DataFrame({"model_number": input_df["model_num"].to_numpy()[imaging],
+                               "health_auth": input_df["health_auth"].to_numpy()[imaging],
+                               "site_code": site_codes.to_numpy()[imaging]})
+    service_contract_costs[imaging] = resolve_service_contract_costs(imaging_df, read_service_contract_catalogue(),
+                                                                     BudgetReport.service_contract_date)[0]
+
+    return asset_cost_centres, cost_centre_names, support_hours.to_numpy(dtype=np.float64), service_contract_costs
+
+
+def run_vectorized_path(input_df):
+    """
+    Runs the array-based engine (referencearrays, vectorengine) on input_df, with assets resolved by
+    resolve_asset_input().
+
+    :param input_df: DataFrame laid out like the "User Input" sheet
+    :return: Tuple (cost_centre_results, asset_results) of DataFrames
+    """
+
+    asset_cost_centres, cost_centre_names, support_hours, service_contract_costs = resolve_asset_input(input_df)
+
+    arrays = build_reference_arrays(cost_centre_names)
+    rates = compute_cost_centre_rates(arrays, CostCentre.OH_TECH_TIME_PERCENTAGE, CostCentre.PRODUCTIVITY_RATE)
+
+    cost_centre_results = pd.DataFrame({"cost_centre_name": cost_centre_names,
+                                        "non_labour_oh": rates["non_labour_oh"],
+                                        "tech_staff_oh": rates["tech_staff_oh"],
+                                        "regional_staff_oh": rates["regional_staff_oh"],
+                                        "total_oh": rates["total_oh"],
+                                        "pohr": rates["pohr"],
+                                        "weighted_avg_tech_hourly_wage": rates["weighted_avg_tech_hourly_wage"]})
+
+    cc_index = pd.Index(cost_centre_names).get_indexer(asset_cost_centres)
+    pohr = rates["pohr"][cc_index]
+    wage = rates["weighted_avg_tech_hourly_wage"][cc_index]
+    cost_to_service_per_asset = pohr * support_hours + wage * support_hours + service_contract_costs
+
+    asset_results = pd.DataFrame({"input_row": np.arange(len(input_df)),
+                                  "cost_centre_name": asset_cost_centres,
+                                  "avg_support_hours": support_hours,
+                                  "cost_to_service_per_asset": cost_to_service_per_asset,
+                                  "total_cost_to_service": cost_to_service_per_asset *
+                                  input_df["quantity"].to_numpy(dtype=np.float64)})
+
+    return cost_centre_results, asset_results
+
+
+def run_fixed_point_path(input_df):
+    """
+    Runs the fixed-point engine (fixedpoint) on input_df, with assets resolved by resolve_asset_input(), and converts
+    its cents back to dollars.
+
+    :param input_df: DataFrame laid out like the "User Input" sheet
+    :return: Tuple (cost_centre_results, asset_results) of DataFrames
+    """
+
+    asset_cost_centres, cost_centre_names, support_hours, service_contract_costs = resolve_asset_input(input_df)
+
+    arrays = build_reference_arrays(cost_centre_names)
+    rates = compute_cost_centre_rates_cents(arrays, CostCentre.OH_TECH_TIME_PERCENTAGE,
+                                            CostCentre.PRODUCTIVITY_RATE)
+    costs = compute_asset_costs_cents(rates, pd.Index(cost_centre_names).get_indexer(asset_cost_centres),
+                                      support_hours, input_df["quantity"].to_numpy(dtype=np.float64),
+                                      service_contract_costs)
+
+    cost_centre_results = pd.DataFrame({"cost_centre_name": cost_centre_names,
+                                        "non_labour_oh": to_dollars(rates["non_labour_oh"]),
+                                        "tech_staff_oh": to_dollars(rates["tech_staff_oh"]),
+                                        "regional_staff_oh": to_dollars(rates["regional_staff_oh"]),
+                                        "total_oh": to_dollars(rates["total_oh"]),
+                                        "pohr": to_dollars(rates["pohr"]),
+                                        "weighted_avg_tech_hourly_wage": to_dollars(
+                                            rates["weighted_avg_tech_hourly_wage"])})
+
+    asset_results = pd.DataFrame({"input_row": np.arange(len(input_df)),
+                                  "cost_centre_name": asset_cost_centres,
+                                  "avg_support_hours": support_hours,
+                                  "cost_to_service_per_asset": to_dollars(costs["cost_to_service_per_asset"]),
+                                  "total_cost_to_service": to_dollars(costs["total_cost_to_service"])})
+
+    return cost_centre_results, asset_results
+
+
+# Candidate paths that can be compared against the legacy object model
+CANDIDATE_PATHS = {"vectorized": run_vectorized_path,
+                   "fixed-point": run_fixed_point_path}
+
+# Default (rtol, atol) for paths that round differently from the legacy floats: the fixed-point engine rounds POHR and
+# tech $/hr to the cent, so per-asset costs can differ by up to a cent per support hour
+CANDIDATE_TOLERANCES = {"fixed-point": (1e-3, 0.1)}
+
+
+def compare_tables(table_name, reference_df, candidate_df, key, rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+    """
+    Compares two result tables row by row on key. Numeric columns are compared with numpy.isclose(); other columns
+    must match exactly. Rows missing from either table are reported as divergences too.
+
+    :param table_name: Name of the table, used in the report
+    :param reference_df: Result table from the legacy path
+    :param candidate_df: Result table from the candidate path
+    :param key: Column that identifies a row
+    :param rtol: Relative tolerance
+    :param atol: Absolute tolerance
+    :return: DataFrame of divergences with columns "table", "key", "column", "reference", "candidate",
+             "abs_difference", "context" (the full reference and candidate rows)
+    """
+
+    merged_df = reference_df.merge(candidate_df, on=key, how="outer", suffixes=("_reference", "_candidate"),
+                                   indicator=True, sort=True)
+    value_columns = [column for column in reference_df.columns if column != key]
+
+    divergences = []
+
+    for column in value_columns:
+        reference = merged_df[column + "_reference"]
+        candidate = merged_df[column + "_candidate"]
+
+        if pd.api.types.is_numeric_dtype(reference) and pd.api.types.is_numeric_dtype(candidate):
+            matches = np.isclose(reference.to_numpy(dtype=np.float64), candidate.to_numpy(dtype=np.float64),
+                                 rtol=rtol, atol=atol, equal_nan=True)
+            abs_difference = (reference - candidate).abs()
+        else:
+            matches = (reference == candidate).to_numpy()
+            abs_difference = pd.Series(np.nan, index=merged_df.index)
+
+        matches = matches & (merged_df["_merge"] == "both").to_numpy()
+
+        for row in np.flatnonzero(~matches):
+            divergences.append({"table": table_name,
+                                "key": merged_df.at[row, key],
+                                "column": column,
+                                "reference": reference.iat[row],
+                                "candidate": candidate.iat[row],
+                                "abs_difference": abs_difference.iat[row],
+                                "context": merged_df.iloc[row].drop("_merge").to_dict()})
+
+    divergences_df = pd.DataFrame(divergences, columns=["table", "key", "column", "reference", "candidate",
+                                                        "abs_difference", "context"])
+
+    return divergences_df.sort_values(["key", "column"], ignore_index=True)
+
+
+def check_equivalence(input_df, candidate_path, rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+    """
+    Runs the legacy object model and candidate_path on the same input and compares every per-cost centre and per-asset
+    number.
+
+    :param input_df: DataFrame laid out like the "User Input" sheet
+    :param candidate_path: Function taking input_df and returning (cost_centre_results, asset_results)
+    :param rtol: Relative tolerance
+    :param atol: Absolute tolerance
+    :return: DataFrame of divergences (see compare_tables()); empty if the paths are equivalent
+    """
+
+    reference_cost_centres, reference_assets = run_legacy_path(input_df)
+    candidate_cost_centres, candidate_assets = candidate_path(input_df)
+
+    return pd.concat([compare_tables("cost_centre", reference_cost_centres, candidate_cost_centres,
+                                     "cost_centre_name", rtol, atol),
+                      compare_tables("asset", reference_assets, candidate_assets, "input_row", rtol, atol)],
+                     ignore_index=True)
+
+
+def check_live_budget(input_df, unknown_site_code="ZZZ"):
+    """
+    Loads input_df into a LiveBudget, tries to move every asset line to a site code that isn't in the price matrix, and
+    checks that each failed update left the asset lines and every running total as they were.
+
+    :param input_df: DataFrame laid out like the "User Input" sheet
+    :param unknown_site_code: Site code that no cost centre serves
+    :return: List of problems found; empty if every failed update left the budget unchanged
+    """
+
+    budget = LiveBudget(build_price_matrix())
+    asset_ids = budget.load_assets(input_df)
+
+    assets = {asset_id: dict(asset) for asset_id, asset in budget.assets.items()}
+    cost_centres = {name: dict(totals) for name, totals in budget.cost_centres.items()}
+    totals = (budget.total_cost_to_service_cents, budget.total_support_hours_fixed)
+
+    problems = []
+
+    for asset_id in asset_ids:
+        try:
+            budget.update_asset(asset_id, site_code=unknown_site_code)
+        except KeyError:
+            continue
+        problems.append("Asset line {asset_id} was moved to site {site_code}".format(asset_id=asset_id,
+                                                                                    site_code=unknown_site_code))
+
+    if budget.assets != assets:
+        problems.append("Asset lines changed")
+    if budget.cost_centres != cost_centres:
+        problems.append("Cost centre totals changed")
+    if (budget.total_cost_to_service_cents, budget.total_support_hours_fixed) != totals:
+        problems.append("Overall totals changed")
+
+    return problems
+
+
+def check_staffing_optimizer(atol=DEFAULT_ATOL, processes=None):
+    """
+    Solves the staffing problem of every cost centre with its workload left as is, and checks that the current mix is
+    feasible and costs no less than the optimal one.
+
+    :param atol: Absolute tolerance on the savings, in dollars
+    :param processes: Number of worker processes; defaults to the number of cores
+    :return: List of problems found; empty if every current mix is feasible and no cheaper than the optimum
+    """
+
+    arrays = build_reference_arrays()
+    optimization_df = optimize_staffing(arrays, CostCentre.OH_TECH_TIME_PERCENTAGE, CostCentre.PRODUCTIVITY_RATE,
+                                        processes=processes)
+
+    # The current mix alone, as a problem whose only headcount combination is that mix
+    current_problems = build_staffing_problems(arrays, optimization_df["workload_hours"].to_numpy(),
+                                               CostCentre.OH_TECH_TIME_PERCENTAGE, CostCentre.PRODUCTIVITY_RATE,
+                                               min_headcount=arrays["level_qty"], max_headcount=arrays["level_qty"])
+
+    problems = []
+
+    for problem, row in zip(current_problems, optimization_df.itertuples(index=False)):
+        if not solve_staffing_problem(problem)["feasible"]:
+            problems.append("{name}: current mix doesn't cover its own workload".format(name=row.cost_centre_name))
+        if not row.feasible:
+            problems.append("{name}: no feasible mix found".format(name=row.cost_centre_name))
+        elif row.savings < -atol:
+            problems.append("{name}: current mix is {amount:,.2f} cheaper than the optimum".format(
+                name=row.cost_centre_name, amount=-row.savings))
+
+    return problems
+
+
+def check_stream_partitions(chunk_size=None):
+    """
+    Partitions budget_report_input.xlsx by cost centre a chunk at a time, as a streaming run does, and checks each
+    partition against the input lines the whole input resolves to that cost centre.
+
+    :param chunk_size: Number of input rows read at a time; defaults to one less than the number of input rows, so that
+                       the last chunk has a single row
+    :return: List of problems found; empty if every partition holds exactly its cost centre's lines
+    """
+
+    input_df = pd.concat(read_table_chunks(BudgetReport.budget_report_input_file_path, "User Input"))
+    if chunk_size is None:
+        chunk_size = max(len(input_df) - 1, 1)
+
+    budget_report = BudgetReport()
+    line_cost_centres = pd.Series([asset.cost_centre for asset in
+                                   budget_report.create_asset_objects(input_df, collapse_duplicates=False)],
+                                  index=input_df.index)
+
+    problems = []
+
+    with tempfile.TemporaryDirectory() as folder_path:
+        chunks = read_table_chunks(BudgetReport.budget_report_input_file_path, "User Input", chunk_size)
+        partition_paths = partition_by_cost_centre(chunks, budget_report, folder_path)
+
+        for cost_centre_name, file_path in partition_paths.items():
+            partition_rows = list(read_partition(file_path).index)
+            expected_rows = [row for row, name in line_cost_centres.items() if name == cost_centre_name]
+            if not expected_rows:
+                problems.append("Partition {name!r} is not a cost centre".format(name=cost_centre_name))
+            elif partition_rows != expected_rows:
+                problems.append("Partition {name} is missing rows {missing} and has extra rows {extra}".format(
+                    name=cost_centre_name, missing=sorted(set(expected_rows) - set(partition_rows)),
+                    extra=sorted(set(partition_rows) - set(expected_rows))))
+
+    for cost_centre_name in set(line_cost_centres) - set(partition_paths):
+        problems.append("No partition for {name}".format(name=cost_centre_name))
+
+    return problems
+
+
+def main():
+    """
+    Checks a candidate path against the legacy object model on the real input or a generated one, and prints the first
+    divergences.
+
+    :return: None
+    """
+
+    parser = argparse.ArgumentParser(description="Compare an optimized path against the legacy object model")
+    parser.add_argument("--path", choices=sorted(CANDIDATE_PATHS), default="vectorized")
+    parser.add_argument("--rows", type=int, default=None,
+                        help="Generate an input with this many rows instead of using budget_report_input.xlsx")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rtol", type=float, default=None,
+                        help="Relative tolerance (default: {rtol}, or the path's entry in CANDIDATE_TOLERANCES)".format(
+                            rtol=DEFAULT_RTOL))
+    parser.add_argument("--atol", type=float, default=None,
+                        help="Absolute tolerance (default: {atol}, or the path's entry in CANDIDATE_TOLERANCES)".format(
+                            atol=DEFAULT_ATOL))
+    parser.add_argument("--show", type=int, default=10, help="Number of divergences to print")
+    parser.add_argument("--live-budget", action="store_true",
+                        help="Check that LiveBudget updates that fail leave the budget unchanged instead of comparing "
+                             "a path")
+    parser.add_argument("--staffing", action="store_true",
+                        help="Check that no current tech level mix is infeasible or cheaper than the optimized one "
+                             "instead of comparing a path")
+    parser.add_argument("--stream-partitions", action="store_true",
+                        help="Check that a streaming run partitions the input by cost centre instead of comparing a "
+                             "path")
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help="Rows per chunk for --stream-partitions (default: one less than the number of input rows)")
+    args = parser.parse_args()
+
+    if args.stream_partitions:
+        problems = check_stream_partitions(args.chunk_size)
+        for problem in problems:
+            print("  " + problem)
+        print("{count} problems in stream partitions".format(count=len(problems)))
+        return
+
+    if args.staffing:
+        problems = check_staffing_optimizer()
+        for problem in problems:
+            print("  " + problem)
+        print("{count} problems in staffing optimization".format(count=len(problems)))
+        return
+
+    if args.rows is None:
+        input_df = read_asset_input()
+    else:
+        input_df = generate_asset_input(args.rows, args.seed)
+
+    if args.live_budget:
+        problems = check_live_budget(input_df)
+        for problem in problems:
+            print("  " + problem)
+        print("{count} problems in LiveBudget updates of {rows} assets".format(count=len(problems), rows=len(input_df)))
+        return
+
+    rtol, atol = CANDIDATE_TOLERANCES.get(args.path, (DEFAULT_RTOL, DEFAULT_ATOL))
+    if args.rtol is not None:
+        rtol = args.rtol
+    if args.atol is not None:
+        atol = args.atol
+
+    divergences_df = check_equivalence(input_df, CANDIDATE_PATHS[args.path], rtol, atol)
+
+    if divergences_df.empty:
+        print("{path} path matches the legacy object model on {rows} assets".format(path=args.path,
+                                                                                   rows=len(input_df)))
+    else:
+        print("{count} divergences; first {show}:".format(count=len(divergences_df), show=args.show))
+        for divergence in divergences_df.head(args.show).itertuples(index=False):
+            print("  {table} {key} {column}: reference={reference} candidate={candidate}".format(
+                **divergence._asdict()))
+            print("    context: {context}".format(context=divergence.context))
+
+
+if __name__ == "__main__":
+
+    main()
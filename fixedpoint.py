@@ -0,0 +1,387 @@
+import math
+import numpy as np
+import pandas as pd
+from vectorengine import as_scenario_column
+
+"""
+########################################################################################################################
+##################################### MODULE SCOPE FUNCTIONS BELOW #####################################################
+########################################################################################################################
+
+Fixed-point equivalent of vectorengine: every amount of money is carried as int64 cents and every other quantity (hours,
+days, headcount, percentages and multipliers) as an int64 number of millionths, so results are exact and identical on
+every machine and do not drift as more terms are summed.
+
+Values are rounded only at the following points, always to the nearest unit with halves rounded away from zero (the
+same as Excel's ROUND):
+    1. Inputs: dollar amounts are rounded to cents and other quantities to millionths (to_cents(), to_fixed())
+    2. Annual salary of one tech of each level: hourly wage * hours paid per year
+    3. Annual salary of all techs of a level at a cost centre: headcount * annual salary of one tech
+    4. Total compensation: annual salary * benefits multiplier, for each cost centre's techs and each regional staff
+    5. Tech staff OH: total tech compensation * % of tech time spent on non-device related work
+    6. Non-labour OH: mean over fiscal years of the larger of actual and budgeted partial OH
+    7. Annual labour hours (to millionths of an hour) and productive labour hours = productivity rate * labour hours
+    8. POHR (cents per hour): total OH / productive labour hours
+    9. Weighted average tech hourly wage (cents per hour)
+    10. Per-asset OH and direct cost: support hours * POHR and support hours * tech hourly wage
+    11. Total cost to service: cost to service per asset * quantity
+
+Sums are never rounded. A regional staff's total compensation is split across the cost centres they oversee with the
+largest remainder method: every cost centre gets the whole cents of an even split and the cents left over go one each to
+the cost centres that come first alphabetically, so the shares always add back up to the staff's total compensation.
+"""
+
+# Integer units in a dollar
+CENTS_PER_DOLLAR = 100
+
+# Integer units in one hour, day, staff, or in a percentage or multiplier of 1
+SCALE = 10 ** 6
+
+# Largest magnitude an intermediate product may reach; guards against silent int64 overflow
+MAX_INTERMEDIATE = 2 ** 62
+
+
+def to_fixed(values, scale):
+    """
+    Rounds values to the nearest 1 / scale and returns them as integers, halves away from zero. Values are first rounded
+    to 6 decimal places of the scaled amount so that binary representation error can't move a half (e.g. 1.005 dollars
+    is stored as 1.00499999..., but is still rounded to 101 cents).
+
+    :param values: Scalar or array of floats; must not contain NaN
+    :param scale: Integer units per 1 (e.g. CENTS_PER_DOLLAR)
+    :return: int64 array of values * scale
+    """
+
+    scaled = np.round(np.asarray(values, dtype=np.float64) * scale, 6)
+
+    if np.any(np.abs(scaled) >= 2 ** 53):
+        raise OverflowError("Value too large to convert to a fixed-point integer exactly")
+
+    return (np.sign(scaled) * np.floor(np.abs(scaled) + 0.5)).astype(np.int64)
+
+
+def scalar_to_fixed(value, scale):
+    """
+    Same as to_fixed() for a single number, with plain Python arithmetic; much faster than NumPy for one value at a
+    time.
+
+    :param value: Float
+    :param scale: Integer units per 1 (e.g. CENTS_PER_DOLLAR)
+    :return: Python int
+    """
+
+    scaled = round(float(value) * scale, 6)
+
+    if abs(scaled) >= 2 ** 53:
+        raise OverflowError("Value too large to convert to a fixed-point integer exactly")
+
+    return int(math.copysign(math.floor(abs(scaled) + 0.5), scaled))
+
+
+def to_cents(dollars):
+    """
+    Rounds dollar amounts to int64 cents.
+
+    :param dollars: Scalar or array of dollar amounts
+    :return: int64 array of cents
+    """
+
+    return to_fixed(dollars, CENTS_PER_DOLLAR)
+
+
+def to_dollars(cents):
+    """
+    Converts cents back to float dollars for display or for comparison with the float engines.
+
+    :param cents: Scalar or array of cents
+    :return: Float array of dollars
+    """
+
+    return np.asarray(cents, dtype=np.float64) / CENTS_PER_DOLLAR
+
+
+def multiply(a, b):
+    """
+    Multiplies two int64 arrays, raising OverflowError instead of wrapping around if any product is too large.
+
+    :param a: int64 array
+    :param b: int64 array that broadcasts against a
+    :return: int64 array a * b
+    """
+
+    a = np.asarray(a, dtype=np.int64)
+    b = np.asarray(b, dtype=np.int64)
+
+    if a.size and b.size:
+        largest_a = int(np.max(np.abs(a)))
+        largest_b = int(np.max(np.abs(b)))
+        if largest_a * largest_b > MAX_INTERMEDIATE:
+            raise OverflowError("Fixed-point product out of int64 range")
+
+    return a * b
+
+
+def round_divide(numerator, denominator):
+    """
+    Divides integers and rounds the quotient to the nearest integer, halves away from zero.
+
+    :param numerator: int64 array
+    :param denominator: int64 array of positive integers that broadcasts against numerator
+    :return: int64 array
+    """
+
+    numerator = np.asarray(numerator, dtype=np.int64)
+    denominator = np.asarray(denominator, dtype=np.int64)
+
+    return np.sign(numerator) * ((2 * np.abs(numerator) + denominator) // (2 * denominator))
+
+
+def scalar_round_divide(numerator, denominator):
+    """
+    Same as round_divide() for a single pair of Python ints.
+
+    :param numerator: Python int
+    :param denominator: Positive Python int
+    :return: Python int
+    """
+
+    quotient = (2 * abs(numerator) + denominator) // (2 * denominator)
+
+    return quotient if numerator >= 0 else -quotient
+
+
+def scale_by(amount, factor):
+    """
+    Multiplies an integer amount by a fixed-point factor and rounds back to the units of amount.
+
+    :param amount: int64 array (cents, or millionths)
+    :param factor: int64 array of millionths (e.g. to_fixed(1.2006, SCALE) for a benefits multiplier of 1.2006)
+    :return: int64 array in the units of amount
+    """
+
+    return round_divide(multiply(amount, factor), SCALE)
+
+
+def allocate_evenly(total, num_shares, share_rank):
+    """
+    Splits integer totals into num_shares parts that differ by at most one unit and add back up to the total exactly
+    (largest remainder method with equal shares). The leftover units go to the shares with the lowest rank.
+
+    :param total: int64 array with one total per row of share_rank, optionally with leading scenario dimensions
+    :param num_shares: int64 array of the number of parts each total is split into
+    :param share_rank: int64 array of shape (number of totals, number of recipients) giving each recipient's rank
+                       among the parts of a total, or -1 if the recipient doesn't get a part
+    :return: int64 array of shape (..., number of recipients) with the sum of the parts each recipient gets
+    """
+
+    base_share = np.floor_divide(total, num_shares)
+    leftover = total - base_share * num_shares
+
+    shares = np.where(share_rank >= 0,
+                      base_share[..., np.newaxis] + (share_rank < leftover[..., np.newaxis]),
+                      0)
+
+    return shares.sum(axis=-2)
+
+
+def compute_cost_centre_rates_cents(arrays, oh_tech_time_percentage, productivity_rate, benefits_multiplier=None,
+                                    hours_worked_per_day=None, semi_prod_days_per_year=None):
+    """
+    Fixed-point version of vectorengine.compute_cost_centre_rates(). Assumptions may be scalars or 1-D arrays with one
+    value per scenario, exactly as there.
+
+    :param arrays: Dict of reference arrays (see referencearrays.build_reference_arrays())
+    :param oh_tech_time_percentage: % of tech time spent on non-device related work
+    :param productivity_rate: % of annual labour hours that techs are productive
+    :param benefits_multiplier: Multiplier applied to salaries to get total compensation; defaults to the reference value
+    :param hours_worked_per_day: Average hours a tech works in a day; defaults to the reference value
+    :param semi_prod_days_per_year: Days in a year less weekends, stats and sick days; defaults to the reference value
+    :return: Dict of int64 arrays with keys "non_labour_oh", "tech_staff_oh", "regional_staff_oh", "total_oh" (cents),
+             "annual_labour_hours" (millionths of an hour), "pohr", "weighted_avg_tech_hourly_wage" (cents per hour);
+             cost centres without tech labour hours get a POHR of 0
+    """
+
+    if benefits_multiplier is None:
+        benefits_multiplier = arrays["benefits_multiplier"]
+    if hours_worked_per_day is None:
+        hours_worked_per_day = arrays["hours_worked_per_day"]
+    if semi_prod_days_per_year is None:
+        semi_prod_days_per_year = arrays["semi_prod_days_per_year"]
+
+    # Rounding point 1: inputs
+    oh_tech_time_percentage = to_fixed(as_scenario_column(oh_tech_time_percentage), SCALE)
+    productivity_rate = to_fixed(as_scenario_column(productivity_rate), SCALE)
+    benefits_multiplier = to_fixed(as_scenario_column(benefits_multiplier), SCALE)
+    hours_worked_per_day = to_fixed(as_scenario_column(hours_worked_per_day), SCALE)
+    semi_prod_days_per_year = to_fixed(as_scenario_column(semi_prod_days_per_year), SCALE)
+
+    level_qty = to_fixed(arrays["level_qty"], SCALE)
+    level_wage = to_cents(arrays["level_wage"])
+    level_vac_days = to_fixed(arrays["level_vac_days"], SCALE)
+    hours_paid_per_year = to_fixed(arrays["hours_paid_per_year"], SCALE)
+    regional_salary = to_cents(arrays["regional_salary"])
+
+    # Rounding points 2 and 3: annual salary of one tech of each level, then of all techs of each level
+    level_annual_salary = scale_by(level_wage, hours_paid_per_year)
+    annual_tech_salary = scale_by(level_qty, level_annual_salary).sum(axis=1)
+
+    # Rounding points 4 and 5: tech compensation, then the share of it that is OH
+    tech_compensation = scale_by(annual_tech_salary, benefits_multiplier)
+    tech_staff_oh = scale_by(tech_compensation, oh_tech_time_percentage)
+
+    # Rounding point 4, then an exact split of each regional staff's compensation across their cost centres
+    regional_compensation = scale_by(regional_salary, benefits_multiplier)
+    regional_staff_oh = allocate_evenly(regional_compensation, arrays["regional_num_shares"],
+                                        arrays["regional_share_rank"])
+
+    # Rounding point 6: mean of the larger of actual and budgeted partial OH over the fiscal years on record
+    partial_oh_max = arrays["partial_oh_max"]
+    has_year = ~np.isnan(partial_oh_max)
+    partial_oh_cents = to_cents(np.where(has_year, partial_oh_max, 0.0))
+    non_labour_oh = round_divide(partial_oh_cents.sum(axis=1), np.maximum(has_year.sum(axis=1), 1))
+
+    total_oh = non_labour_oh + regional_staff_oh + tech_staff_oh
+
+    # Rounding point 7: labour days are exact in millionths squared, then hours and productive hours in millionths
+    total_num_staff = level_qty.sum(axis=1)
+    labour_days = multiply(semi_prod_days_per_year, total_num_staff) - multiply(level_qty, level_vac_days).sum(axis=1)
+    annual_labour_hours = scale_by(round_divide(labour_days, SCALE), hours_worked_per_day)
+    productive_hours = scale_by(annual_labour_hours, productivity_rate)
+
+    # Rounding point 8: POHR in cents per hour
+    has_hours = productive_hours > 0
+    pohr = np.where(has_hours, round_divide(multiply(total_oh, SCALE), np.where(has_hours, productive_hours, 1)), 0)
+
+    # Rounding point 9: headcount-weighted average hourly wage in cents per hour
+    has_staff = total_num_staff > 0
+    weighted_avg_tech_hourly_wage = np.where(has_staff,
+                                             round_divide(multiply(level_qty, level_wage).sum(axis=1),
+                                                          np.where(has_staff, total_num_staff, 1)),
+                                             0)
+
+    return {"non_labour_oh": np.broadcast_to(non_labour_oh, pohr.shape),
+            "tech_staff_oh": np.broadcast_to(tech_staff_oh, pohr.shape),
+            "regional_staff_oh": np.broadcast_to(regional_staff_oh, pohr.shape),
+            "total_oh": total_oh,
+            "annual_labour_hours": np.broadcast_to(annual_labour_hours, pohr.shape),
+            "pohr": pohr,
+            "weighted_avg_tech_hourly_wage": np.broadcast_to(weighted_avg_tech_hourly_wage, pohr.shape)}
+
+
+def compute_asset_costs_cents(rates, asset_cc_index, asset_support_hours, asset_qty, asset_service_contract_cost=None):
+    """
+    Computes per-asset costs in cents and sums them per cost centre, the fixed-point equivalent of the OH, direct cost,
+    cost to service and total formulas in budget_report_output.xlsx.
+
+    :param rates: Dict returned by compute_cost_centre_rates_cents()
+    :param asset_cc_index: 1-D array of each asset's cost centre position
+    :param asset_support_hours: 1-D array of each asset's annual support hours
+    :param asset_qty: 1-D array of each asset's quantity
+    :param asset_service_contract_cost: Optional 1-D array of each asset's annual service contract cost in dollars;
+                                        0 for every asset if None
+    :return: Dict of int64 arrays with keys "oh_cost_per_asset", "direct_cost_per_asset",
+             "service_contract_cost_per_asset", "cost_to_service_per_asset", "total_cost_to_service" (per asset, cents)
+             and "cost_centre_total_cost_to_service" (per cost centre, cents)
+    """
+
+    support_hours = to_fixed(asset_support_hours, SCALE)
+    qty = to_fixed(asset_qty, SCALE)
+
+    # Rounding point 10
+    oh_cost_per_asset = scale_by(rates["pohr"][..., asset_cc_index], support_hours)
+    direct_cost_per_asset = scale_by(rates["weighted_avg_tech_hourly_wage"][..., asset_cc_index], support_hours)
+    service_contract_cost_per_asset = np.zeros(len(support_hours), dtype=np.int64)
+    if asset_service_contract_cost is not None:
+        service_contract_cost_per_asset = to_cents(asset_service_contract_cost)
+    cost_to_service_per_asset = oh_cost_per_asset + direct_cost_per_asset + service_contract_cost_per_asset
+
+    # Rounding point 11
+    total_cost_to_service = scale_by(cost_to_service_per_asset, qty)
+
+    cost_centre_total = np.zeros(rates["pohr"].shape, dtype=np.int64)
+    np.add.at(cost_centre_total, (..., asset_cc_index), total_cost_to_service)
+
+    return {"oh_cost_per_asset": oh_cost_per_asset,
+            "direct_cost_per_asset": direct_cost_per_asset,
+            "service_contract_cost_per_asset": service_contract_cost_per_asset,
+            "cost_to_service_per_asset": cost_to_service_per_asset,
+            "total_cost_to_service": total_cost_to_service,
+            "cost_centre_total_cost_to_service": cost_centre_total}
+
+
+def apply_fixed_point_engine(budget_report):
+    """
+    Recomputes a BudgetReport's rates and costs in fixed point. The exact rates replace the float ones on its CostCentre
+    objects and its fixed_point flag is set, so the workbook written afterwards shows the same cents as the returned
+    results.
+
+    :param budget_report: BudgetReport object on which create_cost_centre_objects() and compute_asset_support_hours()
+                          have been called
+    :return: Tuple (cost_centre_results, asset_results) of DataFrames laid out like BudgetReport.build_results_tables(),
+             with every amount an exact number of cents
+    """
+
+    # Imported here so that the arithmetic above can be used without reading any workbook
+    from costcentre import CostCentre
+    from referencearrays import build_reference_arrays
+
+    arrays = build_reference_arrays(budget_report=budget_report)
+    rates = compute_cost_centre_rates_cents(arrays, CostCentre.OH_TECH_TIME_PERCENTAGE, CostCentre.PRODUCTIVITY_RATE)
+    costs = compute_asset_costs_cents(rates, arrays["asset_cc_index"], arrays["asset_support_hours"],
+                                      arrays["asset_qty"], arrays["asset_service_contract_cost"])
+
+    cost_centre_rows = []
+    asset_rows = []
+    asset_position = 0
+
+    budget_report.fixed_point = True
+
+    for index, cost_centre in enumerate(budget_report.cost_centres.values()):
+        cost_centre.non_labour_oh = to_dollars(rates["non_labour_oh"][index]).item()
+        cost_centre.tech_staff_oh = to_dollars(rates["tech_staff_oh"][index]).item()
+        cost_centre.regional_staff_oh = to_dollars(rates["regional_staff_oh"][index]).item()
+        cost_centre.pohr = to_dollars(rates["pohr"][index]).item()
+        cost_centre.weighted_avg_tech_hourly_wage = to_dollars(rates["weighted_avg_tech_hourly_wage"][index]).item()
+
+        # Assets are in the same order as in build_reference_arrays()
+        for asset in cost_centre.assets:
+            asset_rows.append({"cost_centre_name": cost_centre.name,
+                               "health_auth": asset.health_auth,
+                               "function": asset.function,
+                               "shop_code": asset.shop_code,
+                               "site_code": asset.site_code,
+                               "model_num": str(asset.model_num),
+                               "asset_description": asset.name,
+                               "qty": asset.qty,
+                               "avg_support_hours": asset.avg_support_hours,
+                               "support_hours_match": asset.support_hours_match,
+                               "service_contract_match": asset.service_contract_match,
+                               "oh_cost_per_asset": to_dollars(costs["oh_cost_per_asset"][asset_position]).item(),
+                               "direct_cost_per_asset": to_dollars(
+                                   costs["direct_cost_per_asset"][asset_position]).item(),
+                               "service_contract_cost_per_asset": to_dollars(
+                                   costs["service_contract_cost_per_asset"][asset_position]).item(),
+                               "cost_to_service_per_asset": to_dollars(
+                                   costs["cost_to_service_per_asset"][asset_position]).item(),
+                               "total_cost_to_service": to_dollars(
+                                   costs["total_cost_to_service"][asset_position]).item()})
+            asset_position += 1
+
+        support_hours = sum(asset.avg_support_hours * asset.qty for asset in cost_centre.assets)
+
+        cost_centre_rows.append({"cost_centre_name": cost_centre.name,
+                                 "health_auth": cost_centre.health_auth,
+                                 "function": cost_centre.function,
+                                 "num_assets": len(cost_centre.assets),
+                                 "asset_qty": sum(asset.qty for asset in cost_centre.assets),
+                                 "support_hours": support_hours,
+                                 "non_labour_oh": cost_centre.non_labour_oh,
+                                 "tech_staff_oh": cost_centre.tech_staff_oh,
+                                 "regional_staff_oh": cost_centre.regional_staff_oh,
+                                 "total_oh": to_dollars(rates["total_oh"][index]).item(),
+                                 "pohr": cost_centre.pohr,
+                                 "weighted_avg_tech_hourly_wage": cost_centre.weighted_avg_tech_hourly_wage,
+                                 "total_cost_to_service": to_dollars(
+                                     costs["cost_centre_total_cost_to_service"][index]).item()})
+
+    return pd.DataFrame(cost_centre_rows), pd.DataFrame(asset_rows)
@@ -0,0 +1,122 @@
+import pandas as pd
+from modelinputs import read_table
+
+"""
+########################################################################################################################
+##################################### MODULE SCOPE FUNCTIONS BELOW #####################################################
+########################################################################################################################
+"""
+
+# File path to cost_centres_and_sites_reference.xlsx
+sites_cc_file_path = "model_inputs/cost_centres_and_sites/cost_centres_and_sites_reference.xlsx"
+
+# Number of general ledger transaction lines to hold in memory at once
+GL_CHUNK_SIZE = 500000
+
+# Compensation accounts (e.g. Salaries and Wages 3200000, Benefit Compensation 3400000) all fall in the 3xxxxxx block
+LABOUR_ACCOUNT_RANGE = (3000000, 3999999)
+
+# Service contract accounts, which are excluded from partial OH for imaging cost centres only
+CONTRACTS_ACCOUNTS = [7102000]   # Equipment Maintenance Contract
+
+
+def read_cost_centre_codes_reference():
+    """
+    Reads the "Cost Centres" sheet in cost_centres_and_sites_reference.xlsx so that general ledger transactions, which
+    are keyed by cost centre code, can be mapped to the cost centre names used by the rest of the model.
+
+    :return: DataFrame with columns "cost_centre_code", "cost_centre_name", "health_authority", "function"
+    """
+
+    cc_codes_df = read_table(sites_cc_file_path,
+                             sheet_name="Cost Centres",
+                             usecols=["cost_centre_code",
+                                      "cost_centre_name",
+                                      "health_authority",
+                                      "function"],
+                             dtype={"cost_centre_code": str})
+
+    return cc_codes_df
+
+
+def aggregate_gl_chunk(chunk, cc_codes_df, labour_account_range, contracts_accounts):
+    """
+    Drops labour (and, for imaging cost centres, contracts) transactions from a chunk of the general ledger extract and
+    sums the remaining actual and budget amounts by cost centre and fiscal year.
+
+    :param chunk: DataFrame holding a chunk of the general ledger extract
+    :param cc_codes_df: DataFrame returned by read_cost_centre_codes_reference()
+    :param labour_account_range: Tuple (first, last) of the inclusive range of labour account numbers
+    :param contracts_accounts: List of contracts account numbers
+    :return: DataFrame with columns "cost_centre_name", "fiscal_year", "actual_partial_oh", "budgeted_partial_oh"
+    """
+
+    # Attach cost centre name and function; transactions for cost centres outside of LMBME are dropped
+    chunk = chunk.merge(cc_codes_df[["cost_centre_code", "cost_centre_name", "function"]],
+                        on="cost_centre_code",
+                        how="inner")
+
+    # For all cost centres, partial OH is total expenses less labour expense.
+    # For imaging cost centres, partial OH is total expenses less labour and contracts expense.
+    is_labour = chunk["account"].between(labour_account_range[0], labour_account_range[1])
+    is_imaging_contract = (chunk["function"] == "imaging") & chunk["account"].isin(contracts_accounts)
+    chunk = chunk[~(is_labour | is_imaging_contract)]
+
+    partial_oh_df = chunk.groupby(["cost_centre_name", "fiscal_year"], as_index=False).agg(
+        actual_partial_oh=("actual_amount", "sum"),
+        budgeted_partial_oh=("budget_amount", "sum"))
+
+    return partial_oh_df
+
+
+def ingest_general_ledger(gl_file_path, chunk_size=GL_CHUNK_SIZE, labour_account_range=LABOUR_ACCOUNT_RANGE,
+                          contracts_accounts=None):
+    """
+    Streams a raw general ledger extract (CSV with columns "cost_centre_code", "fiscal_year", "account",
+    "actual_amount", "budget_amount") in chunks and aggregates actual and budgeted partial OH by cost centre and fiscal
+    year in a single pass over the file. Only the running per-chunk aggregates are kept in memory.
+
+    The result replaces the hand-built per-cost centre worksheets in model_inputs/financial_reports/ and can be handed
+    straight to CostCentre.partial_oh_history.
+
+    :param gl_file_path: Path to the general ledger extract
+    :param chunk_size: Number of transaction lines to read at a time
+    :param labour_account_range: Tuple (first, last) of the inclusive range of labour account numbers
+    :param contracts_accounts: List of contracts account numbers excluded for imaging cost centres; defaults to
+                               CONTRACTS_ACCOUNTS
+    :return: Long format DataFrame with one row per cost centre and fiscal year and columns "cost_centre_name",
+             "health_authority", "function", "fiscal_year", "actual_partial_oh", "budgeted_partial_oh"
+    """
+
+    if contracts_accounts is None:
+        contracts_accounts = CONTRACTS_ACCOUNTS
+
+    cc_codes_df = read_cost_centre_codes_reference()
+
+    gl_reader = pd.read_csv(gl_file_path,
+                            usecols=["cost_centre_code", "fiscal_year", "account", "actual_amount", "budget_amount"],
+                            dtype={"cost_centre_code": str,
+                                   "fiscal_year": str,
+                                   "account": "int64",
+                                   "actual_amount": "float64",
+                                   "budget_amount": "float64"},
+                            chunksize=chunk_size)
+
+    # Aggregate each chunk as it is read, then combine the (small) partial aggregates at the end
+    partial_aggregates = [aggregate_gl_chunk(chunk, cc_codes_df, labour_account_range, contracts_accounts)
+                          for chunk in gl_reader]
+
+    if not partial_aggregates:
+        partial_aggregates = [pd.DataFrame(columns=["cost_centre_name", "fiscal_year",
+                                                    "actual_partial_oh", "budgeted_partial_oh"])]
+
+    partial_oh_df = pd.concat(partial_aggregates, ignore_index=True).groupby(
+        ["cost_centre_name", "fiscal_year"], as_index=False)[["actual_partial_oh", "budgeted_partial_oh"]].sum()
+
+    # Attach HA and function so the long table can stand in for the financial_reports/{function}/{HA}.xlsx layout
+    partial_oh_df = partial_oh_df.merge(cc_codes_df[["cost_centre_name", "health_authority", "function"]],
+                                        on="cost_centre_name",
+                                        how="left")
+
+    return partial_oh_df[["cost_centre_name", "health_authority", "function", "fiscal_year",
+                          "actual_partial_oh", "budgeted_partial_oh"]]
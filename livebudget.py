@@ -0,0 +1,230 @@
+import itertools
+import pandas as pd
+from fixedpoint import CENTS_PER_DOLLAR, SCALE, scalar_round_divide, scalar_to_fixed
+from pricematrix import build_price_matrix, load_price_matrix
+
+"""
+########################################################################################################################
+##################################### MODULE SCOPE FUNCTIONS BELOW #####################################################
+########################################################################################################################
+
+In-memory budget that planners can change one asset at a time, e.g. during a meeting:
+
+    >>> budget = LiveBudget(load_price_matrix())
+    >>> asset_id = budget.add_asset("MODEL123", "PUMP, INFUSION", 4, "VGH", "WHITE")
+    >>> budget.update_asset(asset_id, qty=6)
+    >>> budget.cost_centre_totals()
+
+Rates, site resolution, support hours and imaging service contract costs come from a PriceMatrix, so no workbook is
+read after it is built. Running
+totals are kept in integer cents and millionths of an hour (see fixedpoint) so that any sequence of adds and removes
+leaves them exactly where a fresh build would.
+"""
+
+
+def create_live_budget(price_matrix_file_path=None):
+    """
+    Creates an empty LiveBudget from a saved PriceMatrix, or from the reference workbooks if no file is given.
+
+    :param price_matrix_file_path: Optional path to a PriceMatrix saved with PriceMatrix.save()
+    :return: LiveBudget object
+    """
+
+    if price_matrix_file_path is None:
+        return LiveBudget(build_price_matrix())
+
+    return LiveBudget(load_price_matrix(price_matrix_file_path))
+
+
+"""
+########################################################################################################################
+######################################### LIVEBUDGET CLASS BELOW #######################################################
+########################################################################################################################
+"""
+
+
+class LiveBudget:
+    """
+    Mutable budget of assets with per-cost centre running totals. Adding, removing or updating an asset is constant time
+    (apart from the fuzzy support hours fallback for assets matched by neither model number nor description), and
+    totals can be read at any moment without recomputation.
+    """
+
+    def __init__(self, price_matrix):
+        """
+        :param price_matrix: PriceMatrix object supplying rates, site resolution and support hours
+        """
+
+        # Source of rates, cost centres and support hours
+        self.price_matrix = price_matrix
+        # Dict with key: asset id and value: dict of the asset's details and costs
+        self.assets = {}
+        # Dict with key: cost centre name and value: dict of running totals; cost centres are added on first use
+        self.cost_centres = {}
+        # Source of asset ids
+        self.asset_ids = itertools.count(1)
+        # Running totals over all cost centres, in cents and millionths of an hour
+        self.total_cost_to_service_cents = 0
+        self.total_support_hours_fixed = 0
+
+    def add_asset(self, model_num, asset_description, qty, site_code, shop_code, health_auth=None):
+        """
+        Adds an asset line to the budget.
+
+        :param model_num: Model number
+        :param asset_description: Asset description
+        :param qty: Quantity (negative for assets being removed from service)
+        :param site_code: Three-letter site code
+        :param shop_code: Shop code
+        :param health_auth: Health authority, for service contracts that name one
+        :return: Id of the new asset line, for update_asset() and remove_asset()
+        """
+
+        asset = self.price_asset(model_num, asset_description, qty, site_code, shop_code, health_auth)
+
+        asset_id = next(self.asset_ids)
+        self.assets[asset_id] = asset
+        self.apply_to_totals(asset, 1)
+
+        return asset_id
+
+    def remove_asset(self, asset_id):
+        """
+        Removes an asset line from the budget.
+
+        :param asset_id: Id returned by add_asset()
+        :return: Dict of the removed asset's details and costs
+        """
+
+        asset = self.assets.pop(asset_id)
+        self.apply_to_totals(asset, -1)
+
+        return asset
+
+    def update_asset(self, asset_id, **changes):
+        """
+        Changes any of an asset line's details, keeping its id. The changed line is priced before the old one is taken
+        out of the totals, so an update that can't be priced (e.g. to an unknown site code) leaves the budget unchanged.
+
+        :param asset_id: Id returned by add_asset()
+        :param changes: New values for any of "model_num", "asset_description", "qty", "site_code", "shop_code",
+                        "health_auth"
+        :return: None
+        """
+
+        old_asset = self.assets[asset_id]
+        details = {key: old_asset[key]
+                   for key in ["model_num", "asset_description", "qty", "site_code", "shop_code", "health_auth"]}
+        details.update(changes)
+
+        asset = self.price_asset(**details)
+
+        self.apply_to_totals(old_asset, -1)
+        self.assets[asset_id] = asset
+        self.apply_to_totals(asset, 1)
+
+    def price_asset(self, model_num, asset_description, qty, site_code, shop_code, health_auth=None):
+        """
+        Prices an asset line without adding it to the budget.
+
+        :param model_num: Model number
+        :param asset_description: Asset description
+        :param qty: Quantity
+        :param site_code: Three-letter site code
+        :param shop_code: Shop code
+        :param health_auth: Health authority, for service contracts that name one
+        :return: Dict of the asset line's details and costs, as stored in self.assets
+        """
+
+        quote = self.price_matrix.quote(model_num, site_code, shop_code, 1, asset_description, health_auth)
+
+        cost_to_service_cents = scalar_to_fixed(quote["cost_to_service_per_asset"], CENTS_PER_DOLLAR)
+        qty_fixed = scalar_to_fixed(qty, SCALE)
+
+        asset = {"model_num": model_num,
+                 "asset_description": asset_description,
+                 "qty": qty,
+                 "site_code": site_code,
+                 "shop_code": shop_code,
+                 "health_auth": health_auth,
+                 "cost_centre": quote["cost_centre"],
+                 "avg_support_hours": quote["support_hours"],
+                 "service_contract_cost_per_asset": quote["service_contract_cost_per_asset"],
+                 "cost_to_service_per_asset": quote["cost_to_service_per_asset"],
+                 # Exact contributions to the running totals
+                 "total_cost_to_service_cents": scalar_round_divide(cost_to_service_cents * qty_fixed, SCALE),
+                 "support_hours_fixed": scalar_round_divide(scalar_to_fixed(quote["support_hours"], SCALE) * qty_fixed,
+                                                            SCALE)}
+
+        return asset
+
+    def apply_to_totals(self, asset, sign):
+        """
+        Adds (sign=1) or subtracts (sign=-1) an asset line's contribution to its cost centre's and the overall running
+        totals, creating the cost centre's entry from the cached rates on first use.
+
+        :param asset: Dict of the asset line's details and costs, as stored in self.assets
+        :param sign: 1 to add, -1 to subtract
+        :return: None
+        """
+
+        cost_centre = self.cost_centres.get(asset["cost_centre"])
+
+        if cost_centre is None:
+            rates = self.price_matrix.rate_card.loc[asset["cost_centre"]]
+            cost_centre = {"pohr": rates["pohr"],
+                           "weighted_avg_tech_hourly_wage": rates["weighted_avg_tech_hourly_wage"],
+                           "num_assets": 0,
+                           "asset_qty": 0,
+                           "support_hours_fixed": 0,
+                           "total_cost_to_service_cents": 0}
+            self.cost_centres[asset["cost_centre"]] = cost_centre
+
+        cost_centre["num_assets"] += sign
+        cost_centre["asset_qty"] += sign * asset["qty"]
+        cost_centre["support_hours_fixed"] += sign * asset["support_hours_fixed"]
+        cost_centre["total_cost_to_service_cents"] += sign * asset["total_cost_to_service_cents"]
+
+        self.total_support_hours_fixed += sign * asset["support_hours_fixed"]
+        self.total_cost_to_service_cents += sign * asset["total_cost_to_service_cents"]
+
+    def load_assets(self, df):
+        """
+        Adds every row of a DataFrame laid out like the "User Input" sheet of budget_report_input.xlsx.
+
+        :param df: DataFrame with columns "model_num", "asset_description", "quantity", "health_auth", "site_code",
+                   "shop_code"
+        :return: List of the new asset ids, in row order
+        """
+
+        return [self.add_asset(model_num, str(asset_description).strip(), qty, site_code.strip(), shop_code.strip(),
+                               health_auth.strip())
+                for model_num, asset_description, qty, site_code, shop_code, health_auth in
+                df[["model_num", "asset_description", "quantity", "site_code", "shop_code",
+                    "health_auth"]].itertuples(index=False)]
+
+    def total_cost_to_service(self):
+        """
+        :return: Total annual cost to service every asset line in the budget, in dollars
+        """
+
+        return self.total_cost_to_service_cents / CENTS_PER_DOLLAR
+
+    def cost_centre_totals(self):
+        """
+        Snapshot of the running totals of every cost centre that has had an asset.
+
+        :return: DataFrame with columns "cost_centre_name", "num_assets", "asset_qty", "support_hours", "pohr",
+                 "weighted_avg_tech_hourly_wage", "total_cost_to_service"
+        """
+
+        return pd.DataFrame([{"cost_centre_name": name,
+                              "num_assets": totals["num_assets"],
+                              "asset_qty": totals["asset_qty"],
+                              "support_hours": totals["support_hours_fixed"] / SCALE,
+                              "pohr": totals["pohr"],
+                              "weighted_avg_tech_hourly_wage": totals["weighted_avg_tech_hourly_wage"],
+                              "total_cost_to_service": totals["total_cost_to_service_cents"] / CENTS_PER_DOLLAR}
+                             for name, totals in self.cost_centres.items()],
+                            columns=["cost_centre_name", "num_assets", "asset_qty", "support_hours", "pohr",
+                                     "weighted_avg_tech_hourly_wage", "total_cost_to_service"])
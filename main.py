@@ -1,37 +1,311 @@
+import argparse
+import os
 import pandas as pd
-from budgetreport import BudgetReport
+from budgetreport import BudgetReport, compute_file_hash, compute_input_hashes
+from checkpoint import checkpoint_folder_path, run_with_checkpoints
+from costcentre import CostCentre
+from fixedpoint import apply_fixed_point_engine
+from generalledger import ingest_general_ledger
+from modelinputs import get_workbook_pool, read_table_chunks
+from referenceloader import start_reference_loader
+from referencestore import ReferenceStore, use_reference_store
+from resultswarehouse import ResultsWarehouse, results_warehouse_file_path
+from scheduler import run_scheduled
+from streaming import DEFAULT_CHUNK_SIZE, run_streaming
+from validation import format_problems, validate_inputs
 
 # Show all df columns in run tool window
 pd.set_option("display.expand_frame_repr", False)
 
 
+def parse_args():
+    """
+    Parses optional command line arguments. Running main.py without any arguments produces the standard budget report.
+
+    :return: argparse.Namespace with the parsed arguments
+    """
+
+    parser = argparse.ArgumentParser(description="LMBME Service Delivery Cost Model")
+    parser.add_argument("--general-ledger",
+                        metavar="CSV_PATH",
+                        help="Raw general ledger extract to derive non-labour OH history from, instead of the "
+                             "worksheets in model_inputs/financial_reports/")
+    parser.add_argument("--warehouse",
+                        metavar="SQLITE_PATH",
+                        default=results_warehouse_file_path,
+                        help="Results warehouse to append this run to (default: %(default)s)")
+    parser.add_argument("--no-warehouse",
+                        action="store_true",
+                        help="Don't record this run in the results warehouse")
+    parser.add_argument("--notes",
+                        help="Free-text description of this run to store in the results warehouse")
+    parser.add_argument("--reference-store",
+                        metavar="SQLITE_PATH",
+                        help="Reference store compiled with 'python referencestore.py compile' to look up cost "
+                             "centres, tech staff, support hours and partial OH history in, instead of the reference "
+                             "workbooks")
+    parser.add_argument("--allow-stale-reference-store",
+                        action="store_true",
+                        help="Use --reference-store even if reference workbooks have changed since it was compiled")
+    parser.add_argument("--preload",
+                        choices=["auto", "processes", "threads", "off"],
+                        default="auto",
+                        help="Read the input workbooks concurrently at startup on a pool of processes or threads, or "
+                             "one at a time as each is needed; auto uses processes if there is more than one CPU "
+                             "(default: %(default)s)")
+    parser.add_argument("--contract-date",
+                        metavar="DATE",
+                        help="Date imaging service contracts must cover to be costed, e.g. 2025-04-01 (see "
+                             "servicecontracts.py; default: today)")
+    parser.add_argument("--skip-validation",
+                        action="store_true",
+                        help="Don't check the inputs and reference tables for problems before running (see "
+                             "validation.py)")
+    parser.add_argument("--workbook-stats",
+                        action="store_true",
+                        help="Print how many times each input workbook was opened and how many sheet reads it served")
+    parser.add_argument("--resume",
+                        action="store_true",
+                        help="Restart after the latest stage whose checkpoint matches the current inputs")
+    parser.add_argument("--checkpoint-dir",
+                        default=checkpoint_folder_path,
+                        help="Folder for stage checkpoints (default: %(default)s)")
+    parser.add_argument("--fixed-point",
+                        action="store_true",
+                        help="Compute OH, rates and costs in exact integer cents with documented rounding points (see "
+                             "fixedpoint.py) instead of floats")
+    parser.add_argument("--expand-lines",
+                        action="store_true",
+                        help="Write one output row per input line instead of one per set of identical lines")
+    parser.add_argument("--array-formulas",
+                        action="store_true",
+                        help="Write each computed asset column as a single dynamic array formula instead of one "
+                             "formula per row")
+    parser.add_argument("--values-only",
+                        action="store_true",
+                        help="Write computed costs and totals as plain values instead of formulas")
+    parser.add_argument("--layout",
+                        choices=["worksheets", "long"],
+                        default="worksheets",
+                        help="worksheets: one worksheet per cost centre; long: one cost centre table and one asset "
+                             "table, spilling over into further worksheets and workbooks as needed (default: "
+                             "%(default)s)")
+    parser.add_argument("--rollups",
+                        action="store_true",
+                        help="Also write totals by health authority, function, site and shop (see rollups.py)")
+    parser.add_argument("--summary-only",
+                        action="store_true",
+                        help="Write only the Summary worksheet (or, with --layout long, the Cost Centres table)")
+    parser.add_argument("--cost-centres",
+                        nargs="+",
+                        metavar="NAME",
+                        help="Only compute and write these cost centres")
+    parser.add_argument("--health-auth",
+                        choices=list(BudgetReport.cost_centre_responsibility_dict),
+                        help="Only compute and write the cost centres of this health authority")
+    parser.add_argument("--function",
+                        choices=sorted({function for functions in BudgetReport.cost_centre_responsibility_dict.values()
+                                        for function in functions}),
+                        help="Only compute and write the cost centres responsible for this function")
+    parser.add_argument("--stream",
+                        action="store_true",
+                        help="Read the input in chunks and compute and write one cost centre at a time, so that memory "
+                             "is bounded by the largest cost centre (see streaming.py)")
+    parser.add_argument("--schedule",
+                        action="store_true",
+                        help="Run the model as a task graph that overlaps independent stages and writes each cost "
+                             "centre as soon as it is computed (see scheduler.py)")
+    parser.add_argument("--schedule-workers",
+                        type=int,
+                        help="Threads to run --schedule tasks on (default: the thread pool's default)")
+    parser.add_argument("--schedule-trace",
+                        metavar="PATH",
+                        help="Export the tasks run with --schedule, their timings and the critical path to a .csv "
+                             "file, or a .json file in the Chrome trace event format")
+    parser.add_argument("--chunk-size",
+                        type=int,
+                        default=DEFAULT_CHUNK_SIZE,
+                        help="Input rows read at a time with --stream (default: %(default)s)")
+
+    args = parser.parse_args()
+
+    # Streaming writes each cost centre's worksheet as soon as it is computed, top to bottom
+    if args.stream and (args.resume or args.fixed_point or args.array_formulas or args.layout == "long"):
+        parser.error("--stream can't be combined with --resume, --fixed-point, --array-formulas or --layout long")
+
+    # Scheduled runs write each cost centre's worksheet as soon as it is computed, but not necessarily top to bottom
+    if args.schedule and (args.stream or args.resume or args.fixed_point or args.layout == "long"):
+        parser.error("--schedule can't be combined with --stream, --resume, --fixed-point or --layout long")
+    if (args.schedule_workers or args.schedule_trace) and not args.schedule:
+        parser.error("--schedule-workers and --schedule-trace need --schedule")
+
+    if args.allow_stale_reference_store and not args.reference_store:
+        parser.error("--allow-stale-reference-store needs --reference-store")
+
+    if args.contract_date is not None:
+        try:
+            args.contract_date = pd.Timestamp(args.contract_date)
+        except ValueError:
+            parser.error("--contract-date must be a date, e.g. 2025-04-01")
+
+    # Set of the only cost centres to compute and write, or None for all
+    args.cost_centre_names = None
+    if args.cost_centres or args.health_auth or args.function:
+        if args.resume:
+            parser.error("--resume can't be combined with --cost-centres, --health-auth or --function")
+
+        budget_report = BudgetReport()
+        unknown_names = set(args.cost_centres or []) - budget_report.select_cost_centres()
+        if unknown_names:
+            parser.error("Not in the Cost Centres sheet: {names}".format(names=", ".join(sorted(unknown_names))))
+
+        args.cost_centre_names = budget_report.select_cost_centres(args.cost_centres, args.health_auth, args.function)
+        if not args.cost_centre_names:
+            parser.error("No cost centre matches --cost-centres, --health-auth and --function")
+
+    # Concurrent reads only pay for the pool with more than one CPU to run them on
+    if args.preload == "auto":
+        args.preload = "processes" if (os.cpu_count() or 1) > 1 else "off"
+
+    return args
+
+
+def finish_run(args, message):
+    """
+    Closes every pooled input workbook, so none is held open while the window waits, and waits for the user to close
+    the window.
+
+    :param args: argparse.Namespace returned by parse_args()
+    :param message: Message to show the user
+    :return: None
+    """
+
+    workbook_pool = get_workbook_pool()
+    workbook_pool.close()
+
+    if args.workbook_stats:
+        print(workbook_pool.summarize().to_string(index=False))
+
+    input(message)
+
+
 def main():
 
+    args = parse_args()
+
     print("Importing data...")
 
-    # Create BudgetReport object holding data needed to produce final output
-    budget_report = BudgetReport()
+    # Start reading every input workbook the run will need at once; each stage then waits only for its own tables
+    if args.preload != "off":
+        start_reference_loader(use_threads=args.preload == "threads",
+                               support_hours=not args.reference_store,
+                               financial_reports=not (args.general_ledger or args.reference_store),
+                               asset_input=not args.stream,
+                               cost_centre_names=args.cost_centre_names)
+
+    # Replace hand-built financial report worksheets with partial OH aggregated from the general ledger
+    if args.general_ledger:
+        CostCentre.partial_oh_history = ingest_general_ledger(args.general_ledger)
+
+    # Look up reference data with indexed queries against a compiled store, unless it was compiled from other reference
+    # workbooks than those in model_inputs/, which would silently give different numbers than a run on the workbooks
+    if args.reference_store:
+        reference_store = ReferenceStore(args.reference_store)
+        changed_inputs = reference_store.find_changed_inputs()
+
+        if changed_inputs:
+            print("Reference files changed since {store} was compiled:\n{paths}".format(
+                store=args.reference_store, paths="\n".join("  " + file_path for file_path in changed_inputs)))
+            if not args.allow_stale_reference_store:
+                finish_run(args, "Recompile the reference store, or pass --allow-stale-reference-store to use it "
+                                 "anyway. Press 'Enter' to close this window.")
+                return
+
+        use_reference_store(reference_store)
 
-    # Create list of Asset objects for which the user wants to budget
-    assets = budget_report.create_asset_objects()
+    # Cost imaging assets' service contracts in force on another day than today
+    if args.contract_date is not None:
+        BudgetReport.service_contract_date = args.contract_date
 
-    print("Computing cost to service...")
+    # Check every input line and reference table before any expensive computation, and report every problem at once
+    if not args.skip_validation:
+        chunks = None
+        if args.stream:
+            chunks = read_table_chunks(BudgetReport.budget_report_input_file_path, "User Input", args.chunk_size)
+        problems_df = validate_inputs(chunks)
 
-    # Create CostCentre objects based on the Asset objects above
-    budget_report.create_cost_centre_objects(assets, budget_report)
+        if not problems_df.empty:
+            print(format_problems(problems_df))
+        if (problems_df["severity"] == "error").any():
+            finish_run(args, "Fix the errors above and run the model again. Press 'Enter' to close this window.")
+            return
 
-    # Compute asset support hours
-    budget_report.compute_asset_support_hours()
+    # Hashes of every input, used to validate checkpoints and recorded in the results warehouse
+    input_hashes = compute_input_hashes()
+    if args.general_ledger:
+        input_hashes[args.general_ledger] = compute_file_hash(args.general_ledger)
+    if args.reference_store:
+        input_hashes[args.reference_store] = compute_file_hash(args.reference_store)
+
+    # Compute and write one cost centre at a time
+    if args.stream:
+        # Each cost centre's results are appended to the warehouse as soon as it is computed
+        warehouse = None if args.no_warehouse else ResultsWarehouse(args.warehouse)
+        run_streaming(args.chunk_size, results_warehouse=warehouse, input_hashes=input_hashes, notes=args.notes,
+                      expand_lines=args.expand_lines, values_only=args.values_only, rollups=args.rollups,
+                      summary_only=args.summary_only, cost_centre_names=args.cost_centre_names)
+        if warehouse is not None:
+            warehouse.close()
+
+        finish_run(args, "Budget report output successfully generated. Press 'Enter' to close this window.")
+        return
+
+    # Compute and write each cost centre as soon as the stages it depends on are done
+    if args.schedule:
+        print("Computing cost to service and writing output to Excel...")
+        budget_report = run_scheduled(args.cost_centre_names, args.schedule_workers, args.schedule_trace,
+                                      expand_lines=args.expand_lines, array_formulas=args.array_formulas,
+                                      values_only=args.values_only, rollups=args.rollups,
+                                      summary_only=args.summary_only)
+        if not args.no_warehouse:
+            warehouse = ResultsWarehouse(args.warehouse)
+            warehouse.record_run(*budget_report.build_results_tables(), input_hashes, args.notes)
+            warehouse.close()
+
+        finish_run(args, "Budget report output successfully generated. Press 'Enter' to close this window.")
+        return
+
+    # Create Asset and CostCentre objects and compute asset support hours, saving a checkpoint after each stage
+    budget_report = run_with_checkpoints(input_hashes, args.resume, args.checkpoint_dir, args.cost_centre_names)
+
+    # Replace float rates with exact fixed-point ones before they are written
+    if args.fixed_point:
+        cost_centre_results, asset_results = apply_fixed_point_engine(budget_report)
 
     print("Writing output to Excel...")
 
     # Write output to Excel
-    budget_report.write_output_to_excel()
+    budget_report.expand_lines = args.expand_lines
+    budget_report.array_formulas = args.array_formulas
+    budget_report.values_only = args.values_only
+    budget_report.rollups = args.rollups
+    budget_report.summary_only = args.summary_only
+    if args.layout == "long":
+        budget_report.write_long_format_output()
+    else:
+        budget_report.write_output_to_excel()
 
-    input("Budget report output successfully generated. Press 'Enter' to close this window.")
+    # Append per-cost centre and per-asset results and input hashes to the results warehouse
+    if not args.no_warehouse:
+        if not args.fixed_point:
+            cost_centre_results, asset_results = budget_report.build_results_tables()
+        warehouse = ResultsWarehouse(args.warehouse)
+        warehouse.record_run(cost_centre_results, asset_results, input_hashes, args.notes)
+        warehouse.close()
+
+    finish_run(args, "Budget report output successfully generated. Press 'Enter' to close this window.")
 
 
 if __name__ == "__main__":
 
     main()
-
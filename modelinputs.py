@@ -0,0 +1,526 @@
+import collections
+import concurrent.futures
+import functools
+import itertools
+import json
+import os
+import threading
+import openpyxl
+import pandas as pd
+from openpyxl.utils import column_index_from_string
+
+"""
+########################################################################################################################
+##################################### MODULE SCOPE FUNCTIONS BELOW #####################################################
+########################################################################################################################
+
+Every model input is a logical table named by the workbook and worksheet it has always been read from, e.g.
+("model_inputs/labour_reports/staff_salaries.xlsx", "Tech Staff"). read_table() resolves the table to the first source
+that exists, in this order:
+
+    1. A file given for the table in model_inputs/input_sources.json, e.g.
+           {"model_inputs/labour_reports/staff_salaries.xlsx": {"Tech Staff": "exports/tech_staff.parquet"},
+            "model_inputs/wo_reports/asset_support_hours_reference.xlsx": "exports/support_hours.csv"}
+       (a workbook read without a worksheet name maps straight to a file)
+    2. A CSV, Parquet or Arrow IPC export named after the worksheet in a folder named after the workbook, e.g.
+           model_inputs/labour_reports/staff_salaries/Tech Staff.parquet
+       or, for a workbook read without a worksheet name, named after the workbook, e.g.
+           model_inputs/wo_reports/asset_support_hours_reference.csv
+    3. The worksheet itself
+
+The format is taken from the file extension. Every format has the same column contract as the worksheet. Parquet and
+Arrow IPC (.arrow, .feather) files are memory-mapped and only the requested columns are read; they need pyarrow, an
+optional requirement (see requirements.txt).
+
+Reads can be scheduled ahead of time on a thread or process pool with preload_tables() (see referenceloader.py); a
+read_table() call with the same arguments then waits for the scheduled read instead of repeating it.
+
+Worksheets are read through a WorkbookPool, which opens each workbook (decompressing it and parsing its shared strings)
+once and serves every sheet read from that handle until the pool is closed at the end of the run. Each process has its
+own pool, so preload_tables() schedules all the reads of a workbook as one task, which opens it once in whichever worker
+runs it, and hands its worksheet names to list_worksheets(). A preloaded workbook is then only opened again if a table
+of it that wasn't preloaded is read. The open and read counts of each task are merged into the main process's pool, so
+WorkbookPool.summarize() covers the whole run.
+"""
+
+# Optional file mapping logical tables to files
+input_sources_file_path = "model_inputs/input_sources.json"
+
+# Extensions of the formats that can replace a worksheet, in order of preference
+TABLE_EXTENSIONS = [".parquet", ".arrow", ".feather", ".csv"]
+
+# Dict with key: read_table() arguments (see table_key()) and value: Future of the table, for reads scheduled with
+# preload_tables()
+preloaded_tables = {}
+
+# Dict with key: workbook path and value: Future of its worksheet names (None if the preload didn't open it), for
+# workbooks with reads scheduled with preload_tables()
+preloaded_worksheets = {}
+
+
+def get_workbook_pool():
+    """
+    Gives the workbook pool of the current process. A worker process forked from the main process gets a new pool
+    rather than sharing the main process's open file handles.
+
+    :return: WorkbookPool object
+    """
+
+    global workbook_pool
+
+    if workbook_pool.pid != os.getpid():
+        workbook_pool = WorkbookPool()
+
+    return workbook_pool
+
+
+def list_worksheets(file_path):
+    """
+    Lists the worksheets of a workbook, from the preload of its tables if they were scheduled with preload_tables(),
+    otherwise opening it through the workbook pool.
+
+    :param file_path: Path to the workbook
+    :return: Set of worksheet names; empty if the workbook doesn't exist
+    """
+
+    if not os.path.exists(file_path):
+        return set()
+
+    future = preloaded_worksheets.get(file_path)
+    if future is not None and future.result() is not None:
+        return set(future.result())
+
+    return set(get_workbook_pool().open_workbook(file_path).sheet_names)
+
+
+def read_input_sources(file_path=input_sources_file_path):
+    """
+    Reads the configured sources of logical tables.
+
+    :param file_path: Path to input_sources.json
+    :return: Dict with key: workbook path and value: source file path, or dict with key: worksheet name and value:
+             source file path; empty if there is no input_sources.json
+    """
+
+    if not os.path.exists(file_path):
+        return {}
+
+    with open(file_path) as input_sources_file:
+        return json.load(input_sources_file)
+
+
+def resolve_table_source(file_path, sheet_name=None):
+    """
+    Finds the file a logical table is read from (see the module docstring for the order of precedence).
+
+    :param file_path: Path of the workbook the table is defined by
+    :param sheet_name: Name of the worksheet, or None for a workbook's first worksheet
+    :return: Path of the file to read
+    """
+
+    configured_source = read_input_sources().get(file_path)
+
+    if isinstance(configured_source, dict):
+        configured_source = configured_source.get(sheet_name)
+
+    if configured_source is not None:
+        return configured_source
+
+    root = os.path.splitext(file_path)[0]
+    if sheet_name is not None:
+        root = os.path.join(root, sheet_name)
+
+    for extension in TABLE_EXTENSIONS:
+        if os.path.exists(root + extension):
+            return root + extension
+
+    return file_path
+
+
+def column_positions(usecols):
+    """
+    Converts an Excel column range such as "A:B" or "A,C:E" to zero-based column positions.
+
+    :param usecols: Excel column range
+    :return: List of column positions
+    """
+
+    positions = []
+
+    for column_range in usecols.split(","):
+        first, last = (column_range.split(":") + [column_range])[:2]
+        positions.extend(range(column_index_from_string(first.strip()) - 1, column_index_from_string(last.strip())))
+
+    return positions
+
+
+def read_arrow_table(file_path, columns=None):
+    """
+    Reads a Parquet or Arrow IPC file into a pyarrow Table, memory-mapped and reading only the given columns.
+
+    :param file_path: Path to a .parquet, .arrow or .feather file
+    :param columns: Optional list of column names to read
+    :return: pyarrow Table
+    """
+
+    # Imported here so that pyarrow is only needed for Parquet and Arrow IPC inputs
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    if os.path.splitext(file_path)[1].lower() == ".parquet":
+        return pyarrow.parquet.read_table(file_path, columns=columns, memory_map=True)
+
+    table = pyarrow.ipc.open_file(pyarrow.memory_map(file_path)).read_all()
+
+    return table.select(columns) if columns is not None else table
+
+
+def table_key(file_path, sheet_name=None, usecols=None, header=0, nrows=None, dtype=None):
+    """
+    Identifies a read_table() call by its arguments.
+
+    :param file_path: See read_table()
+    :param sheet_name: See read_table()
+    :param usecols: See read_table()
+    :param header: See read_table()
+    :param nrows: See read_table()
+    :param dtype: See read_table()
+    :return: Hashable tuple of the arguments
+    """
+
+    return (file_path,
+            sheet_name,
+            tuple(usecols) if isinstance(usecols, list) else usecols,
+            header,
+            nrows,
+            tuple(sorted(dtype.items())) if dtype is not None else None)
+
+
+def preload_tables(table_reads, executor):
+    """
+    Schedules reads of logical tables on an executor, one task per workbook, so that each workbook is opened once
+    however many of its worksheets are read. Reads already scheduled are left as they are.
+
+    :param table_reads: List of dicts of read_table() arguments
+    :param executor: concurrent.futures.Executor to read the tables on
+    :return: None
+    """
+
+    # Dict with key: workbook path and value: list of its reads not yet scheduled
+    workbook_reads = {}
+
+    for table_read in table_reads:
+        key = table_key(**table_read)
+        if key not in preloaded_tables:
+            preloaded_tables[key] = concurrent.futures.Future()
+            workbook_reads.setdefault(table_read["file_path"], []).append(table_read)
+
+    for file_path, reads in workbook_reads.items():
+        preloaded_worksheets.setdefault(file_path, concurrent.futures.Future())
+        future = executor.submit(load_workbook_tables, reads)
+        future.add_done_callback(functools.partial(finish_preload, file_path, reads))
+
+
+def load_workbook_tables(table_reads):
+    """
+    Reads logical tables defined by the same workbook through a pool of their own, so the workbook is opened at most
+    once. This is what preload_tables() runs on its executor.
+
+    :param table_reads: List of dicts of read_table() arguments with the same "file_path"
+    :return: Tuple (tables, worksheet_names, open_counts, sheet_read_counts): for each read, its DataFrame or the
+             exception it raised; the workbook's worksheet names, or None if it wasn't opened (e.g. every table has a
+             CSV, Parquet or Arrow IPC source); and the pool's counts (see WorkbookPool)
+    """
+
+    pool = WorkbookPool()
+    tables = []
+
+    for table_read in table_reads:
+        try:
+            tables.append(load_table(**table_read, pool=pool))
+        except Exception as error:
+            tables.append(error)
+
+    file_path = table_reads[0]["file_path"]
+    worksheet_names = pool.workbooks[file_path].sheet_names if file_path in pool.workbooks else None
+    pool.close()
+
+    return tables, worksheet_names, pool.open_counts, pool.sheet_read_counts
+
+
+def finish_preload(file_path, table_reads, future):
+    """
+    Hands the tables read by a load_workbook_tables() task to the read_table() calls waiting for them, and merges the
+    task's counts into the workbook pool of the main process. Runs in the main process when the task finishes.
+
+    :param file_path: Path of the workbook the tables are defined by
+    :param table_reads: List of dicts of read_table() arguments the task was given
+    :param future: Finished Future of the task
+    :return: None
+    """
+
+    try:
+        tables, worksheet_names, open_counts, sheet_read_counts = future.result()
+    except Exception as error:
+        # The task itself failed (e.g. its worker process died), so every read raises its error
+        tables, worksheet_names = [error] * len(table_reads), None
+        open_counts, sheet_read_counts = collections.Counter(), collections.Counter()
+
+    get_workbook_pool().merge_counts(open_counts, sheet_read_counts)
+
+    for table_read, table in zip(table_reads, tables):
+        if isinstance(table, Exception):
+            preloaded_tables[table_key(**table_read)].set_exception(table)
+        else:
+            preloaded_tables[table_key(**table_read)].set_result(table)
+
+    if not preloaded_worksheets[file_path].done():
+        preloaded_worksheets[file_path].set_result(worksheet_names)
+
+
+def read_table(file_path, sheet_name=None, usecols=None, header=0, nrows=None, dtype=None):
+    """
+    Reads a logical model input table from its xlsx, CSV, Parquet or Arrow IPC source. Takes the same arguments as the
+    pd.read_excel() calls it replaces. If the same read was scheduled with preload_tables(), waits for it and returns a
+    copy of its result (re-raising any error it raised).
+
+    :param file_path: Path of the workbook the table is defined by
+    :param sheet_name: Name of the worksheet, or None for a workbook's first worksheet
+    :param usecols: Optional list of column names, or Excel column range such as "A:B", to read
+    :param header: 0 if the first row holds column names, None if columns are named by position
+    :param nrows: Optional number of rows to read
+    :param dtype: Optional dict with key: column name and value: type to read the column as
+    :return: DataFrame
+    """
+
+    future = preloaded_tables.get(table_key(file_path, sheet_name, usecols, header, nrows, dtype))
+
+    if future is not None:
+        return future.result().copy()
+
+    return load_table(file_path, sheet_name, usecols, header, nrows, dtype)
+
+
+def load_table(file_path, sheet_name=None, usecols=None, header=0, nrows=None, dtype=None, pool=None):
+    """
+    Reads a logical model input table from its source, without checking for a scheduled read.
+
+    :param file_path: Path of the workbook the table is defined by
+    :param sheet_name: Name of the worksheet, or None for a workbook's first worksheet
+    :param usecols: Optional list of column names, or Excel column range such as "A:B", to read
+    :param header: 0 if the first row holds column names, None if columns are named by position
+    :param nrows: Optional number of rows to read
+    :param dtype: Optional dict with key: column name and value: type to read the column as
+    :param pool: WorkbookPool to read worksheets through; defaults to the pool of the current process
+    :return: DataFrame
+    """
+
+    source_path = resolve_table_source(file_path, sheet_name)
+    extension = os.path.splitext(source_path)[1].lower()
+
+    if extension not in TABLE_EXTENSIONS:
+        if pool is None:
+            pool = get_workbook_pool()
+        return pool.read_sheet(source_path,
+                               sheet_name=sheet_name if sheet_name is not None else 0,
+                               usecols=usecols,
+                               header=header,
+                               nrows=nrows,
+                               dtype=dtype)
+
+    positions = column_positions(usecols) if isinstance(usecols, str) else None
+
+    if extension == ".csv":
+        return pd.read_csv(source_path, usecols=positions if positions is not None else usecols, header=header,
+                           nrows=nrows, dtype=dtype)
+
+    # Columnar formats always carry column names; with header=None, columns are renamed to their positions
+    if positions is not None or header is None:
+        table = read_arrow_table(source_path)
+        if positions is None:
+            positions = range(table.num_columns)
+        table = table.select([table.column_names[position] for position in positions])
+    else:
+        table = read_arrow_table(source_path, usecols)
+
+    if nrows is not None:
+        table = table.slice(0, nrows)
+
+    df = table.to_pandas()
+    if header is None:
+        df.columns = list(positions)
+
+    return df.astype(dtype) if dtype is not None else df
+
+
+def read_table_chunks(file_path, sheet_name=None, chunk_size=10000):
+    """
+    Reads a logical model input table a chunk of rows at a time without loading it into memory: worksheets with
+    openpyxl's read-only row iterator, CSV files with pandas' chunked reader and Parquet and Arrow IPC files from a
+    memory map.
+
+    :param file_path: Path of the workbook the table is defined by
+    :param sheet_name: Name of the worksheet, or None for a workbook's first worksheet
+    :param chunk_size: Number of rows per chunk
+    :return: Generator of DataFrames indexed by each row's number in the worksheet (the header is row 1); empty rows are
+             skipped
+    """
+
+    source_path = resolve_table_source(file_path, sheet_name)
+    extension = os.path.splitext(source_path)[1].lower()
+    # Row 1 holds the headers
+    first_row = 2
+
+    if extension == ".csv":
+        chunks = pd.read_csv(source_path, chunksize=chunk_size)
+    elif extension in TABLE_EXTENSIONS:
+        table = read_arrow_table(source_path)
+        chunks = (table.slice(offset, chunk_size).to_pandas() for offset in range(0, table.num_rows, chunk_size))
+    else:
+        chunks = read_worksheet_chunks(source_path, sheet_name, chunk_size)
+
+    for chunk_df in chunks:
+        chunk_df.index = range(first_row, first_row + len(chunk_df))
+        first_row += len(chunk_df)
+
+        chunk_df = chunk_df.dropna(how="all")
+        if not chunk_df.empty:
+            yield chunk_df
+
+
+def read_worksheet_chunks(file_path, sheet_name=None, chunk_size=10000):
+    """
+    Reads a worksheet a chunk of rows at a time with openpyxl's read-only row iterator.
+
+    :param file_path: Path to the workbook
+    :param sheet_name: Name of the worksheet, or None for the first worksheet
+    :param chunk_size: Number of rows per chunk
+    :return: Generator of DataFrames with the worksheet's columns
+    """
+
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+
+    try:
+        worksheet = workbook[sheet_name] if sheet_name is not None else workbook.worksheets[0]
+        rows = worksheet.iter_rows(values_only=True)
+        columns = next(rows)
+
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+
+            yield pd.DataFrame(chunk, columns=columns)
+    finally:
+        workbook.close()
+
+
+"""
+########################################################################################################################
+####################################### WORKBOOKPOOL CLASS BELOW #######################################################
+########################################################################################################################
+"""
+
+
+class WorkbookPool:
+    """
+    Workbooks opened once and shared by every sheet read through the pool, with counts of opens and reads for
+    diagnostics.
+    Opening a workbook decompresses it and parses its shared strings, so reading several of its sheets (or the same
+    sheet several times) from one handle avoids repeating that work.
+    """
+
+    def __init__(self):
+        """
+        Initialize instance variables.
+        """
+
+        # Dict with key: workbook path and value: open pd.ExcelFile
+        self.workbooks = {}
+        # Dict with key: workbook path and value: lock held while one of its sheets is read, as a handle isn't safe to
+        # read from several threads at once; different workbooks are still read concurrently
+        self.workbook_locks = {}
+        # Number of times each workbook was opened, i.e. had its shared strings parsed
+        self.open_counts = collections.Counter()
+        # Number of sheet reads served from each workbook
+        self.sheet_read_counts = collections.Counter()
+        # Process the pool belongs to (see get_workbook_pool())
+        self.pid = os.getpid()
+        # Guards workbooks and the counts when sheets are read from several threads
+        self.lock = threading.Lock()
+
+    def open_workbook(self, file_path):
+        """
+        Gives the open handle of a workbook, opening it if this is its first use since the pool was last closed.
+
+        :param file_path: Path to the workbook
+        :return: pd.ExcelFile
+        """
+
+        with self.lock:
+            if file_path not in self.workbooks:
+                self.workbooks[file_path] = pd.ExcelFile(file_path)
+                self.workbook_locks.setdefault(file_path, threading.Lock())
+                self.open_counts[file_path] += 1
+
+            return self.workbooks[file_path]
+
+    def read_sheet(self, file_path, sheet_name=0, **read_excel_args):
+        """
+        Reads a worksheet from a pooled workbook.
+
+        :param file_path: Path to the workbook
+        :param sheet_name: Name or position of the worksheet
+        :param read_excel_args: Further pd.read_excel() arguments
+        :return: DataFrame
+        """
+
+        workbook = self.open_workbook(file_path)
+
+        with self.lock:
+            self.sheet_read_counts[file_path] += 1
+
+        with self.workbook_locks[file_path]:
+            return pd.read_excel(workbook, sheet_name=sheet_name, **read_excel_args)
+
+    def close(self):
+        """
+        Closes every open workbook. The counts are kept; a later read opens its workbook again.
+
+        :return: None
+        """
+
+        with self.lock:
+            for workbook in self.workbooks.values():
+                workbook.close()
+            self.workbooks.clear()
+
+    def merge_counts(self, open_counts, sheet_read_counts):
+        """
+        Adds the counts of another pool, e.g. one a preload task read through in a worker process.
+
+        :param open_counts: Counter of workbook opens
+        :param sheet_read_counts: Counter of sheet reads
+        :return: None
+        """
+
+        with self.lock:
+            self.open_counts.update(open_counts)
+            self.sheet_read_counts.update(sheet_read_counts)
+
+    def summarize(self):
+        """
+        :return: DataFrame with columns "file_path", "opens", "sheet_reads", one row per workbook read in this process
+                 or by a preload task whose counts were merged in (see merge_counts())
+        """
+
+        return pd.DataFrame([{"file_path": file_path,
+                              "opens": self.open_counts[file_path],
+                              "sheet_reads": self.sheet_read_counts[file_path]}
+                             for file_path in self.open_counts],
+                            columns=["file_path", "opens", "sheet_reads"])
+
+
+# Workbook pool of the main process; use get_workbook_pool()
+workbook_pool = WorkbookPool()
@@ -0,0 +1,259 @@
+import argparse
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from asset import Asset, function_from_shop_code
+from descriptionindex import DescriptionIndex
+from servicecontracts import lookup_service_contract_cost
+
+"""
+########################################################################################################################
+##################################### MODULE SCOPE FUNCTIONS BELOW #####################################################
+########################################################################################################################
+
+Precomputes a rate card and a model x cost centre matrix of annual cost to service so that procurement quotes ("what
+would it cost to service N of model X at site Y") can be answered in constant time without running the model. Imaging
+quotes add the annual service contract cost from the catalogue in force when the matrix was built (see
+servicecontracts.py).
+
+This module only imports workbook-reading modules inside build_price_matrix(), so loading a saved PriceMatrix and
+quoting from it never touches a workbook:
+
+    $ python pricematrix.py build --contract-date 2025-04-01
+    $ python pricematrix.py quote MODEL_NUMBER SITE_CODE SHOP_CODE --qty 4 --health-auth HEALTH_AUTH
+"""
+
+# Default location of the persisted PriceMatrix
+price_matrix_file_path = "model_outputs/price_matrix.pkl"
+
+# A representative shop code for each asset function, used to resolve each site to its cost centres
+FUNCTION_SHOP_CODES = {"clinical": "", "renal": "REN", "imaging": "IMAG"}
+
+
+def build_price_matrix(contract_date=None):
+    """
+    Builds a PriceMatrix from the reference workbooks in model_inputs/.
+
+    :param contract_date: Date the service contracts must cover; defaults to BudgetReport.service_contract_date
+    :return: PriceMatrix object
+    """
+
+    # Imported here so that loading and quoting from a saved PriceMatrix doesn't read any workbooks
+    from budgetreport import BudgetReport, read_asset_support_hours_reference
+    from costcentre import CostCentre
+    from referencearrays import build_reference_arrays, build_support_hours_lookup
+    from servicecontracts import build_service_contract_lookup, read_service_contract_catalogue
+    from vectorengine import compute_cost_centre_rates
+
+    # Rate card: POHR and weighted average tech wage for every cost centre with tech staff
+    arrays = build_reference_arrays()
+    rates = compute_cost_centre_rates(arrays, CostCentre.OH_TECH_TIME_PERCENTAGE, CostCentre.PRODUCTIVITY_RATE)
+
+    rate_card = pd.DataFrame({"non_labour_oh": rates["non_labour_oh"],
+                              "tech_staff_oh": rates["tech_staff_oh"],
+                              "regional_staff_oh": rates["regional_staff_oh"],
+                              "total_oh": rates["total_oh"],
+                              "pohr": rates["pohr"],
+                              "weighted_avg_tech_hourly_wage": rates["weighted_avg_tech_hourly_wage"]},
+                             index=pd.Index(arrays["cost_centre_names"], name="cost_centre_name"))
+    rate_card["hourly_cost"] = rate_card["pohr"] + rate_card["weighted_avg_tech_hourly_wage"]
+
+    asset_support_hours_df = read_asset_support_hours_reference()
+    model_hours, description_hours = build_support_hours_lookup(asset_support_hours_df)
+
+    # Resolve every site-function combination to a cost centre the same way Asset does
+    site_cost_centres = {}
+
+    for site_code in BudgetReport.sites_cost_centre_dict:
+        for function, shop_code in FUNCTION_SHOP_CODES.items():
+            try:
+                asset = Asset("", "", 0, "", site_code, shop_code, BudgetReport.sites_cost_centre_dict)
+            except AttributeError:
+                # Site has no cost centre of any function
+                continue
+            site_cost_centres[(site_code, function)] = asset.cost_centre
+
+    if contract_date is None:
+        contract_date = BudgetReport.service_contract_date
+    service_contract_lookup = build_service_contract_lookup(read_service_contract_catalogue(), contract_date)
+
+    return PriceMatrix(rate_card, model_hours, description_hours, site_cost_centres,
+                       DescriptionIndex(asset_support_hours_df), service_contract_lookup)
+
+
+def load_price_matrix(file_path=price_matrix_file_path):
+    """
+    Loads a PriceMatrix persisted with PriceMatrix.save().
+
+    :param file_path: Path to the persisted PriceMatrix
+    :return: PriceMatrix object
+    """
+
+    with open(file_path, "rb") as price_matrix_file:
+        return pickle.load(price_matrix_file)
+
+
+"""
+########################################################################################################################
+######################################## PRICEMATRIX CLASS BELOW #######################################################
+########################################################################################################################
+"""
+
+
+class PriceMatrix:
+    """
+    Rate card and precomputed annual cost to service for every (model number or asset description) x cost centre pair.
+    Annual cost = support hours * (POHR + Tech $/hr), i.e. the outer product of the support hours vector and the
+    hourly cost vector. Imaging quotes add the asset's annual service contract cost on top.
+    """
+
+    def __init__(self, rate_card, model_hours, description_hours, site_cost_centres, description_index=None,
+                 service_contract_lookup=None):
+        """
+        :param rate_card: DataFrame indexed by cost centre name with OH components, "pohr",
+                          "weighted_avg_tech_hourly_wage" and "hourly_cost" columns
+        :param model_hours: Dict with key: model number and value: annual support hours
+        :param description_hours: Dict with key: asset description and value: annual support hours
+        :param site_cost_centres: Dict with key: (site code, function) and value: cost centre name
+        :param description_index: Optional DescriptionIndex used to estimate support hours for assets with neither an
+                                  exact model number nor an exact description match
+        :param service_contract_lookup: Optional tuple returned by servicecontracts.build_service_contract_lookup();
+                                        without it, no asset has a service contract cost
+        """
+
+        # Per cost centre rates
+        self.rate_card = rate_card
+        # POHR and weighted average tech wage for each column of annual_cost
+        self.pohr = rate_card["pohr"].to_numpy(dtype=np.float64)
+        self.weighted_avg_tech_hourly_wage = rate_card["weighted_avg_tech_hourly_wage"].to_numpy(dtype=np.float64)
+        # Dict with key: cost centre name and value: column of annual_cost
+        self.cost_centre_columns = {name: column for column, name in enumerate(rate_card.index)}
+        # Dict with key: model number and value: row of annual_cost
+        self.model_rows = {model_num: row for row, model_num in enumerate(model_hours)}
+        # Dict with key: asset description and value: row of annual_cost (rows follow the model number rows)
+        self.description_rows = {description: row + len(model_hours)
+                                 for row, description in enumerate(description_hours)}
+        # Annual support hours for each row of annual_cost
+        self.support_hours = np.array(list(model_hours.values()) + list(description_hours.values()),
+                                      dtype=np.float64)
+        # Dict with key: (site code, function) and value: cost centre name
+        self.site_cost_centres = site_cost_centres
+        # Fuzzy fallback for unmatched assets
+        self.description_index = description_index
+        # Service contracts in force when the matrix was built, keyed by each match level's columns
+        self.service_contract_lookup = service_contract_lookup
+        # Annual cost to service one asset, shape (number of models + number of descriptions, number of cost centres)
+        self.annual_cost = np.outer(self.support_hours, rate_card["hourly_cost"].to_numpy(dtype=np.float64))
+
+    def save(self, file_path=price_matrix_file_path):
+        """
+        Persists this PriceMatrix to disk.
+
+        :param file_path: Path to write to
+        :return: None
+        """
+
+        with open(file_path, "wb") as price_matrix_file:
+            pickle.dump(self, price_matrix_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def quote(self, model_num, site_code, shop_code, qty=1, asset_description=None, health_auth=None):
+        """
+        Looks up the annual cost to service qty assets of a model at a site. Support hours are matched on model number
+        first and on asset description second, as in BudgetReport.compute_asset_support_hours(). Imaging assets also
+        carry their service contract cost, resolved as in BudgetReport.compute_service_contract_costs().
+
+        :param model_num: Model number
+        :param site_code: Three-letter site code
+        :param shop_code: Shop code, for determining the function (clinical, renal, imaging) of the asset
+        :param qty: Quantity of assets
+        :param asset_description: Asset description, used if the model number isn't in the support hours reference
+        :param health_auth: Health authority of the asset, for service contracts that name one
+        :return: Dict with keys "cost_centre", "support_hours", "pohr", "weighted_avg_tech_hourly_wage",
+                 "service_contract_cost_per_asset", "service_contract_match", "cost_to_service_per_asset",
+                 "total_cost_to_service"
+        """
+
+        function = function_from_shop_code(shop_code)
+        cost_centre = self.site_cost_centres.get((site_code, function))
+        if cost_centre is None:
+            raise KeyError("Site {site_code} has no {function} cost centre in the price matrix".format(
+                site_code=site_code, function=function))
+
+        column = self.cost_centre_columns.get(cost_centre)
+        if column is None:
+            raise KeyError("Cost centre {name} has no tech staff in the price matrix".format(name=cost_centre))
+
+        row = self.model_rows.get(model_num)
+        if row is None and asset_description is not None:
+            row = self.description_rows.get(asset_description)
+
+        if row is not None:
+            support_hours = self.support_hours[row]
+            cost_to_service_per_asset = self.annual_cost[row, column]
+
+        # Unmatched assets fall back to the fuzzy description index (not constant time), then to 0 support hours,
+        # as in BudgetReport.compute_asset_support_hours()
+        else:
+            support_hours = 0.0
+            if self.description_index is not None and asset_description is not None:
+                support_hours = self.description_index.estimate_support_hours(model_num, asset_description)[0]
+            cost_to_service_per_asset = support_hours * (self.pohr[column] + self.weighted_avg_tech_hourly_wage[column])
+
+        # Only imaging worksheets have a service contract column
+        service_contract_cost, service_contract_match = 0.0, None
+        if function == "imaging" and self.service_contract_lookup is not None:
+            service_contract_cost, service_contract_match = lookup_service_contract_cost(self.service_contract_lookup,
+                                                                                         model_num, health_auth,
+                                                                                         site_code)
+        cost_to_service_per_asset = cost_to_service_per_asset + service_contract_cost
+
+        return {"cost_centre": cost_centre,
+                "support_hours": support_hours,
+                "pohr": self.pohr[column],
+                "weighted_avg_tech_hourly_wage": self.weighted_avg_tech_hourly_wage[column],
+                "service_contract_cost_per_asset": service_contract_cost,
+                "service_contract_match": service_contract_match,
+                "cost_to_service_per_asset": cost_to_service_per_asset,
+                "total_cost_to_service": cost_to_service_per_asset * qty}
+
+
+def main():
+    """
+    Builds and saves a PriceMatrix, or answers a quote from a saved one.
+
+    :return: None
+    """
+
+    parser = argparse.ArgumentParser(description="Precomputed price matrix for cost to service quotes")
+    parser.add_argument("--file", default=price_matrix_file_path, help="Path to the persisted price matrix")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Build the price matrix from model_inputs/ and save it")
+    build_parser.add_argument("--contract-date", default=None,
+                              help="Date the service contracts must cover (default: today)")
+
+    quote_parser = subparsers.add_parser("quote", help="Quote the annual cost to service assets of a model at a site")
+    quote_parser.add_argument("model_num")
+    quote_parser.add_argument("site_code")
+    quote_parser.add_argument("shop_code")
+    quote_parser.add_argument("--qty", type=float, default=1)
+    quote_parser.add_argument("--description", default=None, help="Asset description, if the model isn't matched")
+    quote_parser.add_argument("--health-auth", default=None,
+                              help="Health authority of the assets, for service contracts that name one")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_price_matrix(args.contract_date).save(args.file)
+        print("Price matrix written to {path}".format(path=os.path.abspath(args.file)))
+    else:
+        quote = load_price_matrix(args.file).quote(args.model_num, args.site_code, args.shop_code, args.qty,
+                                                   args.description, args.health_auth)
+        for key, value in quote.items():
+            print("{key}: {value}".format(key=key, value=value))
+
+
+if __name__ == "__main__":
+
+    main()
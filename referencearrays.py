@@ -0,0 +1,156 @@
+import numpy as np
+from budgetreport import BudgetReport
+from costcentre import CostCentre, read_partial_oh_history
+from generalledger import read_cost_centre_codes_reference
+from staff import Staff
+from vectorengine import TECH_LEVELS
+
+"""
+########################################################################################################################
+##################################### MODULE SCOPE FUNCTIONS BELOW #####################################################
+########################################################################################################################
+"""
+
+
+def build_reference_arrays(cost_centre_names=None, budget_report=None):
+    """
+    Flattens the reference data that the CostCentre computations use into plain NumPy arrays so that they can be
+    consumed by vectorengine (and shared between processes without pickling DataFrames).
+
+    :param cost_centre_names: List of cost centre names to build arrays for; defaults to the cost centres in
+                              budget_report if one is given, otherwise every cost centre in the "Tech Staff" sheet
+    :param budget_report: Optional BudgetReport object on which create_cost_centre_objects() and
+                          compute_asset_support_hours() (and optionally compute_service_contract_costs()) have been
+                          called; if given, per-asset arrays are added
+    :return: Dict with the following keys:
+                "cost_centre_names": 1-D object array of cost centre names (row order of every per-cost centre array)
+                "level_qty": (number of cost centres, 4) array of the number of techs at each level in TECH_LEVELS
+                "level_wage": Hourly wage for each level in TECH_LEVELS
+                "level_vac_days": Average annual vacation days for each level in TECH_LEVELS
+                "non_labour_oh": Non-labour OH per cost centre
+                "partial_oh_max": (number of cost centres, number of fiscal years) array of the larger of actual and
+                    budgeted partial OH in each fiscal year, padded with NaN for cost centres with a shorter history
+                "regional_salary_share": Regional staff annual salary (before benefits) attributed to each cost centre
+                "regional_salary": Annual salary (before benefits) of each regional staff
+                "regional_num_shares": Number of cost centres each regional staff's salary is split across
+                "regional_share_rank": (number of regional staff, number of cost centres) array giving the position of
+                    each cost centre in the alphabetical list of the staff's cost centres, or -1 if they don't oversee
+                    it
+                "hours_paid_per_year", "hours_worked_per_day", "semi_prod_days_per_year", "benefits_multiplier":
+                    0-D arrays
+                "asset_cc_index", "asset_qty", "asset_support_hours", "asset_service_contract_cost": Per-asset
+                    arrays, only if budget_report is given
+    """
+
+    cc_reference_df = read_cost_centre_codes_reference().set_index("cost_centre_name")
+    tech_staff_df = CostCentre.tech_staff_df.drop_duplicates("cost_centre_name").set_index("cost_centre_name")
+
+    if cost_centre_names is None:
+        if budget_report is not None:
+            cost_centre_names = list(budget_report.cost_centres.keys())
+        else:
+            cost_centre_names = tech_staff_df.index.tolist()
+
+    # Number of techs at each level, treating blank cells as no techs
+    level_columns = ["level{level}".format(level=level) for level in TECH_LEVELS]
+    level_qty = tech_staff_df.loc[cost_centre_names, level_columns].fillna(0).to_numpy(dtype=np.float64)
+
+    # Non-labour OH: mean over fiscal years of the larger of actual and budgeted partial OH
+    non_labour_oh = np.empty(len(cost_centre_names))
+    partial_oh_max = []
+
+    for index, name in enumerate(cost_centre_names):
+        if budget_report is not None and name in budget_report.cost_centres:
+            function = budget_report.cost_centres[name].function
+            health_auth = budget_report.cost_centres[name].health_auth
+        else:
+            function = cc_reference_df.at[name, "function"]
+            health_auth = cc_reference_df.at[name, "health_authority"]
+
+        financials_df = read_partial_oh_history(name, function, health_auth, CostCentre.partial_oh_history,
+                                                CostCentre.reference_store)
+        actual = financials_df["actual_partial_oh"].to_numpy(dtype=np.float64)
+        budgeted = financials_df["budgeted_partial_oh"].to_numpy(dtype=np.float64)
+        partial_oh_max.append(np.where(actual > budgeted, actual, budgeted))
+        non_labour_oh[index] = partial_oh_max[index].mean()
+
+    num_fiscal_years = max([len(history) for history in partial_oh_max], default=0)
+    partial_oh_max = np.array([np.pad(history, (0, num_fiscal_years - len(history)), constant_values=np.nan)
+                               for history in partial_oh_max]).reshape(len(cost_centre_names), num_fiscal_years)
+
+    # Regional staff salary attributed to each cost centre they oversee; benefits are applied in vectorengine
+    cc_position = {name: index for index, name in enumerate(cost_centre_names)}
+    regional_salary_share = np.zeros(len(cost_centre_names))
+    regional_staff = BudgetReport().create_regional_staff_objects()
+    regional_share_rank = np.full((len(regional_staff), len(cost_centre_names)), -1, dtype=np.int64)
+
+    for staff_index, staff in enumerate(regional_staff):
+        responsibility = sorted(staff.cost_centre_responsibility)
+        for name in set(staff.cost_centre_responsibility):
+            if name in cc_position:
+                regional_salary_share[cc_position[name]] += (staff.annual_salary /
+                                                             len(staff.cost_centre_responsibility))
+                regional_share_rank[staff_index, cc_position[name]] = responsibility.index(name)
+
+    arrays = {"cost_centre_names": np.array(cost_centre_names, dtype=object),
+              "level_qty": level_qty,
+              "level_wage": np.array([CostCentre.tech_staff_salary_dict.get(level) for level in TECH_LEVELS],
+                                     dtype=np.float64),
+              "level_vac_days": np.array([CostCentre.annual_vac_days_by_level.get(level) for level in TECH_LEVELS],
+                                         dtype=np.float64),
+              "non_labour_oh": non_labour_oh,
+              "partial_oh_max": partial_oh_max,
+              "regional_salary_share": regional_salary_share,
+              "regional_salary": np.array([staff.annual_salary for staff in regional_staff], dtype=np.float64),
+              "regional_num_shares": np.array([len(staff.cost_centre_responsibility) for staff in regional_staff],
+                                              dtype=np.int64),
+              "regional_share_rank": regional_share_rank,
+              "hours_paid_per_year": np.array(float(CostCentre.hours_paid_per_year)),
+              "hours_worked_per_day": np.array(float(CostCentre.hours_worked_per_day)),
+              "semi_prod_days_per_year": np.array(float(CostCentre.semi_prod_days_per_year)),
+              "benefits_multiplier": np.array(float(Staff.benefits_multiplier))}
+
+    if budget_report is not None:
+        asset_cc_index = []
+        asset_qty = []
+        asset_support_hours = []
+        asset_service_contract_cost = []
+
+        for name, cost_centre in budget_report.cost_centres.items():
+            for asset in cost_centre.assets:
+                asset_cc_index.append(cc_position[name])
+                asset_qty.append(asset.qty)
+                asset_support_hours.append(asset.avg_support_hours)
+                asset_service_contract_cost.append(asset.service_contract_cost)
+
+        arrays["asset_cc_index"] = np.array(asset_cc_index, dtype=np.int64)
+        arrays["asset_qty"] = np.array(asset_qty, dtype=np.float64)
+        arrays["asset_support_hours"] = np.array(asset_support_hours, dtype=np.float64)
+        arrays["asset_service_contract_cost"] = np.array(asset_service_contract_cost, dtype=np.float64)
+
+    return arrays
+
+
+def build_support_hours_lookup(asset_support_hours_df):
+    """
+    Precomputes, for every model number and every asset description in the support hours reference, the annual support
+    hours that BudgetReport.compute_asset_support_hours() would assign:
+        - By model number: mean "avg_support_hour_per_model" over the rows with that model number
+        - By description (fallback): average of the per-model means weighted by "count_asset"
+
+    :param asset_support_hours_df: DataFrame returned by budgetreport.read_asset_support_hours_reference()
+    :return: Tuple (model_hours, description_hours) of dicts keyed by model number and asset description
+    """
+
+    model_hours = asset_support_hours_df.groupby("model_number")["avg_support_hour_per_model"].mean().to_dict()
+
+    # Group by description and model number and summarize by average support hour and count of that model
+    description_model_df = asset_support_hours_df.groupby(["asset_description", "model_number"]).agg(
+        {"avg_support_hour_per_model": "mean", "count_asset": "sum"})
+    description_count = description_model_df.groupby(level="asset_description")["count_asset"].transform("sum")
+    # Product portion of weighted average computation
+    description_model_df["weight"] = description_model_df["avg_support_hour_per_model"] * (
+            description_model_df["count_asset"] / description_count)
+    description_hours = description_model_df.groupby(level="asset_description")["weight"].sum().to_dict()
+
+    return model_hours, description_hours
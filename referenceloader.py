@@ -0,0 +1,86 @@
+import concurrent.futures
+import os
+from budgetreport import BudgetReport
+from costcentre import CostCentre
+from modelinputs import preload_tables
+
+"""
+########################################################################################################################
+##################################### MODULE SCOPE FUNCTIONS BELOW #####################################################
+########################################################################################################################
+
+Concurrent loading of the model's input workbooks at startup. The asset support hours reference, the "Regional Staff"
+sheet, every financial report worksheet and the asset input don't depend on each other, but are otherwise read one
+after another, each when the stage that needs it gets to it. start_reference_loader() schedules all of them at once on
+a process (or thread) pool, one task per workbook so that each is opened once; each stage's read_table() call then only
+waits for its own table (see modelinputs.preload_tables()), so the reads take about as long as the slowest workbook
+(the support hours reference) rather than their sum.
+
+The small reference tables that CostCentre, Staff and BudgetReport read into class attributes at import time are read
+before any arguments are parsed and are left as they are.
+"""
+
+# Reads of the asset support hours reference and the "Regional Staff" sheet, with the same arguments as
+# budgetreport.read_asset_support_hours_reference() and BudgetReport.create_regional_staff_objects()
+SUPPORT_HOURS_READ = {"file_path": "model_inputs/wo_reports/asset_support_hours_reference.xlsx",
+                      "usecols": ["asset_description", "model_number", "avg_support_hour_per_model", "count_asset"]}
+REGIONAL_STAFF_READ = {"file_path": "model_inputs/labour_reports/staff_salaries.xlsx",
+                       "sheet_name": "Regional Staff"}
+
+
+def list_financial_report_reads(cost_centre_names=None):
+    """
+    Lists the financial report worksheet of every cost centre in the "Cost Centres" sheet, as read by
+    costcentre.read_partial_oh_history().
+
+    :param cost_centre_names: Set of the only cost centres whose worksheets to list; None for all
+    :return: List of dicts of read_table() arguments
+    """
+
+    table_reads = []
+
+    for health_auth, functions in BudgetReport.cost_centre_responsibility_dict.items():
+        for function, names in functions.items():
+            file_path = CostCentre.financial_reports_folder_path + "{function}/{health_auth}.xlsx".format(
+                function=function, health_auth=health_auth)
+            if os.path.exists(file_path):
+                table_reads.extend({"file_path": file_path, "sheet_name": name}
+                                   for name in names if cost_centre_names is None or name in cost_centre_names)
+
+    return table_reads
+
+
+def start_reference_loader(use_threads=False, max_workers=None, support_hours=True, financial_reports=True,
+                           asset_input=True, cost_centre_names=None):
+    """
+    Starts reading the input workbooks in the background.
+
+    :param use_threads: Whether to read on a thread pool instead of a process pool; workbook parsing is mostly pure
+                        Python, so threads only help where starting processes is slow
+    :param max_workers: Number of workers; defaults to the executor's default
+    :param support_hours: Whether to read the asset support hours reference (not needed with a reference store)
+    :param financial_reports: Whether to read the financial report worksheets (not needed with a general ledger or a
+                              reference store)
+    :param asset_input: Whether to read the "User Input" sheet (not needed for a streaming run, which reads it in
+                        chunks)
+    :param cost_centre_names: Set of the only cost centres whose financial report worksheets to read; None for all
+    :return: The concurrent.futures.Executor the reads were scheduled on
+    """
+
+    # Slowest first, so that it starts straight away
+    table_reads = [SUPPORT_HOURS_READ] if support_hours else []
+    table_reads.append(REGIONAL_STAFF_READ)
+
+    if asset_input:
+        table_reads.append({"file_path": BudgetReport.budget_report_input_file_path, "sheet_name": "User Input"})
+    if financial_reports:
+        table_reads.extend(list_financial_report_reads(cost_centre_names))
+
+    if use_threads:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers)
+
+    preload_tables(table_reads, executor)
+
+    return executor
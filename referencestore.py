@@ -0,0 +1,451 @@
+import argparse
+import datetime
+import os
+import sqlite3
+import pandas as pd
+
+"""
+########################################################################################################################
+##################################### MODULE SCOPE FUNCTIONS BELOW #####################################################
+########################################################################################################################
+
+Compiles the reference workbooks (cost centres and sites, asset support hours, tech staffing levels and the financial
+reports) into a single SQLite database, indexed on the keys the model looks them up by: cost centre name, site code,
+HA-function, model number and asset description. A run given a compiled store answers those lookups with indexed
+queries instead of scanning DataFrames or opening a financial report workbook per cost centre, and each fiscal year's
+reference data becomes one versioned file:
+
+    $ python referencestore.py compile FY2025
+    $ python referencestore.py info model_outputs/reference_stores/reference_store_FY2025.sqlite
+    $ python main.py --reference-store model_outputs/reference_stores/reference_store_FY2025.sqlite
+
+Labour scalars (salary schedules, vacation and general summaries, regional staff) are still read from the labour
+report workbooks, once per run. A run refuses a store whose source workbooks have changed since it was compiled, unless
+given --allow-stale-reference-store.
+"""
+
+# Default location of a compiled reference store, by fiscal year
+reference_store_file_path = "model_outputs/reference_stores/reference_store_{fiscal_year}.sqlite"
+
+# Reference workbooks compiled into the store
+REFERENCE_FILE_PATHS = ["model_inputs/cost_centres_and_sites/cost_centres_and_sites_reference.xlsx",
+                        "model_inputs/wo_reports/asset_support_hours_reference.xlsx",
+                        "model_inputs/labour_reports/staff_salaries.xlsx",
+                        "model_inputs/financial_reports/"]
+
+# model_number is left untyped so that, as in the worksheet, a numeric model number never matches a text one
+SCHEMA = """
+CREATE TABLE store_info (
+    fiscal_year TEXT NOT NULL,
+    compiled TEXT NOT NULL
+);
+
+CREATE TABLE store_inputs (
+    file_path TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL
+);
+
+CREATE TABLE sites (
+    site_code TEXT PRIMARY KEY,
+    clinical_cost_centre TEXT,
+    renal_cost_centre TEXT,
+    imaging_cost_centre TEXT
+);
+
+CREATE TABLE cost_centres (
+    cost_centre_code TEXT,
+    cost_centre_name TEXT NOT NULL,
+    health_authority TEXT,
+    function TEXT
+);
+
+CREATE TABLE tech_staff (
+    cost_centre_name TEXT NOT NULL,
+    health_auth TEXT,
+    function TEXT,
+    level8 REAL,
+    level9 REAL,
+    level10 REAL,
+    level12 REAL
+);
+
+CREATE TABLE asset_support_hours (
+    asset_description TEXT,
+    model_number,
+    avg_support_hour_per_model REAL,
+    count_asset INTEGER
+);
+
+CREATE TABLE partial_oh_history (
+    cost_centre_name TEXT NOT NULL,
+    health_authority TEXT,
+    function TEXT,
+    fiscal_year INTEGER,
+    actual_partial_oh REAL,
+    budgeted_partial_oh REAL
+);
+
+CREATE INDEX cost_centres_by_name ON cost_centres (cost_centre_name);
+CREATE INDEX cost_centres_by_ha_function ON cost_centres (health_authority, function);
+CREATE INDEX tech_staff_by_name ON tech_staff (cost_centre_name);
+CREATE INDEX asset_support_hours_by_model ON asset_support_hours (model_number);
+CREATE INDEX asset_support_hours_by_description ON asset_support_hours (asset_description);
+CREATE INDEX partial_oh_history_by_name ON partial_oh_history (cost_centre_name, fiscal_year);
+"""
+
+# Columns of each table loaded from the reference workbooks, in insert order
+TABLE_COLUMNS = {"sites": ["site_code", "clinical_cost_centre", "renal_cost_centre", "imaging_cost_centre"],
+                 "cost_centres": ["cost_centre_code", "cost_centre_name", "health_authority", "function"],
+                 "tech_staff": ["cost_centre_name", "health_auth", "function", "level8", "level9", "level10",
+                                "level12"],
+                 "asset_support_hours": ["asset_description", "model_number", "avg_support_hour_per_model",
+                                         "count_asset"],
+                 "partial_oh_history": ["cost_centre_name", "health_authority", "function", "fiscal_year",
+                                        "actual_partial_oh", "budgeted_partial_oh"]}
+
+
+def read_reference_tables():
+    """
+    Reads every reference table compiled into the store from the reference workbooks.
+
+    :return: Dict with key: table name (see TABLE_COLUMNS) and value: DataFrame with the table's columns
+    """
+
+    # Imported here so that opening and querying a compiled store doesn't read any workbooks
+    from budgetreport import read_asset_support_hours_reference
+    from costcentre import read_partial_oh_history, read_tech_staff_ref
+    from generalledger import read_cost_centre_codes_reference, sites_cc_file_path
+    from modelinputs import read_table
+
+    cost_centres_df = read_cost_centre_codes_reference()
+
+    # Every cost centre's history from its worksheet in financial_reports/{function}/{HA}.xlsx; cost centres without
+    # a worksheet (e.g. those with no tech staff) are left out, as they are never looked up
+    partial_oh_dfs = []
+
+    for cost_centre_name, health_auth, function in cost_centres_df[["cost_centre_name", "health_authority",
+                                                                    "function"]].itertuples(index=False):
+        try:
+            financials_df = read_partial_oh_history(cost_centre_name, function, health_auth)
+        except (FileNotFoundError, ValueError):
+            continue
+
+        partial_oh_dfs.append(financials_df[["fiscal_year", "actual_partial_oh", "budgeted_partial_oh"]].assign(
+            cost_centre_name=cost_centre_name, health_authority=health_auth, function=function))
+
+    return {"sites": read_table(sites_cc_file_path, sheet_name="Sites", usecols=TABLE_COLUMNS["sites"]),
+            "cost_centres": cost_centres_df,
+            "tech_staff": read_tech_staff_ref(),
+            "asset_support_hours": read_asset_support_hours_reference(),
+            "partial_oh_history": pd.concat(partial_oh_dfs, ignore_index=True) if partial_oh_dfs else
+            pd.DataFrame(columns=TABLE_COLUMNS["partial_oh_history"])}
+
+
+def hash_reference_inputs():
+    """
+    Hashes the reference workbooks compiled into the store, so that a store can be traced back to its sources.
+
+    :return: Dict with key: file path and value: hex digest; workbooks that don't exist are left out
+    """
+
+    # Imported here so that opening and querying a compiled store doesn't read any workbooks
+    from budgetreport import compute_file_hash, compute_input_hashes
+
+    input_hashes = {}
+
+    for file_path in REFERENCE_FILE_PATHS:
+        if os.path.isdir(file_path):
+            input_hashes.update({os.path.join(file_path, relative_path).replace(os.sep, "/"): digest
+                                 for relative_path, digest in compute_input_hashes(file_path).items()})
+        elif os.path.exists(file_path):
+            input_hashes[file_path] = compute_file_hash(file_path)
+
+    return input_hashes
+
+
+def compile_reference_store(fiscal_year, file_path=None):
+    """
+    Compiles the reference workbooks into a new reference store. The database is written under a temporary name and
+    then renamed, so an existing store is only replaced by a complete one.
+
+    :param fiscal_year: Fiscal year the reference data is for, e.g. "FY2025"; recorded in the store and used to name it
+    :param file_path: Path to write the store to; defaults to reference_store_file_path for fiscal_year
+    :return: Path of the compiled store
+    """
+
+    if file_path is None:
+        file_path = reference_store_file_path.format(fiscal_year=fiscal_year)
+
+    tables = read_reference_tables()
+    input_hashes = hash_reference_inputs()
+
+    if os.path.dirname(file_path):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    if os.path.exists(file_path + ".tmp"):
+        os.remove(file_path + ".tmp")
+
+    connection = sqlite3.connect(file_path + ".tmp")
+
+    try:
+        with connection:
+            connection.executescript(SCHEMA)
+            connection.execute("INSERT INTO store_info (fiscal_year, compiled) VALUES (?, ?)",
+                               (fiscal_year, datetime.datetime.now().isoformat(timespec="seconds")))
+            connection.executemany("INSERT INTO store_inputs (file_path, sha256) VALUES (?, ?)",
+                                   input_hashes.items())
+
+            for table_name, columns in TABLE_COLUMNS.items():
+                insert_sql = "INSERT INTO {table} ({columns}) VALUES ({placeholders})".format(
+                    table=table_name, columns=", ".join(columns), placeholders=", ".join("?" * len(columns)))
+                # Blank cells are stored as NULL; astype(object) turns NumPy scalars into Python ones for sqlite3
+                table_df = tables[table_name][columns].astype(object)
+                table_df = table_df.where(table_df.notna(), None)
+                connection.executemany(insert_sql, table_df.itertuples(index=False, name=None))
+
+        connection.execute("ANALYZE")
+    finally:
+        connection.close()
+
+    os.replace(file_path + ".tmp", file_path)
+
+    return file_path
+
+
+def use_reference_store(reference_store):
+    """
+    Makes the model look up reference data in a compiled store: site and HA-function cost centres, tech staffing
+    levels, asset support hours and (unless a general ledger was ingested) partial OH history.
+
+    :param reference_store: ReferenceStore object
+    :return: None
+    """
+
+    # Imported here so that opening and querying a compiled store doesn't read any workbooks
+    from budgetreport import BudgetReport
+    from costcentre import CostCentre
+
+    BudgetReport.reference_store = reference_store
+    BudgetReport.sites_cost_centre_dict = reference_store.read_sites_cost_centres()
+    BudgetReport.cost_centre_responsibility_dict = reference_store.read_cc_responsibility()
+    CostCentre.reference_store = reference_store
+
+
+"""
+########################################################################################################################
+##################################### REFERENCESTORE CLASS BELOW #######################################################
+########################################################################################################################
+"""
+
+
+class ReferenceStore:
+    """
+    Read-only indexed lookups against a reference store compiled with compile_reference_store().
+    """
+
+    def __init__(self, file_path):
+        """
+        Opens a compiled reference store.
+
+        :param file_path: Path to the SQLite database file
+        """
+
+        if not os.path.exists(file_path):
+            raise FileNotFoundError("No reference store at {path}; compile one with 'python referencestore.py "
+                                    "compile FISCAL_YEAR'".format(path=file_path))
+
+        # Path of the store, e.g. for hashing it with the run's inputs
+        self.file_path = file_path
+        # Read-only and shared by the threads of a scheduled run (see scheduler.py); sqlite3 serializes their queries
+        self.connection = sqlite3.connect("file:{path}?mode=ro".format(path=os.path.abspath(file_path)), uri=True,
+                                          check_same_thread=False)
+
+    def close(self):
+        """
+        Closes the database connection.
+
+        :return: None
+        """
+
+        self.connection.close()
+
+    def read_store_info(self):
+        """
+        :return: Dict with keys "fiscal_year", "compiled" and "inputs" (dict with key: reference file path and value:
+                 hex digest)
+        """
+
+        fiscal_year, compiled = self.connection.execute("SELECT fiscal_year, compiled FROM store_info").fetchone()
+
+        inputs = dict(self.connection.execute("SELECT file_path, sha256 FROM store_inputs ORDER BY file_path"))
+
+        return {"fiscal_year": fiscal_year, "compiled": compiled, "inputs": inputs}
+
+    def find_changed_inputs(self):
+        """
+        Compares the hashes of the reference workbooks the store was compiled from with those of the workbooks in
+        model_inputs/ now.
+
+        :return: Sorted list of the reference file paths changed, added or removed since the store was compiled
+        """
+
+        compiled_hashes = self.read_store_info()["inputs"]
+        current_hashes = hash_reference_inputs()
+
+        return sorted(file_path for file_path in compiled_hashes.keys() | current_hashes.keys()
+                      if compiled_hashes.get(file_path) != current_hashes.get(file_path))
+
+    def count_rows(self):
+        """
+        :return: Dict with key: table name and value: number of rows
+        """
+
+        return {table_name: self.connection.execute(
+                    "SELECT COUNT(*) FROM {table}".format(table=table_name)).fetchone()[0]
+                for table_name in TABLE_COLUMNS}
+
+    def read_sites_cost_centres(self):
+        """
+        Reads the cost centres of every site, laid out like budgetreport.read_sites_cost_centres_reference().
+
+        :return: Dictionary with key: "site" and value: ["clinical cost centre", "renal cost centre", "imaging cost
+                 centre"], with None for a function the site has no cost centre for
+        """
+
+        return {row[0]: list(row[1:]) for row in self.connection.execute(
+            "SELECT site_code, clinical_cost_centre, renal_cost_centre, imaging_cost_centre FROM sites ORDER BY rowid")}
+
+    def read_cc_responsibility(self):
+        """
+        Lists the cost centres of each HA-function combination, laid out like
+        budgetreport.read_cc_responsibility_reference().
+
+        :return: Nested dictionary in the form {"HA1": {"function1": ["cost_centre1", "cost_centre2"], ...}, ...}
+        """
+
+        health_auths = [row[0] for row in self.connection.execute(
+            "SELECT health_authority FROM cost_centres GROUP BY health_authority ORDER BY MIN(rowid)")]
+        functions = [row[0] for row in self.connection.execute(
+            "SELECT function FROM cost_centres GROUP BY function ORDER BY MIN(rowid)")]
+
+        return {health_auth: {function: self.find_cost_centres(health_auth, function) for function in functions}
+                for health_auth in health_auths}
+
+    def find_cost_centres(self, health_auth, function):
+        """
+        :param health_auth: Health authority
+        :param function: Function (clinical, renal, imaging)
+        :return: List of the names of the HA's cost centres of that function, in reference order
+        """
+
+        return [row[0] for row in self.connection.execute(
+            "SELECT cost_centre_name FROM cost_centres WHERE health_authority = ? AND function = ? ORDER BY rowid",
+            (health_auth, function))]
+
+    def find_tech_staff_levels(self, cost_centre_name):
+        """
+        Looks up the number of techs of each level at a cost centre in the "Tech Staff" reference.
+
+        :param cost_centre_name: Cost centre name
+        :return: List of floats [level 8, level 9, level 10, level 12], with NaN for blank cells
+        """
+
+        row = self.connection.execute(
+            "SELECT level8, level9, level10, level12 FROM tech_staff WHERE cost_centre_name = ? ORDER BY rowid LIMIT 1",
+            (cost_centre_name,)).fetchone()
+
+        if row is None:
+            raise KeyError("Cost centre {name} has no tech staff in the reference store".format(name=cost_centre_name))
+
+        return [float("nan") if qty is None else qty for qty in row]
+
+    def find_asset_support_hours(self, column, value):
+        """
+        Looks up the asset support hours reference rows with a given model number or asset description.
+
+        :param column: "model_number" or "asset_description"
+        :param value: Value to match exactly
+        :return: DataFrame laid out like budgetreport.read_asset_support_hours_reference()
+        """
+
+        if column not in ("model_number", "asset_description"):
+            raise ValueError("Asset support hours can only be looked up by model_number or asset_description")
+
+        return pd.read_sql_query("SELECT {columns} FROM asset_support_hours WHERE {column} = ? ORDER BY rowid".format(
+            columns=", ".join(TABLE_COLUMNS["asset_support_hours"]), column=column), self.connection,
+            params=(value.item() if hasattr(value, "item") else value,))
+
+    def read_table(self, table_name):
+        """
+        Reads a whole reference table, e.g. for checks that join it against the input.
+
+        :param table_name: One of TABLE_COLUMNS
+        :return: DataFrame with the table's columns, in reference order
+        """
+
+        if table_name not in TABLE_COLUMNS:
+            raise ValueError("Unknown reference table {table}; choose from {tables}".format(
+                table=table_name, tables=", ".join(TABLE_COLUMNS)))
+
+        return pd.read_sql_query("SELECT {columns} FROM {table} ORDER BY rowid".format(
+            columns=", ".join(TABLE_COLUMNS[table_name]), table=table_name), self.connection)
+
+    def read_asset_support_hours(self):
+        """
+        :return: Whole asset support hours reference, laid out like budgetreport.read_asset_support_hours_reference()
+        """
+
+        return self.read_table("asset_support_hours")
+
+    def find_partial_oh_history(self, cost_centre_name):
+        """
+        Looks up a cost centre's actual and budgeted partial OH for each fiscal year.
+
+        :param cost_centre_name: Cost centre name
+        :return: DataFrame with columns "fiscal_year", "actual_partial_oh", "budgeted_partial_oh", in the order of the
+                 cost centre's financial report
+        """
+
+        return pd.read_sql_query(
+            "SELECT fiscal_year, actual_partial_oh, budgeted_partial_oh FROM partial_oh_history "
+            "WHERE cost_centre_name = ? ORDER BY rowid", self.connection, params=(cost_centre_name,))
+
+
+def main():
+    """
+    Compiles a reference store, or describes a compiled one.
+
+    :return: None
+    """
+
+    parser = argparse.ArgumentParser(description="Compiled, indexed store of the model's reference data")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compile_parser = subparsers.add_parser("compile", help="Compile the reference workbooks in model_inputs/")
+    compile_parser.add_argument("fiscal_year", help="Fiscal year of the reference data, e.g. FY2025")
+    compile_parser.add_argument("--file", help="Path to write the store to (default: {path})".format(
+        path=reference_store_file_path))
+
+    info_parser = subparsers.add_parser("info", help="Show a store's fiscal year, sources and table sizes")
+    info_parser.add_argument("file", help="Path to a compiled store")
+
+    args = parser.parse_args()
+
+    if args.command == "compile":
+        file_path = compile_reference_store(args.fiscal_year, args.file)
+        print("Reference store written to {path}".format(path=os.path.abspath(file_path)))
+    else:
+        reference_store = ReferenceStore(args.file)
+        store_info = reference_store.read_store_info()
+        print("Fiscal year: {fiscal_year}\nCompiled: {compiled}".format(**store_info))
+        for table_name, num_rows in reference_store.count_rows().items():
+            print("{table}: {rows} rows".format(table=table_name, rows=num_rows))
+        for file_path, digest in store_info["inputs"].items():
+            print("{digest}  {path}".format(digest=digest, path=file_path))
+        for file_path in reference_store.find_changed_inputs():
+            print("Changed since compiled: {path}".format(path=file_path))
+        reference_store.close()
+
+
+if __name__ == "__main__":
+
+    main()
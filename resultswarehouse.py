@@ -0,0 +1,352 @@
+import argparse
+import datetime
+import hashlib
+import sqlite3
+import pandas as pd
+
+"""
+########################################################################################################################
+##################################### MODULE SCOPE FUNCTIONS BELOW #####################################################
+########################################################################################################################
+
+Local SQLite warehouse of every model run: per-cost centre rates and OH components, per-asset results and the hashes of
+the input files that produced them. main.py appends each run; this module's command line answers trend and comparison
+questions without reading any workbook:
+
+    $ python resultswarehouse.py runs
+    $ python resultswarehouse.py trend BME_VGH pohr --last 12
+    $ python resultswarehouse.py compare 14 15 total_cost_to_service
+"""
+
+# Default location of the results warehouse
+results_warehouse_file_path = "model_outputs/results_warehouse.sqlite"
+
+# Per-cost centre metrics that can be trended or compared
+COST_CENTRE_METRICS = ["num_assets", "asset_qty", "support_hours", "non_labour_oh", "tech_staff_oh",
+                       "regional_staff_oh", "total_oh", "pohr", "weighted_avg_tech_hourly_wage",
+                       "total_cost_to_service"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_timestamp TEXT NOT NULL,
+    inputs_hash TEXT NOT NULL,
+    notes TEXT
+);
+
+CREATE TABLE IF NOT EXISTS run_inputs (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    file_path TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (run_id, file_path)
+);
+
+CREATE TABLE IF NOT EXISTS cost_centre_results (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    cost_centre_name TEXT NOT NULL,
+    health_auth TEXT,
+    function TEXT,
+    num_assets INTEGER,
+    asset_qty REAL,
+    support_hours REAL,
+    non_labour_oh REAL,
+    tech_staff_oh REAL,
+    regional_staff_oh REAL,
+    total_oh REAL,
+    pohr REAL,
+    weighted_avg_tech_hourly_wage REAL,
+    total_cost_to_service REAL,
+    PRIMARY KEY (run_id, cost_centre_name)
+);
+
+CREATE TABLE IF NOT EXISTS asset_results (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    cost_centre_name TEXT NOT NULL,
+    health_auth TEXT,
+    function TEXT,
+    shop_code TEXT,
+    site_code TEXT,
+    model_num TEXT,
+    asset_description TEXT,
+    qty REAL,
+    avg_support_hours REAL,
+    support_hours_match TEXT,
+    service_contract_match TEXT,
+    oh_cost_per_asset REAL,
+    direct_cost_per_asset REAL,
+    service_contract_cost_per_asset REAL,
+    cost_to_service_per_asset REAL,
+    total_cost_to_service REAL
+);
+
+CREATE INDEX IF NOT EXISTS runs_by_inputs_hash ON runs (inputs_hash);
+CREATE INDEX IF NOT EXISTS run_inputs_by_file ON run_inputs (file_path, sha256);
+CREATE INDEX IF NOT EXISTS cost_centre_results_by_name ON cost_centre_results (cost_centre_name, run_id);
+CREATE INDEX IF NOT EXISTS asset_results_by_run ON asset_results (run_id, cost_centre_name);
+CREATE INDEX IF NOT EXISTS asset_results_by_model ON asset_results (model_num, run_id);
+"""
+
+# Columns added to the schema after it was first released; added to older warehouse files when they are opened
+ADDED_COLUMNS = {"asset_results": {"support_hours_match": "TEXT", "service_contract_match": "TEXT"}}
+
+
+def combine_input_hashes(input_hashes):
+    """
+    Combines per-file hashes into a single hash identifying the full set of inputs.
+
+    :param input_hashes: Dict with key: file path and value: hex digest
+    :return: Hex digest
+    """
+
+    combined = hashlib.sha256()
+
+    for file_path in sorted(input_hashes):
+        combined.update("{path}:{digest}\n".format(path=file_path, digest=input_hashes[file_path]).encode())
+
+    return combined.hexdigest()
+
+
+"""
+########################################################################################################################
+##################################### RESULTSWAREHOUSE CLASS BELOW #####################################################
+########################################################################################################################
+"""
+
+
+class ResultsWarehouse:
+    """
+    Appends model runs to, and queries them from, a local SQLite database.
+    """
+
+    def __init__(self, file_path=results_warehouse_file_path):
+        """
+        Opens (creating if needed) the warehouse database.
+
+        :param file_path: Path to the SQLite database file
+        """
+
+        self.connection = sqlite3.connect(file_path)
+        self.connection.executescript(SCHEMA)
+        self.upgrade_schema()
+
+    def upgrade_schema(self):
+        """
+        Adds any of ADDED_COLUMNS that are missing from a warehouse created by an earlier version of the model.
+
+        :return: None
+        """
+
+        with self.connection:
+            for table_name, columns in ADDED_COLUMNS.items():
+                existing_columns = {row[1] for row in self.connection.execute(
+                    "PRAGMA table_info({table})".format(table=table_name))}
+                for column_name, column_type in columns.items():
+                    if column_name not in existing_columns:
+                        self.connection.execute("ALTER TABLE {table} ADD COLUMN {column} {type}".format(
+                            table=table_name, column=column_name, type=column_type))
+
+    def close(self):
+        """
+        Closes the database connection.
+
+        :return: None
+        """
+
+        self.connection.close()
+
+    def record_run(self, cost_centre_results, asset_results, input_hashes, notes=None):
+        """
+        Appends a run to the warehouse in a single transaction.
+
+        :param cost_centre_results: DataFrame returned by BudgetReport.build_results_tables()
+        :param asset_results: DataFrame returned by BudgetReport.build_results_tables()
+        :param input_hashes: Dict returned by budgetreport.compute_input_hashes()
+        :param notes: Optional free-text description of the run
+        :return: run_id of the new run
+        """
+
+        with self.connection:
+            run_id = self.insert_run(input_hashes, notes)
+            self.insert_results(run_id, cost_centre_results, asset_results)
+
+        return run_id
+
+    def insert_run(self, input_hashes, notes=None):
+        """
+        Adds a run and its input hashes, without committing, so that its results can be inserted in the same
+        transaction (e.g. one cost centre at a time with insert_results()).
+
+        :param input_hashes: Dict returned by budgetreport.compute_input_hashes()
+        :param notes: Optional free-text description of the run
+        :return: run_id of the new run
+        """
+
+        cursor = self.connection.execute(
+            "INSERT INTO runs (run_timestamp, inputs_hash, notes) VALUES (?, ?, ?)",
+            (datetime.datetime.now().isoformat(timespec="seconds"), combine_input_hashes(input_hashes), notes))
+        run_id = cursor.lastrowid
+
+        self.connection.executemany("INSERT INTO run_inputs (run_id, file_path, sha256) VALUES (?, ?, ?)",
+                                    [(run_id, file_path, digest) for file_path, digest in input_hashes.items()])
+
+        return run_id
+
+    def insert_results(self, run_id, cost_centre_results, asset_results):
+        """
+        Inserts results tables of a run added with insert_run(), without committing.
+
+        :param run_id: Run to tag the rows with
+        :param cost_centre_results: DataFrame returned by BudgetReport.build_results_tables()
+        :param asset_results: DataFrame returned by BudgetReport.build_results_tables()
+        :return: None
+        """
+
+        self.insert_rows("cost_centre_results", run_id, cost_centre_results)
+        self.insert_rows("asset_results", run_id, asset_results)
+
+    def insert_rows(self, table_name, run_id, results_df):
+        """
+        Inserts the rows of a results DataFrame into a warehouse table, tagged with run_id.
+
+        :param table_name: Name of the table
+        :param run_id: Run to tag the rows with
+        :param results_df: DataFrame whose columns are a subset of the table's columns
+        :return: None
+        """
+
+        columns = ["run_id"] + list(results_df.columns)
+        insert_sql = "INSERT INTO {table} ({columns}) VALUES ({placeholders})".format(
+            table=table_name, columns=", ".join(columns), placeholders=", ".join("?" * len(columns)))
+
+        self.connection.executemany(insert_sql,
+                                    ((run_id,) + row for row in results_df.itertuples(index=False, name=None)))
+
+    def list_runs(self, limit=20):
+        """
+        Lists the most recent runs.
+
+        :param limit: Maximum number of runs to return
+        :return: DataFrame with columns "run_id", "run_timestamp", "inputs_hash", "notes", "num_cost_centres",
+                 "total_cost_to_service"
+        """
+
+        return pd.read_sql_query("""
+            SELECT r.run_id, r.run_timestamp, r.inputs_hash, r.notes,
+                   COUNT(c.cost_centre_name) AS num_cost_centres,
+                   SUM(c.total_cost_to_service) AS total_cost_to_service
+            FROM runs r LEFT JOIN cost_centre_results c ON c.run_id = r.run_id
+            GROUP BY r.run_id
+            ORDER BY r.run_id DESC
+            LIMIT ?""", self.connection, params=(limit,))
+
+    def cost_centre_trend(self, cost_centre_name, metric, last=12):
+        """
+        Gives a cost centre metric over the last runs that included the cost centre.
+
+        :param cost_centre_name: Cost centre name
+        :param metric: One of COST_CENTRE_METRICS
+        :param last: Number of runs
+        :return: DataFrame with columns "run_id", "run_timestamp", metric, oldest run first
+        """
+
+        if metric not in COST_CENTRE_METRICS:
+            raise ValueError("Unknown metric {metric}; choose from {metrics}".format(
+                metric=metric, metrics=", ".join(COST_CENTRE_METRICS)))
+
+        trend_df = pd.read_sql_query("""
+            SELECT c.run_id, r.run_timestamp, c.{metric}
+            FROM cost_centre_results c JOIN runs r ON r.run_id = c.run_id
+            WHERE c.cost_centre_name = ?
+            ORDER BY c.run_id DESC
+            LIMIT ?""".format(metric=metric), self.connection, params=(cost_centre_name, last))
+
+        return trend_df.iloc[::-1].reset_index(drop=True)
+
+    def compare_runs(self, run_id_a, run_id_b, metric):
+        """
+        Compares a cost centre metric between two runs.
+
+        :param run_id_a: First run
+        :param run_id_b: Second run
+        :param metric: One of COST_CENTRE_METRICS
+        :return: DataFrame with columns "cost_centre_name", "run_a", "run_b", "difference"; cost centres in only one
+                 of the runs have a blank value for the other
+        """
+
+        if metric not in COST_CENTRE_METRICS:
+            raise ValueError("Unknown metric {metric}; choose from {metrics}".format(
+                metric=metric, metrics=", ".join(COST_CENTRE_METRICS)))
+
+        comparison_df = pd.read_sql_query("""
+            SELECT cost_centre_name,
+                   MAX(CASE WHEN run_id = :a THEN {metric} END) AS run_a,
+                   MAX(CASE WHEN run_id = :b THEN {metric} END) AS run_b
+            FROM cost_centre_results
+            WHERE run_id IN (:a, :b)
+            GROUP BY cost_centre_name
+            ORDER BY cost_centre_name""".format(metric=metric), self.connection,
+                                          params={"a": run_id_a, "b": run_id_b})
+        comparison_df["difference"] = comparison_df["run_b"] - comparison_df["run_a"]
+
+        return comparison_df
+
+    def read_run_results(self, run_id):
+        """
+        Reads back the results tables recorded for a run.
+
+        :param run_id: Run to read
+        :return: Tuple (cost_centre_results, asset_results) of DataFrames laid out as returned by
+                 BudgetReport.build_results_tables()
+        """
+
+        results = []
+
+        for table_name in ["cost_centre_results", "asset_results"]:
+            results_df = pd.read_sql_query("SELECT * FROM {table} WHERE run_id = ?".format(table=table_name),
+                                           self.connection, params=(run_id,))
+            results.append(results_df.drop(columns="run_id"))
+
+        return tuple(results)
+
+
+def main():
+    """
+    Answers trend and comparison questions from the results warehouse.
+
+    :return: None
+    """
+
+    parser = argparse.ArgumentParser(description="Query historical cost model runs")
+    parser.add_argument("--file", default=results_warehouse_file_path, help="Path to the results warehouse")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    runs_parser = subparsers.add_parser("runs", help="List recent runs")
+    runs_parser.add_argument("--limit", type=int, default=20)
+
+    trend_parser = subparsers.add_parser("trend", help="Trend a cost centre metric over recent runs")
+    trend_parser.add_argument("cost_centre_name")
+    trend_parser.add_argument("metric", choices=COST_CENTRE_METRICS)
+    trend_parser.add_argument("--last", type=int, default=12)
+
+    compare_parser = subparsers.add_parser("compare", help="Compare a cost centre metric between two runs")
+    compare_parser.add_argument("run_id_a", type=int)
+    compare_parser.add_argument("run_id_b", type=int)
+    compare_parser.add_argument("metric", choices=COST_CENTRE_METRICS)
+
+    args = parser.parse_args()
+
+    warehouse = ResultsWarehouse(args.file)
+
+    if args.command == "runs":
+        print(warehouse.list_runs(args.limit).to_string(index=False))
+    elif args.command == "trend":
+        print(warehouse.cost_centre_trend(args.cost_centre_name, args.metric, args.last).to_string(index=False))
+    else:
+        print(warehouse.compare_runs(args.run_id_a, args.run_id_b, args.metric).to_string(index=False))
+
+    warehouse.close()
+
+
+if __name__ == "__main__":
+
+    main()
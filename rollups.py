@@ -0,0 +1,183 @@
+import argparse
+import pandas as pd
+from resultswarehouse import ResultsWarehouse, results_warehouse_file_path
+
+"""
+########################################################################################################################
+##################################### MODULE SCOPE FUNCTIONS BELOW #####################################################
+########################################################################################################################
+
+Rollups of a run's results by health authority, function, site and shop, computed as grouped sums over the per-asset
+and per-cost centre results tables returned by BudgetReport.build_results_tables(). main.py --rollups writes them as
+Excel tables after the "Summary" worksheet of budget_report_output.xlsx; this module's command line rolls up a run
+recorded in the results warehouse without rerunning the model:
+
+    $ python rollups.py 15
+    $ python rollups.py 15 --level "By Site"
+
+Assets are rolled up under the health authority and function of the cost centre that services them. OH components
+(non-labour, tech staff and regional staff OH) belong to cost centres, so they are only summed for rollups by health
+authority and function; every rollup has the OH cost allocated to assets, which is how OH reaches sites and shops.
+"""
+
+# Sheet name of each rollup and the columns of the results tables it groups by
+ROLLUP_LEVELS = {"By Health Authority": ["health_auth"],
+                 "By Function": ["function"],
+                 "By HA and Function": ["health_auth", "function"],
+                 "By Site": ["health_auth", "site_code"],
+                 "By Shop": ["health_auth", "shop_code"]}
+
+# Header of each column grouped by
+KEY_HEADERS = {"health_auth": "Health Authority",
+               "function": "Function",
+               "site_code": "Site",
+               "shop_code": "Shop"}
+
+# Columns of the cost centre results that assets are rolled up by
+COST_CENTRE_KEYS = ["health_auth", "function"]
+
+# (header, key, number format) of each rollup column, as taken by budgetreport.write_long_format_tables()
+CURRENCY = "$#,##0.00"
+DECIMAL_HUNDREDTH = "#,##0.00"
+ASSET_COLUMNS = [("Assets", "num_assets", None),
+                 ("Qty", "asset_qty", None),
+                 ("Annual Support Hours", "support_hours", DECIMAL_HUNDREDTH),
+                 ("OH Cost", "oh_cost", CURRENCY),
+                 ("Direct Cost", "direct_cost", CURRENCY),
+                 ("Service Contract Cost", "service_contract_cost", CURRENCY),
+                 ("Net Cost to Service", "total_cost_to_service", CURRENCY)]
+COST_CENTRE_COLUMNS = [("Cost Centres", "num_cost_centres", None),
+                       ("Total OH", "total_oh", CURRENCY),
+                       ("Non-labour OH", "non_labour_oh", CURRENCY),
+                       ("Tech Staff OH", "tech_staff_oh", CURRENCY),
+                       ("Regional Staff OH", "regional_staff_oh", CURRENCY)]
+
+# Columns of the results tables read by compute_rollups()
+ASSET_RESULT_COLUMNS = ["cost_centre_name", "health_auth", "function", "site_code", "shop_code", "qty",
+                        "avg_support_hours", "oh_cost_per_asset", "direct_cost_per_asset",
+                        "service_contract_cost_per_asset", "total_cost_to_service"]
+COST_CENTRE_RESULT_COLUMNS = ["cost_centre_name", "health_auth", "function", "non_labour_oh", "tech_staff_oh",
+                              "regional_staff_oh", "total_oh"]
+
+
+def compute_rollups(cost_centre_results, asset_results):
+    """
+    Sums support hours, OH and cost to service for every level in ROLLUP_LEVELS.
+
+    :param cost_centre_results: DataFrame laid out as returned by BudgetReport.build_results_tables()
+    :param asset_results: DataFrame laid out as returned by BudgetReport.build_results_tables()
+    :return: Dict with key: sheet name and value: DataFrame with one row per group, sorted by the columns grouped by
+    """
+
+    # A run without input lines has results tables without columns
+    cost_centre_results = cost_centre_results.reindex(columns=COST_CENTRE_RESULT_COLUMNS)
+    asset_results = asset_results.reindex(columns=ASSET_RESULT_COLUMNS)
+
+    qty = asset_results["qty"].to_numpy(dtype=float)
+    line_costs = pd.DataFrame({"support_hours": asset_results["avg_support_hours"].to_numpy(dtype=float) * qty,
+                               "oh_cost": asset_results["oh_cost_per_asset"].to_numpy(dtype=float) * qty,
+                               "direct_cost": asset_results["direct_cost_per_asset"].to_numpy(dtype=float) * qty,
+                               "service_contract_cost": asset_results["service_contract_cost_per_asset"]
+                               .to_numpy(dtype=float) * qty},
+                              index=asset_results.index)
+    asset_results = pd.concat([asset_results, line_costs], axis=1)
+
+    # An asset can be serviced by a cost centre of another function (e.g. renal assets by a clinical cost centre); it is
+    # rolled up under its cost centre's, so that each group's cost to service and OH come from the same cost centres
+    cost_centre_keys = cost_centre_results.set_index("cost_centre_name")
+    for key in COST_CENTRE_KEYS:
+        asset_results[key] = asset_results["cost_centre_name"].map(cost_centre_keys[key])
+
+    rollups = {}
+
+    for sheet_name, keys in ROLLUP_LEVELS.items():
+        rollup_df = asset_results.groupby(keys, dropna=False).agg(
+            num_assets=("qty", "size"),
+            asset_qty=("qty", "sum"),
+            support_hours=("support_hours", "sum"),
+            oh_cost=("oh_cost", "sum"),
+            direct_cost=("direct_cost", "sum"),
+            service_contract_cost=("service_contract_cost", "sum"),
+            total_cost_to_service=("total_cost_to_service", "sum"))
+
+        # OH components can only be summed over whole cost centres
+        if all(key in COST_CENTRE_KEYS for key in keys):
+            cost_centre_df = cost_centre_results.groupby(keys, dropna=False).agg(
+                num_cost_centres=("cost_centre_name", "size"),
+                total_oh=("total_oh", "sum"),
+                non_labour_oh=("non_labour_oh", "sum"),
+                tech_staff_oh=("tech_staff_oh", "sum"),
+                regional_staff_oh=("regional_staff_oh", "sum"))
+            rollup_df = rollup_df.join(cost_centre_df, how="outer").fillna(0)
+            rollup_df = rollup_df.astype({"num_assets": int, "num_cost_centres": int})
+
+        rollups[sheet_name] = rollup_df.sort_index().reset_index()
+
+    return rollups
+
+
+def combine_rollups(rollups_list):
+    """
+    Adds up rollups computed over separate cost centres, e.g. one cost centre at a time by a streaming run. Every
+    rollup column is a sum, so the result is that of compute_rollups() over all of them.
+
+    :param rollups_list: List of dicts returned by compute_rollups() or combine_rollups()
+    :return: Dict laid out as returned by compute_rollups()
+    """
+
+    combined = {}
+
+    for sheet_name, keys in ROLLUP_LEVELS.items():
+        rollup_df = pd.concat([rollups[sheet_name] for rollups in rollups_list], ignore_index=True)
+        combined[sheet_name] = rollup_df.groupby(keys, dropna=False).sum().sort_index().reset_index()
+
+    return combined
+
+
+def list_rollup_tables(rollups):
+    """
+    Lays out rollups for budgetreport.write_long_format_tables().
+
+    :param rollups: Dict returned by compute_rollups()
+    :return: List of (sheet name, columns, rows) tuples
+    """
+
+    tables = []
+
+    for sheet_name, rollup_df in rollups.items():
+        columns = [(KEY_HEADERS[key], key, None) for key in ROLLUP_LEVELS[sheet_name]]
+        columns.extend(column for column in COST_CENTRE_COLUMNS + ASSET_COLUMNS if column[1] in rollup_df.columns)
+        # Blank rather than NaN for assets without a site or shop
+        rows = rollup_df.astype(object).where(rollup_df.notna(), None).to_dict("records")
+        tables.append((sheet_name, columns, rows))
+
+    return tables
+
+
+def main():
+    """
+    Prints the rollups of a run recorded in the results warehouse.
+
+    :return: None
+    """
+
+    parser = argparse.ArgumentParser(description="Roll up a recorded run by health authority, function, site and shop")
+    parser.add_argument("run_id", type=int)
+    parser.add_argument("--level", choices=list(ROLLUP_LEVELS), help="Only print this rollup")
+    parser.add_argument("--file", default=results_warehouse_file_path, help="Path to the results warehouse")
+    args = parser.parse_args()
+
+    warehouse = ResultsWarehouse(args.file)
+    rollups = compute_rollups(*warehouse.read_run_results(args.run_id))
+    warehouse.close()
+
+    for sheet_name, rollup_df in rollups.items():
+        if args.level in (None, sheet_name):
+            print(sheet_name)
+            print(rollup_df.to_string(index=False))
+            print()
+
+
+if __name__ == "__main__":
+
+    main()
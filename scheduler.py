@@ -0,0 +1,378 @@
+import concurrent.futures
+import json
+import os
+import threading
+import time
+import pandas as pd
+from budgetreport import BudgetReport, read_asset_support_hours_reference
+from rollups import compute_rollups, list_rollup_tables
+from servicecontracts import read_service_contract_catalogue
+
+"""
+########################################################################################################################
+##################################### MODULE SCOPE FUNCTIONS BELOW #####################################################
+########################################################################################################################
+
+Model run expressed as a graph of tasks, each started on a thread pool as soon as the tasks it depends on are done:
+
+    read_assets                     reads the input and adds the tasks below for each of its cost centres
+    read_support_hours_reference    reads asset_support_hours_reference.xlsx
+    read_service_contracts          reads service_contract_catalogue.xlsx
+    open_output                     creates budget_report_output.xlsx
+    cost_centre:{name}              OH and rates; after read_assets
+    support_hours:{name}            the cost centre's assets' support hours; after read_support_hours_reference
+    service_contracts:{name}        the cost centre's assets' service contract costs; after cost_centre:{name} and
+                                    read_service_contracts
+    write:{name}                    the cost centre's worksheet; after cost_centre:{name}, support_hours:{name},
+                                    service_contracts:{name} and the previous cost centre's write:{name} (or
+                                    open_output)
+    close_output                    the "Summary" worksheet and any rollups; after every write:{name}
+
+Each cost centre's OH and rates, and its assets' support hours, are separate tasks, so a cost centre's worksheet is
+written as soon as both are done, while the next cost centres are still being computed. Worksheets are still written
+one after another in input order, so the output is the same as that of a serial run.
+
+The executed graph, with each task's start, end and thread, can be exported to CSV, or to JSON in the Chrome trace
+event format (viewable in chrome://tracing or https://ui.perfetto.dev), with the critical path marked:
+
+    $ python main.py --schedule --schedule-trace model_outputs/schedule_trace.json
+
+The tasks share the model's objects, so they run on threads; they overlap where they wait on file reads (e.g. each
+cost centre's financial report worksheets) or a preload started by referenceloader.py, and otherwise take turns.
+"""
+
+
+def build_model_graph(budget_report, cost_centre_names=None):
+    """
+    Lays out a model run as a task graph. The per-cost centre tasks are added by the read_assets task, once the input
+    lines have been read and each one's cost centre is known.
+
+    :param budget_report: BudgetReport object to compute and write
+    :param cost_centre_names: Set of the only cost centres to compute and write; None for all
+    :return: TaskGraph object
+    """
+
+    graph = TaskGraph()
+
+    def read_support_hours_reference():
+        # Support hours are looked up in the reference store instead, if there is one
+        if budget_report.reference_store is not None:
+            return None
+        return read_asset_support_hours_reference()
+
+    def read_assets():
+        assets = budget_report.create_asset_objects()
+        if cost_centre_names is not None:
+            assets = [asset for asset in assets if asset.cost_centre in cost_centre_names]
+
+        # Assets of each cost centre, in order of first appearance in the input, as in create_cost_centre_objects()
+        cost_centre_assets = {}
+        for asset in assets:
+            cost_centre_assets.setdefault(asset.cost_centre, []).append(asset)
+
+        previous_write = "open_output"
+
+        for name, assets_of_cost_centre in cost_centre_assets.items():
+            graph.add_task("cost_centre:" + name, create_cost_centre(assets_of_cost_centre), ["read_assets"])
+            graph.add_task("support_hours:" + name, compute_support_hours(assets_of_cost_centre),
+                           ["read_assets", "read_support_hours_reference"])
+            # Only imaging cost centres' assets get a service contract cost, which needs the cost centre's function
+            graph.add_task("service_contracts:" + name, compute_service_contracts(assets_of_cost_centre),
+                           ["cost_centre:" + name, "read_service_contracts"])
+            graph.add_task("write:" + name, write_cost_centre(name),
+                           ["cost_centre:" + name, "support_hours:" + name, "service_contracts:" + name,
+                            previous_write])
+            previous_write = "write:" + name
+
+        graph.add_task("close_output", close_output(list(cost_centre_assets)),
+                       ["write:" + name for name in cost_centre_assets] or ["open_output"])
+
+        return len(assets)
+
+    def create_cost_centre(assets):
+        return lambda: budget_report.create_cost_centre_objects(assets, budget_report)
+
+    def compute_support_hours(assets):
+        return lambda: budget_report.compute_asset_support_hours(graph.result("read_support_hours_reference"), assets)
+
+    def compute_service_contracts(assets):
+        return lambda: budget_report.compute_service_contract_costs(graph.result("read_service_contracts"), assets)
+
+    def write_cost_centre(name):
+        def write():
+            workbook, formats, summary_sheet = graph.result("open_output")
+            if budget_report.summary_only:
+                budget_report.summary_totals.append(
+                    (name, budget_report.compute_cost_centre_total(budget_report.cost_centres.get(name))))
+            else:
+                budget_report.write_cost_centre_output(key=name, workbook=workbook, **formats)
+        return write
+
+    def close_output(names):
+        def close():
+            # Cost centres were added as their tasks finished; put them back in input order
+            budget_report.cost_centres = {name: budget_report.cost_centres[name] for name in names}
+
+            rollup_tables = None
+            if budget_report.rollups:
+                rollup_tables = list_rollup_tables(compute_rollups(*budget_report.build_results_tables()))
+            budget_report.close_output_workbook(*graph.result("open_output"), rollup_tables)
+        return close
+
+    graph.add_task("read_support_hours_reference", read_support_hours_reference)
+    graph.add_task("read_service_contracts", read_service_contract_catalogue)
+    graph.add_task("open_output", budget_report.open_output_workbook)
+    graph.add_task("read_assets", read_assets)
+
+    return graph
+
+
+def run_scheduled(cost_centre_names=None, max_workers=None, trace_file_path=None, **output_options):
+    """
+    Computes and writes budget_report_output.xlsx by running the graph laid out by build_model_graph().
+
+    :param cost_centre_names: Set of the only cost centres to compute and write; None for all
+    :param max_workers: Number of threads; defaults to the executor's default
+    :param trace_file_path: Optional path of a .csv or .json file to export the executed graph to (see
+                            TaskGraph.export_trace())
+    :param output_options: BudgetReport output attributes to set, e.g. expand_lines=True, values_only=True
+    :return: BudgetReport object, with every cost centre computed
+    """
+
+    budget_report = BudgetReport()
+    for option, value in output_options.items():
+        setattr(budget_report, option, value)
+
+    graph = build_model_graph(budget_report, cost_centre_names)
+    graph.run(max_workers)
+
+    if trace_file_path is not None:
+        graph.export_trace(trace_file_path)
+
+    return budget_report
+
+
+"""
+########################################################################################################################
+####################################### TASK CLASS BELOW ###############################################################
+########################################################################################################################
+"""
+
+
+class Task:
+    """
+    A step of a TaskGraph, with the timings of its execution.
+    """
+
+    def __init__(self, name, function, dependencies):
+        """
+        :param name: Unique name of the task
+        :param function: Callable taking no arguments; its return value is kept as the task's result
+        :param dependencies: Names of the tasks that have to finish before this one starts
+        """
+
+        self.name = name
+        self.function = function
+        self.dependencies = list(dependencies)
+        # Number of dependencies not yet finished
+        self.num_waiting = 0
+        # Names of the tasks that depend on this one
+        self.dependents = []
+        self.result = None
+        self.done = False
+        # Seconds from the start of TaskGraph.run() to the start and end of the task
+        self.start = None
+        self.end = None
+        # Name of the thread the task ran on
+        self.thread_name = None
+
+
+"""
+########################################################################################################################
+####################################### TASKGRAPH CLASS BELOW ##########################################################
+########################################################################################################################
+"""
+
+
+class TaskGraph:
+    """
+    Tasks and their dependencies, run on a thread pool in dependency order. A running task may add further tasks, as
+    long as the tasks they depend on have already been added.
+    """
+
+    def __init__(self):
+        """
+        Initialize instance variables.
+        """
+
+        # Dict with key: task name and value: Task object, in the order they were added
+        self.tasks = {}
+        # Tasks whose dependencies have all finished, not yet submitted to the thread pool
+        self.ready = []
+        # Guards tasks and ready against tasks added while the graph runs
+        self.lock = threading.Lock()
+        # perf_counter() at the start of run()
+        self.run_start = None
+
+    def add_task(self, name, function, dependencies=()):
+        """
+        Adds a task to the graph.
+
+        :param name: Unique name of the task
+        :param function: Callable taking no arguments
+        :param dependencies: Names of tasks already in the graph, including the running task adding this one, that have
+                             to finish before this one starts
+        :return: None
+        """
+
+        with self.lock:
+            if name in self.tasks:
+                raise ValueError("Task {name} is already in the graph".format(name=name))
+
+            missing = [dependency for dependency in dependencies if dependency not in self.tasks]
+            if missing:
+                raise ValueError("Task {name} depends on tasks not in the graph: {missing}".format(
+                    name=name, missing=", ".join(missing)))
+
+            task = Task(name, function, dependencies)
+            for dependency in task.dependencies:
+                if not self.tasks[dependency].done:
+                    task.num_waiting += 1
+                    self.tasks[dependency].dependents.append(name)
+
+            self.tasks[name] = task
+            if task.num_waiting == 0:
+                self.ready.append(task)
+
+    def result(self, name):
+        """
+        :param name: Name of a finished task
+        :return: The value returned by the task's function
+        """
+
+        return self.tasks[name].result
+
+    def run_task(self, task):
+        """
+        Runs a task's function and records its timings.
+
+        :param task: Task object
+        :return: None
+        """
+
+        task.thread_name = threading.current_thread().name
+        task.start = time.perf_counter() - self.run_start
+        task.result = task.function()
+        task.end = time.perf_counter() - self.run_start
+
+    def run(self, max_workers=None):
+        """
+        Runs every task, each as soon as the tasks it depends on have finished. If a task raises, no further tasks are
+        started and the exception is raised once the running ones have finished.
+
+        :param max_workers: Number of threads; defaults to the executor's default
+        :return: None
+        """
+
+        self.run_start = time.perf_counter()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix="task") as executor:
+            running = {}
+
+            while True:
+                with self.lock:
+                    ready, self.ready = self.ready, []
+                for task in ready:
+                    running[executor.submit(self.run_task, task)] = task
+
+                if not running:
+                    break
+
+                finished, not_finished = concurrent.futures.wait(running,
+                                                                 return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    task = running.pop(future)
+                    # Raises the task's exception, if any
+                    future.result()
+
+                    with self.lock:
+                        task.done = True
+                        for dependent in task.dependents:
+                            self.tasks[dependent].num_waiting -= 1
+                            if self.tasks[dependent].num_waiting == 0:
+                                self.ready.append(self.tasks[dependent])
+
+    def find_critical_path(self):
+        """
+        Follows the chain of tasks that determined when the last task finished: from the last task to finish, back
+        through whichever of each task's dependencies finished last.
+
+        :return: List of task names, first task first
+        """
+
+        finished = [task for task in self.tasks.values() if task.end is not None]
+        if not finished:
+            return []
+
+        task = max(finished, key=lambda task: task.end)
+        critical_path = [task.name]
+
+        while task.dependencies:
+            task = max((self.tasks[dependency] for dependency in task.dependencies), key=lambda task: task.end)
+            critical_path.append(task.name)
+
+        return critical_path[::-1]
+
+    def summarize(self):
+        """
+        :return: DataFrame with columns "task", "dependencies", "thread", "start", "end", "duration", "critical", one
+                 row per task in order of start; times are in seconds from the start of run()
+        """
+
+        critical_path = set(self.find_critical_path())
+
+        summary_df = pd.DataFrame([{"task": task.name,
+                                    "dependencies": ", ".join(task.dependencies),
+                                    "thread": task.thread_name,
+                                    "start": task.start,
+                                    "end": task.end,
+                                    "duration": None if task.end is None else task.end - task.start,
+                                    "critical": task.name in critical_path}
+                                   for task in self.tasks.values()],
+                                  columns=["task", "dependencies", "thread", "start", "end", "duration", "critical"])
+
+        return summary_df.sort_values("start", kind="stable").reset_index(drop=True)
+
+    def export_trace(self, file_path):
+        """
+        Writes the executed graph to a CSV file laid out as returned by summarize(), or, if file_path ends in .json, to
+        a Chrome trace event file with a track per thread and the critical path in its own category.
+
+        :param file_path: Path of the file to write
+        :return: None
+        """
+
+        summary_df = self.summarize()
+
+        if os.path.splitext(file_path)[1].lower() != ".json":
+            summary_df.to_csv(file_path, index=False)
+            return
+
+        summary_df = summary_df.dropna(subset=["end"])
+        thread_ids = {thread_name: thread_id for thread_id, thread_name in enumerate(summary_df["thread"].unique())}
+
+        # A metadata event naming each thread's track, then a complete ("X") event per task, in microseconds
+        events = [{"name": "thread_name", "ph": "M", "pid": 0, "tid": thread_id, "args": {"name": thread_name}}
+                  for thread_name, thread_id in thread_ids.items()]
+        events.extend({"name": row.task,
+                       "cat": "critical" if row.critical else "task",
+                       "ph": "X",
+                       "pid": 0,
+                       "tid": thread_ids[row.thread],
+                       "ts": row.start * 1e6,
+                       "dur": row.duration * 1e6,
+                       "args": {"dependencies": row.dependencies}}
+                      for row in summary_df.itertuples())
+
+        with open(file_path, "w") as trace_file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace_file, indent=1)
@@ -0,0 +1,247 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from modelinputs import read_table, resolve_table_source
+
+"""
+########################################################################################################################
+##################################### MODULE SCOPE FUNCTIONS BELOW #####################################################
+########################################################################################################################
+
+Annual service contract costs of imaging assets, looked up in a service contract catalogue with one line per contract:
+
+    model_number, vendor, health_auth, site_code, annual_contract_cost, coverage_start, coverage_end
+
+annual_contract_cost is per asset. A line applies at the most specific level its filled-in columns allow (see
+MATCH_LEVELS): a model number at a site, in a health authority or anywhere, or, with the model number left blank, every
+model of a vendor at a site, in a health authority or anywhere. A vendor's models are taken from the catalogue lines
+that give both. Only lines whose coverage dates (either may be blank) include the contract date are used, and where
+several lines apply to the same key, the one whose coverage started last.
+
+Every asset is resolved at once, with one keyed join of the asset table against each level's lines, most specific
+level first, so the catalogue can have any number of lines without being scanned per asset. One asset at a time, as
+pricematrix.PriceMatrix.quote() needs, is resolved with a dict lookup per level instead (see
+build_service_contract_lookup()). Without a catalogue, every contract cost is 0. To see which level each imaging asset
+of the input is resolved at:
+
+    $ python servicecontracts.py --date 2025-04-01
+"""
+
+# Path to the service contract catalogue; may be replaced by a CSV, Parquet or Arrow IPC export (see modelinputs.py)
+service_contract_catalogue_file_path = "model_inputs/contract_reports/service_contract_catalogue.xlsx"
+
+# Columns of the catalogue, and those matched on, which are read as text so that model numbers keep leading zeros
+CATALOGUE_COLUMNS = ["model_number", "vendor", "health_auth", "site_code", "annual_contract_cost", "coverage_start",
+                     "coverage_end"]
+KEY_COLUMNS = ["model_number", "vendor", "health_auth", "site_code"]
+
+# (match name, columns matched on, columns left blank) of each level a catalogue line can apply at, most specific first
+MATCH_LEVELS = [("model number and site", ["model_number", "health_auth", "site_code"], []),
+                ("model number and health authority", ["model_number", "health_auth"], ["site_code"]),
+                ("model number", ["model_number"], ["health_auth", "site_code"]),
+                ("vendor and site", ["vendor", "health_auth", "site_code"], ["model_number"]),
+                ("vendor and health authority", ["vendor", "health_auth"], ["model_number", "site_code"]),
+                ("vendor", ["vendor"], ["model_number", "health_auth", "site_code"])]
+
+
+def normalize_keys(series):
+    """
+    Puts model numbers, vendors, health authorities or site codes in the form they are matched in: trimmed upper case
+    text, with blanks as "".
+
+    :param series: Series of keys
+    :return: Series of str
+    """
+
+    return series.astype(object).where(series.notna(), "").astype(str).str.strip().str.upper()
+
+
+def normalize_key(value):
+    """
+    Same as normalize_keys() for a single key.
+
+    :param value: Model number, vendor, health authority or site code; None or NaN if blank
+    :return: str
+    """
+
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return ""
+
+    return str(value).strip().upper()
+
+
+def read_service_contract_catalogue(file_path=service_contract_catalogue_file_path):
+    """
+    Reads the service contract catalogue.
+
+    :param file_path: Path to the catalogue
+    :return: DataFrame with columns CATALOGUE_COLUMNS; empty if there is no catalogue
+    """
+
+    if not os.path.exists(resolve_table_source(file_path)):
+        return pd.DataFrame(columns=CATALOGUE_COLUMNS)
+
+    return read_table(file_path, usecols=CATALOGUE_COLUMNS, dtype={column: str for column in KEY_COLUMNS})
+
+
+def index_service_contracts(catalogue_df, contract_date=None):
+    """
+    Splits the catalogue lines in force on a date into one table per match level, with one line per key.
+
+    :param catalogue_df: DataFrame returned by read_service_contract_catalogue()
+    :param contract_date: Date the contracts must cover; defaults to today
+    :return: Tuple (level_tables, model_vendors): a list of (match name, columns matched on, DataFrame of those columns
+             and "annual_contract_cost") tuples in the order of MATCH_LEVELS, and a Series of the vendor of each model
+             number
+    """
+
+    contract_date = pd.Timestamp.today().normalize() if contract_date is None else pd.Timestamp(contract_date)
+
+    lines_df = pd.DataFrame({column: normalize_keys(catalogue_df[column]) for column in KEY_COLUMNS})
+    lines_df["annual_contract_cost"] = pd.to_numeric(catalogue_df["annual_contract_cost"], errors="coerce")
+    lines_df["coverage_start"] = pd.to_datetime(catalogue_df["coverage_start"], errors="coerce")
+    coverage_end = pd.to_datetime(catalogue_df["coverage_end"], errors="coerce")
+
+    # Lines in force on the contract date, latest coverage start last
+    in_force = ((lines_df["coverage_start"].isna() | (lines_df["coverage_start"] <= contract_date)) &
+                (coverage_end.isna() | (coverage_end >= contract_date)) &
+                lines_df["annual_contract_cost"].notna())
+    lines_df = lines_df[in_force].sort_values("coverage_start", kind="stable", na_position="first")
+
+    is_blank = lines_df[KEY_COLUMNS] == ""
+    level_tables = []
+
+    for match_name, key_columns, blank_columns in MATCH_LEVELS:
+        at_level = ~is_blank[key_columns].any(axis=1) & is_blank[blank_columns].all(axis=1)
+        level_df = lines_df.loc[at_level, key_columns + ["annual_contract_cost"]]
+        level_tables.append((match_name, key_columns, level_df.drop_duplicates(key_columns, keep="last")))
+
+    # Vendors of the model numbers named in the catalogue, whether or not their lines are in force
+    named_df = pd.DataFrame({"model_number": normalize_keys(catalogue_df["model_number"]),
+                             "vendor": normalize_keys(catalogue_df["vendor"])})
+    named_df = named_df[(named_df["model_number"] != "") & (named_df["vendor"] != "")]
+    model_vendors = named_df.drop_duplicates("model_number").set_index("model_number")["vendor"]
+
+    return level_tables, model_vendors
+
+
+def resolve_service_contract_costs(assets_df, catalogue_df, contract_date=None):
+    """
+    Looks up the annual service contract cost of each asset, at the most specific level of MATCH_LEVELS a catalogue
+    line applies at.
+
+    :param assets_df: DataFrame with columns "model_number", "health_auth", "site_code", one row per asset
+    :param catalogue_df: DataFrame returned by read_service_contract_catalogue()
+    :param contract_date: Date the contracts must cover; defaults to today
+    :return: Tuple (costs, matches) of arrays in the order of assets_df's rows: each asset's annual contract cost (0
+             without a contract), and the name of the level it was found at (None without a contract)
+    """
+
+    level_tables, model_vendors = index_service_contracts(catalogue_df, contract_date)
+
+    keys_df = pd.DataFrame({column: normalize_keys(assets_df[column]).to_numpy()
+                            for column in ["model_number", "health_auth", "site_code"]})
+    keys_df["vendor"] = keys_df["model_number"].map(model_vendors).fillna("")
+
+    costs = np.zeros(len(keys_df))
+    matches = np.full(len(keys_df), None, dtype=object)
+    unresolved = np.ones(len(keys_df), dtype=bool)
+
+    for match_name, key_columns, level_df in level_tables:
+        if level_df.empty or not unresolved.any():
+            continue
+
+        # Left join on unique keys, so the result has one row per asset, in order
+        level_costs = keys_df[key_columns].merge(level_df, on=key_columns, how="left")["annual_contract_cost"]
+        found = unresolved & level_costs.notna().to_numpy()
+
+        costs[found] = level_costs.to_numpy()[found]
+        matches[found] = match_name
+        unresolved &= ~found
+
+    return costs, matches
+
+
+def build_service_contract_lookup(catalogue_df, contract_date=None):
+    """
+    Indexes the catalogue lines in force on a date by their keys, so that one asset at a time can be resolved in
+    constant time with lookup_service_contract_cost().
+
+    :param catalogue_df: DataFrame returned by read_service_contract_catalogue()
+    :param contract_date: Date the contracts must cover; defaults to today
+    :return: Tuple (level_lookups, model_vendors): a list of (match name, columns matched on, dict with key: tuple of
+             those columns' values and value: annual contract cost) tuples in the order of MATCH_LEVELS, and a dict of
+             the vendor of each model number
+    """
+
+    level_tables, model_vendors = index_service_contracts(catalogue_df, contract_date)
+
+    level_lookups = [(match_name,
+                      key_columns,
+                      dict(zip(level_df[key_columns].itertuples(index=False, name=None),
+                               level_df["annual_contract_cost"].tolist())))
+                     for match_name, key_columns, level_df in level_tables]
+
+    return level_lookups, model_vendors.to_dict()
+
+
+def lookup_service_contract_cost(service_contract_lookup, model_num, health_auth, site_code):
+    """
+    Looks up the annual service contract cost of one asset, at the same level resolve_service_contract_costs() would
+    find it at.
+
+    :param service_contract_lookup: Tuple returned by build_service_contract_lookup()
+    :param model_num: Model number
+    :param health_auth: Health authority; None matches only contracts that don't name one
+    :param site_code: Three-letter site code
+    :return: Tuple (cost, match): the annual contract cost (0 without a contract), and the name of the level it was
+             found at (None without a contract)
+    """
+
+    level_lookups, model_vendors = service_contract_lookup
+
+    keys = {"model_number": normalize_key(model_num),
+            "health_auth": normalize_key(health_auth),
+            "site_code": normalize_key(site_code)}
+    keys["vendor"] = model_vendors.get(keys["model_number"], "")
+
+    for match_name, key_columns, costs in level_lookups:
+        cost = costs.get(tuple(keys[column] for column in key_columns))
+        if cost is not None:
+            return cost, match_name
+
+    return 0.0, None
+
+
+def main():
+    """
+    Prints the service contract cost and match level of each imaging asset of the model input.
+
+    :return: None
+    """
+
+    # Imported here so that budgetreport.py can import this module
+    from budgetreport import BudgetReport
+
+    parser = argparse.ArgumentParser(description="Resolve imaging assets' service contract costs")
+    parser.add_argument("--date", help="Date the contracts must cover (default: today)")
+    parser.add_argument("--file", default=service_contract_catalogue_file_path, help="Path to the catalogue")
+    args = parser.parse_args()
+
+    # Assets are costed by the function of the cost centre that services them, as in
+    # BudgetReport.compute_service_contract_costs()
+    budget_report = BudgetReport()
+    imaging_cost_centres = budget_report.select_cost_centres(function="imaging")
+    assets = [asset for asset in budget_report.create_asset_objects() if asset.cost_centre in imaging_cost_centres]
+    assets_df = pd.DataFrame({"model_number": [asset.model_num for asset in assets],
+                              "health_auth": [asset.health_auth for asset in assets],
+                              "site_code": [asset.site_code for asset in assets]})
+
+    costs, matches = resolve_service_contract_costs(assets_df, read_service_contract_catalogue(args.file), args.date)
+    print(assets_df.assign(annual_contract_cost=costs, match=matches).to_string(index=False))
+
+
+if __name__ == "__main__":
+
+    main()
@@ -1,5 +1,5 @@
-import pandas as pd
 from abc import ABC, abstractmethod
+from modelinputs import read_table
 
 """
 ########################################################################################################################
@@ -20,11 +20,11 @@ def get_benefits_multiplier():
     regional_staff_salaries_file_path = "model_inputs/labour_reports/staff_salaries.xlsx"
 
     # Read benefits multiplier into dataframe
-    benefits_multiplier_df = pd.read_excel(regional_staff_salaries_file_path,
-                                           sheet_name="Benefits Multiplier",
-                                           header=None,
-                                           usecols="A:B",
-                                           nrows=1)
+    benefits_multiplier_df = read_table(regional_staff_salaries_file_path,
+                                        sheet_name="Benefits Multiplier",
+                                        header=None,
+                                        usecols="A:B",
+                                        nrows=1)
 
     return benefits_multiplier_df.at[0, 1]
 
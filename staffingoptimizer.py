@@ -0,0 +1,298 @@
+import argparse
+import math
+import multiprocessing
+import os
+import numpy as np
+import pandas as pd
+from vectorengine import TECH_LEVELS, compute_cost_centre_rates
+
+"""
+########################################################################################################################
+##################################### MODULE SCOPE FUNCTIONS BELOW #####################################################
+########################################################################################################################
+
+Finds the tech level mix that minimizes the cost of servicing each cost centre's workload:
+
+    minimize    productive labour hours * (POHR + weighted average tech $/hr)
+    subject to  productive labour hours >= workload hours
+                min headcount <= headcount <= max headcount, for each level
+                total tech compensation <= budget cap
+
+Every productive hour the mix provides is charged at the cost centre's rates, because idle capacity is still paid for;
+charging only the workload hours would make every added tech look free, since more techs spread the fixed OH thinner.
+POHR and the weighted average wage are ratios of the headcounts, so the program isn't linear. With only four levels
+every headcount combination on the step grid can be evaluated directly, which gives the exact integer optimum with NumPy
+alone. The current mix is evaluated too, even when it is off the grid, so the optimum is never worse than it. Cost
+centres are independent and are solved in parallel worker processes:
+
+    $ python staffingoptimizer.py --step 0.5 --budget-cap 2500000
+"""
+
+# Headcount increment searched by default, in FTEs
+DEFAULT_HEADCOUNT_STEP = 1.0
+
+# Largest number of headcount combinations searched for one cost centre
+MAX_COMBINATIONS = 50000000
+
+# Shortfall in productive hours still accepted as covering the workload, since the workload and the hours of a mix are
+# the same quantity summed in a different order and can differ in the last bit
+WORKLOAD_TOLERANCE_HOURS = 1e-6
+
+
+def build_staffing_problems(arrays, workload_hours, oh_tech_time_percentage, productivity_rate, min_headcount=None,
+                            max_headcount=None, budget_cap=None, headcount_step=DEFAULT_HEADCOUNT_STEP):
+    """
+    Reduces each cost centre to the handful of numbers its staffing problem depends on, so that problems can be
+    pickled cheaply to worker processes.
+
+    :param arrays: Dict of reference arrays (see referencearrays.build_reference_arrays())
+    :param workload_hours: 1-D array of annual hours of device work each cost centre must cover
+    :param oh_tech_time_percentage: % of tech time spent on non-device related work
+    :param productivity_rate: % of annual labour hours that techs are productive
+    :param min_headcount: Minimum FTEs at each level in TECH_LEVELS, as a (4,) or (number of cost centres, 4) array;
+                          defaults to 0
+    :param max_headcount: Maximum FTEs at each level, shaped like min_headcount; defaults to enough FTEs of any single
+                          level to cover the workload alone
+    :param budget_cap: Maximum total tech compensation per cost centre, as a scalar or 1-D array; defaults to no cap
+    :param headcount_step: Headcount increment searched, in FTEs
+    :return: List of dicts, one per cost centre
+    """
+
+    num_cost_centres = len(arrays["cost_centre_names"])
+
+    # Productive hours and total compensation of one FTE at each level
+    level_hours = (productivity_rate * arrays["hours_worked_per_day"] *
+                   (arrays["semi_prod_days_per_year"] - arrays["level_vac_days"]))
+    level_compensation = arrays["benefits_multiplier"] * arrays["level_wage"] * arrays["hours_paid_per_year"]
+
+    if min_headcount is None:
+        min_headcount = np.zeros(len(TECH_LEVELS))
+    if max_headcount is None:
+        max_headcount = (np.ceil(np.asarray(workload_hours)[:, np.newaxis] / level_hours.min() / headcount_step) *
+                         headcount_step)
+    if budget_cap is None:
+        budget_cap = np.inf
+
+    min_headcount = np.broadcast_to(np.asarray(min_headcount, dtype=np.float64), (num_cost_centres, len(TECH_LEVELS)))
+    max_headcount = np.broadcast_to(np.asarray(max_headcount, dtype=np.float64), (num_cost_centres, len(TECH_LEVELS)))
+    budget_cap = np.broadcast_to(np.asarray(budget_cap, dtype=np.float64), (num_cost_centres,))
+
+    problems = []
+
+    for index, name in enumerate(arrays["cost_centre_names"]):
+        problems.append({"cost_centre_name": name,
+                         "workload_hours": float(workload_hours[index]),
+                         "fixed_oh": float(arrays["non_labour_oh"][index] +
+                                           arrays["benefits_multiplier"] * arrays["regional_salary_share"][index]),
+                         "level_oh": oh_tech_time_percentage * level_compensation,
+                         "level_compensation": level_compensation,
+                         "level_hours": level_hours,
+                         "level_wage": arrays["level_wage"],
+                         "current_level_qty": arrays["level_qty"][index],
+                         "min_headcount": min_headcount[index],
+                         "max_headcount": np.maximum(max_headcount[index], min_headcount[index]),
+                         "budget_cap": float(budget_cap[index]),
+                         "headcount_step": headcount_step})
+
+    return problems
+
+
+def evaluate_staffing_mixes(problem, level_qty):
+    """
+    Computes the annual cost of each headcount combination of a cost centre's staffing problem.
+
+    :param problem: Dict from build_staffing_problems()
+    :param level_qty: (number of combinations, 4) array of FTEs per level, ordered as TECH_LEVELS, within the problem's
+                      min and max headcount
+    :return: 1-D array of annual costs; infinite for combinations that don't cover the workload or exceed the budget cap
+    """
+
+    productive_hours = level_qty @ problem["level_hours"]
+    total_num_staff = level_qty.sum(axis=1)
+
+    feasible = ((productive_hours >= problem["workload_hours"] - WORKLOAD_TOLERANCE_HOURS) &
+                (productive_hours > 0) &
+                (level_qty @ problem["level_compensation"] <= problem["budget_cap"]))
+
+    if not feasible.any():
+        return np.full(len(level_qty), np.inf)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pohr = (problem["fixed_oh"] + level_qty @ problem["level_oh"]) / productive_hours
+        weighted_avg_tech_hourly_wage = (level_qty @ problem["level_wage"]) / total_num_staff
+
+    return np.where(feasible, productive_hours * (pohr + weighted_avg_tech_hourly_wage), np.inf)
+
+
+def solve_staffing_problem(problem):
+    """
+    Evaluates the current mix and every headcount combination on the step grid for one cost centre and returns the
+    cheapest feasible one. Ties go to the current mix, then to the first combination found, so results are reproducible.
+
+    :param problem: Dict from build_staffing_problems()
+    :return: Dict with keys "cost_centre_name", "feasible", "level_qty" (array ordered as TECH_LEVELS, NaN if
+             infeasible), "annual_cost"
+    """
+
+    step = problem["headcount_step"]
+    level_values = [np.arange(low, high + step / 2, step)
+                    for low, high in zip(problem["min_headcount"], problem["max_headcount"])]
+
+    if math.prod(len(values) for values in level_values) > MAX_COMBINATIONS:
+        raise ValueError("Staffing problem for {name} has too many headcount combinations; increase the step or "
+                         "tighten max headcount".format(name=problem["cost_centre_name"]))
+
+    # Every combination of the other levels, evaluated together for each level 8 headcount in turn
+    other_levels = np.stack([grid.ravel() for grid in np.meshgrid(*level_values[1:], indexing="ij")], axis=1)
+
+    best_cost = np.inf
+    best_level_qty = np.full(len(TECH_LEVELS), np.nan)
+
+    # The current mix is the starting point when it is within the headcount bounds, so that a grid combination has to be
+    # strictly cheaper to replace it
+    current_level_qty = np.asarray(problem["current_level_qty"], dtype=np.float64)
+    if (np.all(current_level_qty >= problem["min_headcount"]) and
+            np.all(current_level_qty <= problem["max_headcount"])):
+        current_cost = evaluate_staffing_mixes(problem, current_level_qty[np.newaxis, :])[0]
+        if np.isfinite(current_cost):
+            best_cost = current_cost
+            best_level_qty = current_level_qty
+
+    for level8_qty in level_values[0]:
+        level_qty = np.column_stack([np.full(len(other_levels), level8_qty), other_levels])
+
+        cost = evaluate_staffing_mixes(problem, level_qty)
+        best = np.argmin(cost)
+
+        if cost[best] < best_cost:
+            best_cost = cost[best]
+            best_level_qty = level_qty[best]
+
+    return {"cost_centre_name": problem["cost_centre_name"],
+            "feasible": bool(np.isfinite(best_cost)),
+            "level_qty": best_level_qty,
+            "annual_cost": best_cost if np.isfinite(best_cost) else np.nan}
+
+
+def optimize_staffing(arrays, oh_tech_time_percentage, productivity_rate, additional_support_hours=None,
+                      min_headcount=None, max_headcount=None, budget_cap=None,
+                      headcount_step=DEFAULT_HEADCOUNT_STEP, processes=None):
+    """
+    Solves the staffing problem of every cost centre in parallel and compares the optimal mix against the current one.
+    The workload of a cost centre is the productive labour hours of its current techs plus any additional support hours.
+
+    :param arrays: Dict of reference arrays (see referencearrays.build_reference_arrays())
+    :param oh_tech_time_percentage: % of tech time spent on non-device related work
+    :param productivity_rate: % of annual labour hours that techs are productive
+    :param additional_support_hours: Optional 1-D array of new support hours per cost centre (see
+                                     vectorengine.compute_cost_centre_support_hours())
+    :param min_headcount: See build_staffing_problems()
+    :param max_headcount: See build_staffing_problems()
+    :param budget_cap: See build_staffing_problems()
+    :param headcount_step: Headcount increment searched, in FTEs
+    :param processes: Number of worker processes; defaults to the number of cores
+    :return: DataFrame with one row per cost centre: "cost_centre_name", "workload_hours", "feasible", current and
+             optimal headcount per level ("current_level8", "optimal_level8", ...), current and optimal "pohr",
+             "weighted_avg_tech_hourly_wage", "annual_cost" (all productive hours at the rates) and
+             "total_cost_to_service" (workload hours at the rates), plus "savings" in annual cost
+    """
+
+    current_rates = compute_cost_centre_rates(arrays, oh_tech_time_percentage, productivity_rate)
+    workload_hours = productivity_rate * current_rates["annual_labour_hours"]
+
+    if additional_support_hours is not None:
+        workload_hours = workload_hours + additional_support_hours
+
+    problems = build_staffing_problems(arrays, workload_hours, oh_tech_time_percentage, productivity_rate,
+                                       min_headcount, max_headcount, budget_cap, headcount_step)
+
+    with multiprocessing.Pool(processes) as pool:
+        solutions = pool.map(solve_staffing_problem, problems, chunksize=1)
+
+    optimal_level_qty = np.array([solution["level_qty"] for solution in solutions])
+    optimal_rates = compute_cost_centre_rates(dict(arrays, level_qty=np.nan_to_num(optimal_level_qty)),
+                                              oh_tech_time_percentage, productivity_rate)
+    feasible = np.array([solution["feasible"] for solution in solutions])
+
+    optimization_df = pd.DataFrame({"cost_centre_name": arrays["cost_centre_names"],
+                                    "workload_hours": workload_hours,
+                                    "feasible": feasible})
+
+    for position, level in enumerate(TECH_LEVELS):
+        optimization_df["current_level{level}".format(level=level)] = arrays["level_qty"][:, position]
+        optimization_df["optimal_level{level}".format(level=level)] = optimal_level_qty[:, position]
+
+    for rate in ["pohr", "weighted_avg_tech_hourly_wage"]:
+        optimization_df["current_" + rate] = current_rates[rate]
+        optimization_df["optimal_" + rate] = np.where(feasible, optimal_rates[rate], np.nan)
+
+    for prefix, rates in [("current_", current_rates), ("optimal_", optimal_rates)]:
+        hourly_cost = optimization_df[prefix + "pohr"] + optimization_df[prefix + "weighted_avg_tech_hourly_wage"]
+        optimization_df[prefix + "annual_cost"] = productivity_rate * rates["annual_labour_hours"] * hourly_cost
+        optimization_df[prefix + "total_cost_to_service"] = workload_hours * hourly_cost
+
+    optimization_df["savings"] = optimization_df["current_annual_cost"] - optimization_df["optimal_annual_cost"]
+
+    return optimization_df
+
+
+def main():
+    """
+    Builds the reference arrays from model_inputs/ and finds the cheapest level mix for every cost centre. Output is
+    written to model_outputs/staffing_optimization.csv.
+
+    :return: None
+    """
+
+    parser = argparse.ArgumentParser(description="Find the tech level mix that minimizes the cost of each workload")
+    parser.add_argument("--step", type=float, default=DEFAULT_HEADCOUNT_STEP, help="Headcount increment in FTEs")
+    parser.add_argument("--min-headcount", type=float, nargs=4, metavar=("L8", "L9", "L10", "L12"), default=None)
+    parser.add_argument("--max-headcount", type=float, nargs=4, metavar=("L8", "L9", "L10", "L12"), default=None)
+    parser.add_argument("--budget-cap", type=float, default=None,
+                        help="Maximum total tech compensation per cost centre")
+    parser.add_argument("--new-assets", action="store_true",
+                        help="Add the support hours of the assets in budget_report_input.xlsx to each workload")
+    parser.add_argument("--processes", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--output", default=os.path.join("model_outputs", "staffing_optimization.csv"))
+    args = parser.parse_args()
+
+    # Imported here because importing these modules reads every reference workbook, which must only happen in the
+    # parent process
+    from budgetreport import BudgetReport
+    from costcentre import CostCentre
+    from referencearrays import build_reference_arrays
+    from vectorengine import compute_cost_centre_support_hours
+
+    print("Importing data...")
+
+    additional_support_hours = None
+
+    if args.new_assets:
+        budget_report = BudgetReport()
+        assets = budget_report.create_asset_objects()
+        budget_report.create_cost_centre_objects(assets, budget_report)
+        budget_report.compute_asset_support_hours()
+        arrays = build_reference_arrays(budget_report=budget_report)
+        additional_support_hours = compute_cost_centre_support_hours(arrays)
+    else:
+        arrays = build_reference_arrays()
+
+    print("Optimizing staffing...")
+
+    optimization_df = optimize_staffing(arrays,
+                                        CostCentre.OH_TECH_TIME_PERCENTAGE,
+                                        CostCentre.PRODUCTIVITY_RATE,
+                                        additional_support_hours=additional_support_hours,
+                                        min_headcount=args.min_headcount,
+                                        max_headcount=args.max_headcount,
+                                        budget_cap=args.budget_cap,
+                                        headcount_step=args.step,
+                                        processes=args.processes)
+    optimization_df.to_csv(args.output, index=False)
+
+    print("Staffing optimization written to {path}".format(path=args.output))
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,175 @@
+import contextlib
+import os
+import pickle
+import tempfile
+import pandas as pd
+from budgetreport import BudgetReport, read_asset_support_hours_reference
+from modelinputs import read_table_chunks
+from rollups import combine_rollups, compute_rollups, list_rollup_tables
+from servicecontracts import read_service_contract_catalogue
+
+"""
+########################################################################################################################
+##################################### MODULE SCOPE FUNCTIONS BELOW #####################################################
+########################################################################################################################
+
+Streaming model run, for inputs too large to hold every Asset and CostCentre in memory at once:
+
+    1. The "User Input" table is read in chunks of rows (see modelinputs.read_table_chunks())
+    2. Each line's cost centre is resolved and the line is appended to a spill file for its cost centre on disk
+    3. Each cost centre in turn is read back, computed, written to budget_report_output.xlsx and released
+
+Peak memory is bounded by the largest cost centre rather than the whole input. budget_report_output.xlsx is written in
+xlsxwriter's constant memory mode, which flushes each row to disk as soon as the next one is started. Likewise, each
+cost centre's results are appended to the results warehouse, and added to the rollups, as soon as it is computed:
+
+    $ python main.py --stream --chunk-size 50000
+"""
+
+# Default number of input rows read at a time
+DEFAULT_CHUNK_SIZE = 10000
+
+
+def partition_by_cost_centre(chunks, budget_report, folder_path, cost_centre_names=None):
+    """
+    Resolves each input line's cost centre and appends the line to a spill file for that cost centre. Only one chunk is
+    held in memory at a time.
+
+    :param chunks: Iterable of DataFrames returned by modelinputs.read_table_chunks()
+    :param budget_report: BudgetReport object, used to resolve cost centres
+    :param folder_path: Folder to write spill files to
+    :param cost_centre_names: Set of the only cost centres whose lines to keep; None for all
+    :return: Dict with key: cost centre name and value: path of its spill file, in order of first appearance in the
+             input
+    """
+
+    partition_paths = {}
+
+    for chunk_df in chunks:
+        assets = budget_report.create_asset_objects(chunk_df, collapse_duplicates=False)
+        # A Series rather than a list, which pandas would take as a list of keys, giving tuple names for a one-row chunk
+        line_cost_centres = pd.Series([asset.cost_centre for asset in assets], index=chunk_df.index)
+
+        for cost_centre_name, partition_df in chunk_df.groupby(line_cost_centres, sort=False):
+            if cost_centre_names is not None and cost_centre_name not in cost_centre_names:
+                continue
+
+            if cost_centre_name not in partition_paths:
+                # Cost centre names aren't necessarily valid file names
+                partition_paths[cost_centre_name] = os.path.join(folder_path,
+                                                                 "{number}.pkl".format(number=len(partition_paths)))
+
+            with open(partition_paths[cost_centre_name], "ab") as partition_file:
+                pickle.dump(partition_df, partition_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    return partition_paths
+
+
+def read_partition(file_path):
+    """
+    Reads back every chunk of input lines appended to a spill file by partition_by_cost_centre().
+
+    :param file_path: Path of the spill file
+    :return: DataFrame of the input lines, indexed by row number in the "User Input" sheet
+    """
+
+    partition_dfs = []
+
+    with open(file_path, "rb") as partition_file:
+        while True:
+            try:
+                partition_dfs.append(pickle.load(partition_file))
+            except EOFError:
+                break
+
+    return pd.concat(partition_dfs)
+
+
+def run_streaming(chunk_size=DEFAULT_CHUNK_SIZE, spill_folder_path=None, results_warehouse=None, input_hashes=None,
+                  notes=None, expand_lines=False, values_only=False, rollups=False, summary_only=False,
+                  cost_centre_names=None):
+    """
+    Computes and writes budget_report_output.xlsx one cost centre at a time. The output is the same as that of
+    BudgetReport.write_output_to_excel() after a regular run.
+
+    :param chunk_size: Number of input rows read at a time
+    :param spill_folder_path: Folder under which to create the temporary spill folder; defaults to the system's
+    :param results_warehouse: Optional ResultsWarehouse to record the run in; each cost centre's results are inserted
+                              as soon as it is computed, and the run is committed once the workbook is closed
+    :param input_hashes: Dict returned by budgetreport.compute_input_hashes(), if results_warehouse is given
+    :param notes: Optional free-text description of the run, if results_warehouse is given
+    :param expand_lines: See BudgetReport.expand_lines
+    :param values_only: See BudgetReport.values_only
+    :param rollups: See BudgetReport.rollups
+    :param summary_only: See BudgetReport.summary_only
+    :param cost_centre_names: Set of the only cost centres to compute and write; None for all
+    :return: run_id of the run in results_warehouse, or None if it isn't given
+    """
+
+    budget_report = BudgetReport()
+    budget_report.expand_lines = expand_lines
+    budget_report.values_only = values_only
+    budget_report.rollups = rollups
+    budget_report.summary_only = summary_only
+
+    # Read once for every cost centre, unless support hours are looked up in a reference store
+    asset_support_hours_df = read_asset_support_hours_reference() if BudgetReport.reference_store is None else None
+    service_contracts_df = read_service_contract_catalogue()
+    run_id = None
+    # Rollups of the cost centres computed so far
+    run_rollups = None
+
+    # The run and its results are committed together, or not at all if the run fails
+    transaction = results_warehouse.connection if results_warehouse is not None else contextlib.nullcontext()
+
+    with transaction, tempfile.TemporaryDirectory(dir=spill_folder_path) as folder_path:
+        if results_warehouse is not None:
+            run_id = results_warehouse.insert_run(input_hashes, notes)
+
+        partition_paths = partition_by_cost_centre(read_table_chunks(budget_report.budget_report_input_file_path,
+                                                                     "User Input",
+                                                                     chunk_size),
+                                                   budget_report,
+                                                   folder_path,
+                                                   cost_centre_names)
+
+        print("Computing cost to service and writing output to Excel...")
+
+        workbook, formats, summary_sheet = budget_report.open_output_workbook(constant_memory=True)
+
+        for cost_centre_name, partition_path in partition_paths.items():
+            partition_df = read_partition(partition_path)
+            assets = budget_report.create_asset_objects(partition_df, input_rows=partition_df.index.tolist())
+
+            budget_report.create_cost_centre_objects(assets, budget_report)
+            budget_report.compute_asset_support_hours(asset_support_hours_df)
+            budget_report.compute_service_contract_costs(service_contracts_df)
+            if summary_only:
+                cost_centre = budget_report.cost_centres.get(cost_centre_name)
+                budget_report.summary_totals.append((cost_centre_name,
+                                                     budget_report.compute_cost_centre_total(cost_centre)))
+            else:
+                budget_report.write_cost_centre_output(key=cost_centre_name, workbook=workbook, **formats)
+
+            if results_warehouse is not None or rollups:
+                results = budget_report.build_results_tables()
+                if results_warehouse is not None:
+                    results_warehouse.insert_results(run_id, *results)
+                if rollups:
+                    cost_centre_rollups = compute_rollups(*results)
+                    run_rollups = cost_centre_rollups if run_rollups is None else combine_rollups(
+                        [run_rollups, cost_centre_rollups])
+
+            # Release the cost centre, its assets, its results and its spill file before moving on to the next one
+            budget_report.cost_centres.clear()
+            os.remove(partition_path)
+
+        rollup_tables = None
+        if rollups:
+            # No input lines
+            if run_rollups is None:
+                run_rollups = compute_rollups(*budget_report.build_results_tables())
+            rollup_tables = list_rollup_tables(run_rollups)
+        budget_report.close_output_workbook(workbook, formats, summary_sheet, rollup_tables)
+
+    return run_id
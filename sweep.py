@@ -0,0 +1,317 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory
+from vectorengine import (compute_cost_centre_rates, compute_cost_centre_service_contract_costs,
+                          compute_cost_centre_support_hours, compute_cost_to_service)
+
+"""
+########################################################################################################################
+##################################### MODULE SCOPE FUNCTIONS BELOW #####################################################
+########################################################################################################################
+
+Runs assumption sweeps over many thousands of scenarios across all cores. The numeric reference arrays are copied into
+shared memory once; worker processes attach to them zero-copy instead of receiving pickled DataFrames with every task.
+
+This module deliberately imports nothing that reads workbooks at import time (budgetreport, costcentre, staff, ...), so
+spawned worker processes start quickly. Run it directly to sweep the scenarios in a CSV file:
+
+    $ python sweep.py scenarios.csv
+"""
+
+# Assumptions that can be swept and the CostCentre class constant or reference array they default to
+SWEEP_PARAMETERS = ["oh_tech_time_percentage",
+                    "productivity_rate",
+                    "benefits_multiplier",
+                    "hours_worked_per_day",
+                    "semi_prod_days_per_year",
+                    "support_hours_multiplier"]
+
+# Number of scenarios handed to a worker at a time; small enough that chunks balance across cores
+SWEEP_CHUNK_SIZE = 256
+
+# Reference arrays attached to in each worker process by attach_worker_arrays()
+worker_arrays = None
+
+# SharedMemory handles kept open for the lifetime of each worker process
+worker_shared_memory = []
+
+
+def build_scenario_grid(**parameter_values):
+    """
+    Builds the cartesian product of the given assumption values.
+
+    E.g. build_scenario_grid(productivity_rate=[0.75, 0.8], benefits_multiplier=[1.2, 1.25]) gives 4 scenarios.
+
+    :param parameter_values: Keyword arguments mapping a name in SWEEP_PARAMETERS to a list of values
+    :return: DataFrame with one row per scenario and one column per swept assumption
+    """
+
+    names = list(parameter_values.keys())
+    grid = list(itertools.product(*parameter_values.values()))
+
+    return pd.DataFrame(grid, columns=names)
+
+
+def attach_worker_arrays(specs):
+    """
+    Pool initializer; attaches the worker process to every shared memory block created by SharedReferenceArrays.
+
+    :param specs: List of (key, shared memory name, shape, dtype string) tuples
+    :return: None
+    """
+
+    global worker_arrays
+
+    worker_arrays = {}
+
+    for key, name, shape, dtype in specs:
+        block = shared_memory.SharedMemory(name=name)
+        worker_shared_memory.append(block)
+        worker_arrays[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+
+
+def evaluate_scenarios(arrays, scenarios, oh_tech_time_percentage, productivity_rate):
+    """
+    Computes cost centre rates and total cost to service for a chunk of scenarios in a single vectorized pass.
+
+    :param arrays: Dict of reference arrays (see referencearrays.build_reference_arrays())
+    :param scenarios: Dict mapping swept assumption names to 1-D arrays (one value per scenario)
+    :param oh_tech_time_percentage: Value to use if "oh_tech_time_percentage" is not swept
+    :param productivity_rate: Value to use if "productivity_rate" is not swept
+    :return: Dict of (number of scenarios, number of cost centres) arrays with keys "total_oh", "pohr",
+             "weighted_avg_tech_hourly_wage", "total_cost_to_service"
+    """
+
+    rates = compute_cost_centre_rates(arrays,
+                                      scenarios.get("oh_tech_time_percentage", oh_tech_time_percentage),
+                                      scenarios.get("productivity_rate", productivity_rate),
+                                      scenarios.get("benefits_multiplier"),
+                                      scenarios.get("hours_worked_per_day"),
+                                      scenarios.get("semi_prod_days_per_year"))
+
+    total_cost_to_service = compute_cost_to_service(rates,
+                                                    compute_cost_centre_support_hours(arrays),
+                                                    scenarios.get("support_hours_multiplier", 1.0),
+                                                    compute_cost_centre_service_contract_costs(arrays))
+
+    shape = total_cost_to_service.shape
+
+    return {"total_oh": np.broadcast_to(rates["total_oh"], shape),
+            "pohr": np.broadcast_to(rates["pohr"], shape),
+            "weighted_avg_tech_hourly_wage": np.broadcast_to(rates["weighted_avg_tech_hourly_wage"], shape),
+            "total_cost_to_service": total_cost_to_service}
+
+
+def run_scenario_chunk(task):
+    """
+    Worker entry point; evaluates one chunk of scenarios against the shared reference arrays.
+
+    :param task: Tuple (first scenario id, dict of swept assumption arrays, oh_tech_time_percentage, productivity_rate)
+    :return: Tuple (first scenario id, number of scenarios, dict of result arrays from evaluate_scenarios())
+    """
+
+    first_id, scenarios, oh_tech_time_percentage, productivity_rate = task
+    num_scenarios = len(next(iter(scenarios.values())))
+
+    results = evaluate_scenarios(worker_arrays, scenarios, oh_tech_time_percentage, productivity_rate)
+
+    # Materialize broadcast views so they pickle compactly and independently of shared memory
+    results = {key: np.ascontiguousarray(np.broadcast_to(value, (num_scenarios, value.shape[-1])))
+               for key, value in results.items()}
+
+    return first_id, num_scenarios, results
+
+
+def results_to_frame(first_id, num_scenarios, results, cost_centre_names):
+    """
+    Converts the result arrays of one chunk into long format, with one row per scenario and cost centre.
+
+    :param first_id: Scenario id of the first scenario in the chunk
+    :param num_scenarios: Number of scenarios in the chunk
+    :param results: Dict of result arrays returned by run_scenario_chunk()
+    :param cost_centre_names: 1-D array of cost centre names
+    :return: DataFrame with columns "scenario_id", "cost_centre_name" and one column per result
+    """
+
+    num_cost_centres = len(cost_centre_names)
+
+    frame = pd.DataFrame({"scenario_id": np.repeat(np.arange(first_id, first_id + num_scenarios), num_cost_centres),
+                          "cost_centre_name": np.tile(cost_centre_names, num_scenarios)})
+
+    for key, value in results.items():
+        frame[key] = value.reshape(-1)
+
+    return frame
+
+
+"""
+########################################################################################################################
+################################### SHAREDREFERENCEARRAYS CLASS BELOW ##################################################
+########################################################################################################################
+"""
+
+
+class SharedReferenceArrays:
+    """
+    Copies the numeric reference arrays into shared memory blocks owned by the parent process. Use as a context manager
+    so that the blocks are released even if the sweep fails.
+    """
+
+    def __init__(self, arrays):
+        """
+        :param arrays: Dict of reference arrays (see referencearrays.build_reference_arrays()); non-numeric arrays such
+                       as cost centre names stay in the parent process
+        """
+
+        # List of SharedMemory blocks created by this object
+        self.blocks = []
+        # List of (key, shared memory name, shape, dtype string) tuples passed to attach_worker_arrays()
+        self.specs = []
+
+        for key, array in arrays.items():
+            if array.dtype == object:
+                continue
+
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            self.blocks.append(block)
+            self.specs.append((key, block.name, array.shape, array.dtype.str))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def release(self):
+        """
+        Closes and unlinks all shared memory blocks.
+
+        :return: None
+        """
+
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+
+        self.blocks = []
+
+
+"""
+########################################################################################################################
+########################################## SWEEP EXECUTOR BELOW ########################################################
+########################################################################################################################
+"""
+
+
+def run_sweep(arrays, scenarios_df, oh_tech_time_percentage=0.35, productivity_rate=0.8, processes=None,
+              chunk_size=SWEEP_CHUNK_SIZE, output_file_path=None):
+    """
+    Evaluates every scenario in scenarios_df across all cost centres using a pool of worker processes. Chunks of
+    scenarios are handed out dynamically as workers become free, and results are streamed back and aggregated into a
+    single long format table as each chunk completes.
+
+    :param arrays: Dict of reference arrays including asset arrays (see referencearrays.build_reference_arrays())
+    :param scenarios_df: DataFrame with one row per scenario and columns from SWEEP_PARAMETERS
+    :param oh_tech_time_percentage: Value used when "oh_tech_time_percentage" is not a column of scenarios_df
+    :param productivity_rate: Value used when "productivity_rate" is not a column of scenarios_df
+    :param processes: Number of worker processes; defaults to the number of cores
+    :param chunk_size: Number of scenarios per task
+    :param output_file_path: If given, results are appended to this CSV as they arrive instead of being held in memory
+    :return: DataFrame with columns "scenario_id", "cost_centre_name", "total_oh", "pohr",
+             "weighted_avg_tech_hourly_wage", "total_cost_to_service" joined to the scenario's assumptions, or None if
+             output_file_path is given
+    """
+
+    unknown_parameters = set(scenarios_df.columns) - set(SWEEP_PARAMETERS)
+
+    if unknown_parameters:
+        raise ValueError("Unknown sweep parameters: {names}".format(names=", ".join(sorted(unknown_parameters))))
+
+    scenario_columns = {column: scenarios_df[column].to_numpy(dtype=np.float64) for column in scenarios_df.columns}
+
+    tasks = ((start,
+              {column: values[start:start + chunk_size] for column, values in scenario_columns.items()},
+              oh_tech_time_percentage,
+              productivity_rate)
+             for start in range(0, len(scenarios_df), chunk_size))
+
+    scenarios_df = scenarios_df.reset_index(drop=True).rename_axis("scenario_id").reset_index()
+
+    if output_file_path is not None and os.path.exists(output_file_path):
+        os.remove(output_file_path)
+
+    frames = []
+
+    with SharedReferenceArrays(arrays) as shared_arrays:
+        with multiprocessing.Pool(processes, initializer=attach_worker_arrays,
+                                  initargs=(shared_arrays.specs,)) as pool:
+
+            for first_id, num_scenarios, results in pool.imap_unordered(run_scenario_chunk, tasks):
+                frame = results_to_frame(first_id, num_scenarios, results, arrays["cost_centre_names"])
+                frame = frame.merge(scenarios_df, on="scenario_id", how="left")
+
+                if output_file_path is not None:
+                    frame.to_csv(output_file_path, mode="a", index=False,
+                                 header=not os.path.exists(output_file_path))
+                else:
+                    frames.append(frame)
+
+    if output_file_path is not None:
+        return None
+
+    return pd.concat(frames, ignore_index=True).sort_values(["scenario_id", "cost_centre_name"],
+                                                            ignore_index=True)
+
+
+def main():
+    """
+    Builds the reference arrays from model_inputs/ and sweeps the scenarios in a CSV file. Output is written to
+    model_outputs/sweep_results.csv.
+
+    :return: None
+    """
+
+    parser = argparse.ArgumentParser(description="Sweep cost model assumptions over many scenarios")
+    parser.add_argument("scenarios", help="CSV file with one row per scenario and columns from SWEEP_PARAMETERS")
+    parser.add_argument("--processes", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--output", default=os.path.join("model_outputs", "sweep_results.csv"))
+    parser.add_argument("--contract-date", default=None,
+                        help="Date the imaging service contracts must cover (default: today)")
+    args = parser.parse_args()
+
+    # Imported here rather than at module scope because importing these modules reads every reference workbook, which
+    # must only happen in the parent process
+    from budgetreport import BudgetReport
+    from costcentre import CostCentre
+    from referencearrays import build_reference_arrays
+
+    print("Importing data...")
+
+    BudgetReport.service_contract_date = args.contract_date
+    budget_report = BudgetReport()
+    assets = budget_report.create_asset_objects()
+    budget_report.create_cost_centre_objects(assets, budget_report)
+    budget_report.compute_asset_support_hours()
+    budget_report.compute_service_contract_costs()
+    arrays = build_reference_arrays(budget_report=budget_report)
+
+    print("Sweeping scenarios...")
+
+    run_sweep(arrays,
+              pd.read_csv(args.scenarios),
+              oh_tech_time_percentage=CostCentre.OH_TECH_TIME_PERCENTAGE,
+              productivity_rate=CostCentre.PRODUCTIVITY_RATE,
+              processes=args.processes,
+              output_file_path=args.output)
+
+    print("Sweep results written to {path}".format(path=args.output))
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,454 @@
+import numpy as np
+import pandas as pd
+from asset import function_from_shop_code
+from budgetreport import BudgetReport
+from costcentre import CostCentre
+from modelinputs import list_worksheets, read_table, resolve_table_source
+from vectorengine import TECH_LEVELS
+
+"""
+########################################################################################################################
+##################################### MODULE SCOPE FUNCTIONS BELOW #####################################################
+########################################################################################################################
+
+Validation pass over the asset input and the reference tables, run before any expensive computation. Every check is a
+set or join operation over a whole table, and every problem is reported at once with the worksheet row it is on (the
+header is row 1), instead of the first one surfacing as a crash deep in the run:
+
+    "error":   the run would crash or divide by zero, e.g. a site code missing from the "Sites" sheet, a cost centre
+               missing from the "Tech Staff" sheet or its financial report, a cost centre with no tech labour hours, or
+               a regional staff with no cost centres
+    "warning": the run would complete but a reference table is inconsistent, e.g. a cost centre in the "Sites" sheet
+               that isn't in the "Cost Centres" sheet
+
+main.py runs it before every model run; it can also be run on its own:
+
+    $ python validation.py
+"""
+
+# Path to staff_salaries.xlsx
+staff_salaries_file_path = "model_inputs/labour_reports/staff_salaries.xlsx"
+
+# Columns of the "User Input" sheet, all of which Asset requires
+INPUT_COLUMNS = ["model_num", "asset_description", "quantity", "health_auth", "site_code", "shop_code"]
+
+# Columns of the "User Input" sheet that Asset calls strip() on
+INPUT_TEXT_COLUMNS = ["asset_description", "health_auth", "site_code", "shop_code"]
+
+# Order in which Asset.assign_temp_cost_centre() tries a site's cost centres for each function; the last one is used
+# even if the site has none
+COST_CENTRE_FALLBACKS = {"clinical": ["clinical_cost_centre", "imaging_cost_centre", "renal_cost_centre"],
+                         "renal": ["renal_cost_centre", "clinical_cost_centre", "imaging_cost_centre"],
+                         "imaging": ["imaging_cost_centre", "clinical_cost_centre", "renal_cost_centre"]}
+
+# Columns of the problem report
+PROBLEM_COLUMNS = ["severity", "table", "row", "column", "value", "problem"]
+
+
+def report_problems(values, table, column, problem, severity="error"):
+    """
+    Lays out one problem found on several rows as rows of the problem report.
+
+    :param values: Series of the offending values, indexed by worksheet row number (or None for a whole-table problem)
+    :param table: Name of the table, e.g. "User Input"
+    :param column: Name of the column the values are from
+    :param problem: Description of the problem
+    :param severity: "error" or "warning"
+    :return: DataFrame with columns PROBLEM_COLUMNS
+    """
+
+    return pd.DataFrame({"severity": severity,
+                         "table": table,
+                         "row": values.index,
+                         "column": column,
+                         "value": values.to_numpy(dtype=object),
+                         "problem": problem},
+                        columns=PROBLEM_COLUMNS)
+
+
+def is_text(series):
+    """
+    :param series: Series
+    :return: Boolean Series; True where the value is a string
+    """
+
+    # Only a column of mixed types needs its values' types checked one by one
+    if isinstance(series.dtype, pd.StringDtype):
+        return series.notna()
+
+    return series.map(type) == str
+
+
+def strip_text(series):
+    """
+    Calls strip() on each distinct value of a Series of strings once, rather than on every value.
+
+    :param series: Series of strings
+    :return: Series of stripped strings
+    """
+
+    codes, uniques = pd.factorize(series)
+
+    return pd.Series(np.array([value.strip() for value in uniques], dtype=object)[codes], index=series.index,
+                     name=series.name)
+
+
+def read_sites_reference():
+    """
+    Lays out BudgetReport.sites_cost_centre_dict (from the reference workbook or a reference store) as a table.
+
+    :return: DataFrame indexed by site code with columns "clinical_cost_centre", "renal_cost_centre",
+             "imaging_cost_centre"
+    """
+
+    return pd.DataFrame.from_dict(BudgetReport.sites_cost_centre_dict,
+                                  orient="index",
+                                  columns=["clinical_cost_centre", "renal_cost_centre", "imaging_cost_centre"])
+
+
+def read_tech_staff_reference():
+    """
+    :return: The "Tech Staff" table the run will use, from a reference store if one is in use (see CostCentre)
+    """
+
+    if CostCentre.reference_store is not None:
+        return CostCentre.reference_store.read_table("tech_staff")
+
+    return CostCentre.tech_staff_df
+
+
+def resolve_cost_centres(lines_df, sites_df):
+    """
+    Resolves the cost centre of every input line at once, the same way as Asset.assign_temp_cost_centre().
+
+    :param lines_df: DataFrame laid out like the "User Input" sheet, with stripped text columns
+    :param sites_df: DataFrame returned by read_sites_reference()
+    :return: Tuple (functions, cost_centre_names) of Series indexed like lines_df; the cost centre is NaN if the site
+             code is unknown or the site has no cost centre
+    """
+
+    shop_codes = lines_df["shop_code"]
+    functions = shop_codes.map({shop_code: function_from_shop_code(shop_code) for shop_code in shop_codes.unique()})
+
+    # Each line's site's cost centres, NaN for an unknown site
+    site_cost_centres = sites_df.reindex(lines_df["site_code"].to_numpy())
+    site_cost_centres.index = lines_df.index
+
+    cost_centre_names = pd.Series(np.nan, index=lines_df.index, dtype=object)
+
+    for function, columns in COST_CENTRE_FALLBACKS.items():
+        is_function = functions == function
+        resolved = site_cost_centres.loc[is_function, columns[-1]]
+        # Work back from the last resort so that the first string found wins
+        for column in reversed(columns[:-1]):
+            candidates = site_cost_centres.loc[is_function, column]
+            resolved = candidates.where(is_text(candidates), resolved)
+        cost_centre_names[is_function] = resolved.where(is_text(resolved)).map(str.strip, na_action="ignore")
+
+    return functions, cost_centre_names
+
+
+def validate_asset_lines(lines_df, sites_df, tech_staff_names, table="User Input"):
+    """
+    Checks the input lines: required columns and values, site codes and the cost centres they resolve to.
+
+    :param lines_df: DataFrame laid out like the "User Input" sheet, indexed by worksheet row number
+    :param sites_df: DataFrame returned by read_sites_reference()
+    :param tech_staff_names: Set of cost centre names in the "Tech Staff" table
+    :param table: Name of the table, for the problem report
+    :return: Tuple (problems, cost_centres_df): DataFrame of problems, and DataFrame indexed by cost centre name with
+             columns "function", "health_auth", "row" of the first line resolved to each cost centre (the line its
+             CostCentre is created from)
+    """
+
+    problems = []
+
+    missing_columns = [column for column in INPUT_COLUMNS if column not in lines_df.columns]
+    if missing_columns:
+        problems.append(report_problems(pd.Series(missing_columns, index=[1] * len(missing_columns)), table, "",
+                                        "Column is missing"))
+        return pd.concat(problems, ignore_index=True), pd.DataFrame(columns=["function", "health_auth", "row"])
+
+    # Blank or non-text values would fail on strip() in Asset
+    is_valid = pd.Series(True, index=lines_df.index)
+    for column in INPUT_TEXT_COLUMNS:
+        is_column_text = is_text(lines_df[column])
+        problems.append(report_problems(lines_df.loc[~is_column_text, column], table, column,
+                                        "Value is blank or not text"))
+        is_valid &= is_column_text
+
+    quantities = pd.to_numeric(lines_df["quantity"], errors="coerce")
+    problems.append(report_problems(lines_df.loc[quantities.isna(), "quantity"], table, "quantity",
+                                    "Quantity is blank or not a number"))
+
+    lines_df = lines_df.loc[is_valid, ["health_auth", "site_code", "shop_code"]].apply(strip_text)
+
+    # Site codes missing from the "Sites" sheet
+    is_known_site = lines_df["site_code"].isin(sites_df.index)
+    problems.append(report_problems(lines_df.loc[~is_known_site, "site_code"], table, "site_code",
+                                    "Site code isn't in the \"Sites\" sheet"))
+    lines_df = lines_df[is_known_site]
+
+    # Resolve each distinct (site, shop code) pair once and join the result back onto the lines
+    pairs_df = lines_df[["site_code", "shop_code"]].drop_duplicates()
+    pair_functions, pair_cost_centre_names = resolve_cost_centres(pairs_df, sites_df)
+    pairs_df = pairs_df.assign(function=pair_functions, cost_centre_name=pair_cost_centre_names)
+    resolved_df = lines_df[["site_code", "shop_code"]].merge(pairs_df, on=["site_code", "shop_code"], how="left")
+    functions = resolved_df["function"].set_axis(lines_df.index)
+    cost_centre_names = resolved_df["cost_centre_name"].set_axis(lines_df.index)
+
+    problems.append(report_problems(lines_df.loc[cost_centre_names.isna(), "site_code"], table, "site_code",
+                                    "Site has no cost centre of any function in the \"Sites\" sheet"))
+
+    is_unstaffed = cost_centre_names.notna() & ~cost_centre_names.isin(tech_staff_names)
+    problems.append(report_problems(lines_df.loc[is_unstaffed, "site_code"], table, "site_code",
+                                    "Site resolves to cost centre " + cost_centre_names[is_unstaffed] +
+                                    ", which isn't in the \"Tech Staff\" sheet"))
+
+    is_resolved = cost_centre_names.notna()
+    cost_centres_df = pd.DataFrame({"cost_centre_name": cost_centre_names[is_resolved],
+                                    "function": functions[is_resolved],
+                                    "health_auth": lines_df.loc[is_resolved, "health_auth"],
+                                    "site_code": lines_df.loc[is_resolved, "site_code"],
+                                    "row": lines_df.index[is_resolved]})
+    cost_centres_df = cost_centres_df.drop_duplicates("cost_centre_name").set_index("cost_centre_name")
+
+    return pd.concat(problems, ignore_index=True), cost_centres_df
+
+
+def report_cost_centre_problems(cost_centres_df, is_problem, table, problem):
+    """
+    Reports a problem with some of the cost centres the input lines resolve to on the first line of each (the line its
+    CostCentre is created from).
+
+    :param cost_centres_df: DataFrame returned by validate_asset_lines()
+    :param is_problem: Boolean array, True for each cost centre in cost_centres_df with the problem
+    :param table: Name of the input table
+    :param problem: Description of the problem, formatted with the cost centre's "cost_centre_name", "function" and
+                    "health_auth"
+    :return: DataFrame with columns PROBLEM_COLUMNS
+    """
+
+    problem_df = cost_centres_df[np.asarray(is_problem, dtype=bool)]
+
+    return report_problems(pd.Series(problem_df["site_code"].to_numpy(), index=problem_df["row"].to_numpy()),
+                           table,
+                           "site_code",
+                           [problem.format(cost_centre_name=cost_centre_name, function=function,
+                                           health_auth=health_auth)
+                            for cost_centre_name, function, health_auth in
+                            problem_df[["function", "health_auth"]].itertuples()])
+
+
+def validate_cost_centres(cost_centres_df, tech_staff_df, table="User Input"):
+    """
+    Checks the cost centres the input lines resolve to: each needs tech labour hours, wages and vacation days for its
+    tech levels, and a partial OH history.
+
+    :param cost_centres_df: DataFrame returned by validate_asset_lines()
+    :param tech_staff_df: "Tech Staff" table
+    :param table: Name of the input table, for the problem report
+    :return: DataFrame of problems
+    """
+
+    problems = []
+
+    # Tech labour hours, as in CostCentre.compute_pohr(); cost centres missing from "Tech Staff" are reported by
+    # validate_asset_lines()
+    level_columns = ["level{level}".format(level=level) for level in TECH_LEVELS]
+    staffed_df = tech_staff_df.drop_duplicates("cost_centre_name").set_index("cost_centre_name")
+    staffed_df = staffed_df.reindex(cost_centres_df.index)[level_columns].fillna(0)
+    is_staffed = cost_centres_df.index.isin(tech_staff_df["cost_centre_name"])
+
+    vac_days = np.array([CostCentre.annual_vac_days_by_level.get(level, np.nan) for level in TECH_LEVELS],
+                        dtype=np.float64)
+    wages = np.array([CostCentre.tech_staff_salary_dict.get(level, np.nan) for level in TECH_LEVELS], dtype=np.float64)
+
+    for level, level_column, level_vac_days, level_wage in zip(TECH_LEVELS, level_columns, vac_days, wages):
+        has_level = is_staffed & (staffed_df[level_column] != 0).to_numpy()
+        if np.isnan(level_vac_days):
+            problems.append(report_cost_centre_problems(cost_centres_df, has_level, table,
+                                                        "Cost centre {cost_centre_name} has level " + str(level) +
+                                                        " techs, but \"Vacation Summary\" has no such level"))
+        if np.isnan(level_wage):
+            problems.append(report_cost_centre_problems(cost_centres_df, has_level, table,
+                                                        "Cost centre {cost_centre_name} has level " + str(level) +
+                                                        " techs, but \"Tech Staff Salary Sched\" has no such level"))
+
+    annual_labour_hours = staffed_df.to_numpy(dtype=np.float64) @ (
+        float(CostCentre.semi_prod_days_per_year) - np.nan_to_num(vac_days)) * float(CostCentre.hours_worked_per_day)
+    problems.append(report_cost_centre_problems(cost_centres_df, is_staffed & (annual_labour_hours <= 0), table,
+                                                "Cost centre {cost_centre_name} has no tech labour hours in the \"Tech "
+                                                "Staff\" sheet"))
+
+    # Partial OH history, from wherever CostCentre.compute_non_labour_oh() will read it
+    if CostCentre.partial_oh_history is not None:
+        has_history = cost_centres_df.index.isin(CostCentre.partial_oh_history["cost_centre_name"])
+        problem = "Cost centre {cost_centre_name} has no partial OH history in the general ledger"
+    elif CostCentre.reference_store is not None:
+        has_history = cost_centres_df.index.isin(
+            CostCentre.reference_store.read_table("partial_oh_history")["cost_centre_name"])
+        problem = "Cost centre {cost_centre_name} has no partial OH history in the reference store"
+    else:
+        has_history = np.zeros(len(cost_centres_df), dtype=bool)
+        for position, (cost_centre_name, function, health_auth) in enumerate(
+                cost_centres_df[["function", "health_auth"]].itertuples()):
+            file_path = CostCentre.financial_reports_folder_path + "{function}/{health_auth}.xlsx".format(
+                function=function, health_auth=health_auth)
+            has_history[position] = (resolve_table_source(file_path, cost_centre_name) != file_path or
+                                     cost_centre_name in list_worksheets(file_path))
+        # The financial report is chosen by the function and HA of the cost centre's first line
+        problem = ("Cost centre {cost_centre_name} has no worksheet in financial_reports/{function}/{health_auth}.xlsx "
+                   "(the function and HA of its first line)")
+
+    problems.append(report_cost_centre_problems(cost_centres_df, ~has_history, table, problem))
+
+    return pd.concat(problems, ignore_index=True)
+
+
+def validate_regional_staff(regional_staff_df, cc_responsibility_dict, table="Regional Staff"):
+    """
+    Checks that every regional staff's responsibilities name known health authorities and cover at least one cost
+    centre, as RegionalStaff splits their compensation evenly across them.
+
+    :param regional_staff_df: "Regional Staff" table, indexed by worksheet row number
+    :param cc_responsibility_dict: See BudgetReport.cost_centre_responsibility_dict
+    :param table: Name of the table, for the problem report
+    :return: DataFrame of problems
+    """
+
+    problems = []
+
+    for column in ["min_salary", "max_salary"]:
+        salaries = pd.to_numeric(regional_staff_df[column], errors="coerce")
+        problems.append(report_problems(regional_staff_df.loc[salaries.isna(), column], table, column,
+                                        "Salary is blank or not a number"))
+
+    duplicated = regional_staff_df["name"].duplicated()
+    problems.append(report_problems(regional_staff_df.loc[duplicated, "name"], table, "name",
+                                    "Name appears more than once; only one of the rows is used", "warning"))
+
+    # One row per (staff, health authority, function they oversee there)
+    num_cost_centres = pd.Series(0, index=regional_staff_df.index)
+    responsibility_functions = {"clinical_renal_responsibility": ["clinical", "renal"],
+                                "imaging_responsibility": ["imaging"]}
+
+    for column, functions in responsibility_functions.items():
+        health_auths = regional_staff_df[column].where(is_text(regional_staff_df[column])).map(
+            lambda health_auths: health_auths.split(", "), na_action="ignore").explode().dropna()
+
+        is_known = health_auths.isin(cc_responsibility_dict.keys())
+        problems.append(report_problems(health_auths[~is_known], table, column,
+                                        "Health authority isn't in the \"Cost Centres\" sheet"))
+
+        counts = health_auths[is_known].map({health_auth: sum(len(cc_responsibility_dict[health_auth].get(function, []))
+                                                              for function in functions)
+                                             for health_auth in cc_responsibility_dict})
+        num_cost_centres = num_cost_centres.add(counts.groupby(level=0).sum(), fill_value=0)
+
+    problems.append(report_problems(regional_staff_df.loc[num_cost_centres == 0, "name"], table, "name",
+                                    "Staff has no cost centre responsibilities to split their compensation across"))
+
+    return pd.concat(problems, ignore_index=True)
+
+
+def validate_reference_tables(sites_df, tech_staff_df, cc_responsibility_dict):
+    """
+    Checks that the cost centres named in the "Sites" and "Tech Staff" sheets are in the "Cost Centres" sheet.
+
+    :param sites_df: DataFrame returned by read_sites_reference()
+    :param tech_staff_df: "Tech Staff" table
+    :param cc_responsibility_dict: See BudgetReport.cost_centre_responsibility_dict
+    :return: DataFrame of warnings
+    """
+
+    problems = []
+    cost_centre_names = {name for functions in cc_responsibility_dict.values() for names in functions.values()
+                         for name in names}
+
+    # The "Sites" sheet is read into a dict, so its row numbers follow its order
+    sites_df = sites_df.set_index(pd.RangeIndex(2, len(sites_df) + 2))
+    for column in sites_df.columns:
+        names = sites_df[column].where(is_text(sites_df[column])).map(str.strip, na_action="ignore").dropna()
+        problems.append(report_problems(names[~names.isin(cost_centre_names)], "Sites", column,
+                                        "Cost centre isn't in the \"Cost Centres\" sheet", "warning"))
+
+    tech_staff_names = tech_staff_df["cost_centre_name"].set_axis(pd.RangeIndex(2, len(tech_staff_df) + 2))
+    problems.append(report_problems(tech_staff_names[~tech_staff_names.isin(cost_centre_names)], "Tech Staff",
+                                    "cost_centre_name", "Cost centre isn't in the \"Cost Centres\" sheet", "warning"))
+    problems.append(report_problems(tech_staff_names[tech_staff_names.duplicated()], "Tech Staff", "cost_centre_name",
+                                    "Cost centre appears more than once; only its first row is used", "warning"))
+
+    return pd.concat(problems, ignore_index=True)
+
+
+def validate_inputs(chunks=None):
+    """
+    Runs every check over the asset input and the reference tables the run will use.
+
+    :param chunks: Optional iterable of DataFrames laid out like the "User Input" sheet and indexed by worksheet row
+                   number (see modelinputs.read_table_chunks()); defaults to the whole "User Input" sheet
+    :return: DataFrame with columns PROBLEM_COLUMNS, ordered by severity, table and row; empty if there are no problems
+    """
+
+    if chunks is None:
+        input_df = read_table(BudgetReport.budget_report_input_file_path, sheet_name="User Input")
+        chunks = [input_df.set_axis(pd.RangeIndex(2, len(input_df) + 2))]
+
+    sites_df = read_sites_reference()
+    tech_staff_df = read_tech_staff_reference()
+    tech_staff_names = set(tech_staff_df["cost_centre_name"])
+
+    problems = []
+    cost_centres_dfs = []
+
+    for chunk_df in chunks:
+        chunk_problems, chunk_cost_centres_df = validate_asset_lines(chunk_df, sites_df, tech_staff_names)
+        problems.append(chunk_problems)
+        cost_centres_dfs.append(chunk_cost_centres_df)
+
+    # First line of each cost centre over all chunks
+    cost_centres_df = pd.concat(cost_centres_dfs)
+    cost_centres_df = cost_centres_df[~cost_centres_df.index.duplicated()]
+
+    regional_staff_df = read_table(staff_salaries_file_path, sheet_name="Regional Staff")
+    regional_staff_df = regional_staff_df.set_axis(pd.RangeIndex(2, len(regional_staff_df) + 2))
+
+    problems.append(validate_cost_centres(cost_centres_df, tech_staff_df))
+    problems.append(validate_regional_staff(regional_staff_df, BudgetReport.cost_centre_responsibility_dict))
+    problems.append(validate_reference_tables(sites_df, tech_staff_df, BudgetReport.cost_centre_responsibility_dict))
+
+    problems_df = pd.concat([pd.DataFrame(columns=PROBLEM_COLUMNS)] +
+                            [problems_df for problems_df in problems if not problems_df.empty], ignore_index=True)
+    problems_df["severity"] = pd.Categorical(problems_df["severity"], ["error", "warning"])
+
+    return problems_df.sort_values(["severity", "table", "row"], kind="stable").reset_index(drop=True)
+
+
+def format_problems(problems_df):
+    """
+    :param problems_df: DataFrame returned by validate_inputs()
+    :return: Printable report with one line per problem and a count of errors and warnings
+    """
+
+    lines = ["{severity}: {table} row {row}, {column}={value!r}: {problem}".format(**problem)
+             for problem in problems_df.to_dict("records")]
+    lines.append("{errors} error(s), {warnings} warning(s)".format(
+        errors=(problems_df["severity"] == "error").sum(), warnings=(problems_df["severity"] == "warning").sum()))
+
+    return "\n".join(lines)
+
+
+def main():
+    """
+    Validates the model inputs and prints every problem found.
+
+    :return: None
+    """
+
+    print(format_problems(validate_inputs()))
+
+
+if __name__ == "__main__":
+
+    main()
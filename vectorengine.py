@@ -0,0 +1,146 @@
+import numpy as np
+
+"""
+########################################################################################################################
+##################################### MODULE SCOPE FUNCTIONS BELOW #####################################################
+########################################################################################################################
+
+Array-based equivalents of the CostCentre computations. Every function here works on plain NumPy arrays (see
+referencearrays.build_reference_arrays() for how they are produced) and does not read any workbook, so the module is
+cheap to import in worker processes.
+
+Cost centre arrays are indexed by cost centre position; tech level arrays are ordered as TECH_LEVELS. Any assumption
+passed as a 1-D array of length k (one value per scenario) is broadcast against the cost centres, giving results of
+shape (k, number of cost centres). "level_qty" may likewise be given per scenario, with shape (k, number of cost centres,
+4), e.g. to evaluate a staffing plan (see capacityplanner).
+"""
+
+# Tech staff levels, in the column order of the "Tech Staff" sheet in staff_salaries.xlsx
+TECH_LEVELS = [8, 9, 10, 12]
+
+
+def as_scenario_column(value):
+    """
+    Converts an assumption into a float array that broadcasts against per-cost centre arrays.
+
+    :param value: Scalar, or 1-D array with one value per scenario
+    :return: 0-D array for a scalar, or (k, 1) array for k scenarios
+    """
+
+    value = np.asarray(value, dtype=np.float64)
+
+    if value.ndim == 1:
+        return value[:, np.newaxis]
+
+    return value
+
+
+def compute_cost_centre_rates(arrays, oh_tech_time_percentage, productivity_rate, benefits_multiplier=None,
+                              hours_worked_per_day=None, semi_prod_days_per_year=None):
+    """
+    Computes OH components, POHR and weighted average tech hourly wage for all cost centres at once. Mirrors
+    CostCentre.compute_tech_staff_oh(), compute_regional_staff_oh(), compute_pohr() and
+    compute_weighted_avg_tech_hourly_wage().
+
+    :param arrays: Dict of reference arrays (see referencearrays.build_reference_arrays())
+    :param oh_tech_time_percentage: % of tech time spent on non-device related work
+    :param productivity_rate: % of annual labour hours that techs are productive
+    :param benefits_multiplier: Multiplier applied to salaries to get total compensation; defaults to the reference value
+    :param hours_worked_per_day: Average hours a tech works in a day; defaults to the reference value
+    :param semi_prod_days_per_year: Days in a year less weekends, stats and sick days; defaults to the reference value
+    :return: Dict with keys "non_labour_oh", "tech_staff_oh", "regional_staff_oh", "total_oh", "annual_labour_hours",
+             "pohr", "weighted_avg_tech_hourly_wage"
+    """
+
+    if benefits_multiplier is None:
+        benefits_multiplier = arrays["benefits_multiplier"]
+    if hours_worked_per_day is None:
+        hours_worked_per_day = arrays["hours_worked_per_day"]
+    if semi_prod_days_per_year is None:
+        semi_prod_days_per_year = arrays["semi_prod_days_per_year"]
+
+    oh_tech_time_percentage = as_scenario_column(oh_tech_time_percentage)
+    productivity_rate = as_scenario_column(productivity_rate)
+    benefits_multiplier = as_scenario_column(benefits_multiplier)
+    hours_worked_per_day = as_scenario_column(hours_worked_per_day)
+    semi_prod_days_per_year = as_scenario_column(semi_prod_days_per_year)
+
+    level_qty = arrays["level_qty"]
+    level_wage = arrays["level_wage"]
+
+    # Tech labour OH = % non-device time * total compensation of all techs at the cost centre
+    annual_tech_salary = level_qty @ (level_wage * arrays["hours_paid_per_year"])
+    tech_staff_oh = oh_tech_time_percentage * benefits_multiplier * annual_tech_salary
+
+    # Regional staff OH = each overseeing staff's total compensation split evenly across their cost centres
+    regional_staff_oh = benefits_multiplier * arrays["regional_salary_share"]
+
+    non_labour_oh = arrays["non_labour_oh"]
+    total_oh = non_labour_oh + regional_staff_oh + tech_staff_oh
+
+    # Annual labour hours = sum over levels of qty * (semi-productive days - vacation days) * hours per day
+    total_num_staff = level_qty.sum(axis=-1)
+    annual_labour_hours = hours_worked_per_day * (semi_prod_days_per_year * total_num_staff -
+                                                  level_qty @ arrays["level_vac_days"])
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pohr = total_oh / (productivity_rate * annual_labour_hours)
+        weighted_avg_tech_hourly_wage = np.where(total_num_staff > 0,
+                                                 (level_qty @ level_wage) / total_num_staff,
+                                                 0.0)
+
+    return {"non_labour_oh": np.broadcast_to(non_labour_oh, pohr.shape),
+            "tech_staff_oh": np.broadcast_to(tech_staff_oh, pohr.shape),
+            "regional_staff_oh": np.broadcast_to(regional_staff_oh, pohr.shape),
+            "total_oh": total_oh,
+            "annual_labour_hours": np.broadcast_to(annual_labour_hours, pohr.shape),
+            "pohr": pohr,
+            "weighted_avg_tech_hourly_wage": np.broadcast_to(weighted_avg_tech_hourly_wage, pohr.shape)}
+
+
+def compute_cost_centre_support_hours(arrays):
+    """
+    Sums qty * annual support hours of the assets in each cost centre.
+
+    :param arrays: Dict of reference arrays including the asset arrays "asset_cc_index", "asset_qty" and
+                   "asset_support_hours"
+    :return: 1-D array of total annual support hours per cost centre
+    """
+
+    return np.bincount(arrays["asset_cc_index"],
+                       weights=arrays["asset_qty"] * arrays["asset_support_hours"],
+                       minlength=len(arrays["non_labour_oh"]))
+
+
+def compute_cost_centre_service_contract_costs(arrays):
+    """
+    Sums qty * annual service contract cost of the assets in each cost centre.
+
+    :param arrays: Dict of reference arrays including the asset arrays "asset_cc_index" and "asset_qty", and optionally
+                   "asset_service_contract_cost"
+    :return: 1-D array of total annual service contract costs per cost centre; 0 without "asset_service_contract_cost"
+    """
+
+    if "asset_service_contract_cost" not in arrays:
+        return np.zeros(len(arrays["non_labour_oh"]))
+
+    return np.bincount(arrays["asset_cc_index"],
+                       weights=arrays["asset_qty"] * arrays["asset_service_contract_cost"],
+                       minlength=len(arrays["non_labour_oh"]))
+
+
+def compute_cost_to_service(rates, cc_support_hours, support_hours_multiplier=1.0, cc_service_contract_costs=0.0):
+    """
+    Computes the total annual cost to service the assets in each cost centre:
+        (POHR + Tech $/hr) * total support hours + total service contract costs
+
+    :param rates: Dict returned by compute_cost_centre_rates()
+    :param cc_support_hours: 1-D array returned by compute_cost_centre_support_hours()
+    :param support_hours_multiplier: Scales the support hours (e.g. to model a heavier or lighter workload)
+    :param cc_service_contract_costs: 1-D array returned by compute_cost_centre_service_contract_costs()
+    :return: Array of the same shape as rates["pohr"]
+    """
+
+    support_hours = as_scenario_column(support_hours_multiplier) * cc_support_hours
+
+    return (rates["pohr"] + rates["weighted_avg_tech_hourly_wage"]) * support_hours + cc_service_contract_costs